@@ -0,0 +1,90 @@
+"""
+Benchmark de recall frente a latencia de los tipos de índice FAISS sobre los chunks reales.
+
+Toma los vectores del índice plano de la ingesta (flat.faiss, o index.faiss en instalaciones antiguas),
+genera consultas a partir de chunks aleatorios con ruido gaussiano y compara cada configuración con
+la búsqueda exacta:
+    - recall@k frente al índice plano
+    - latencia por consulta (una consulta cada vez, como en el servidor) p50/p99
+    - tiempo de construcción y tamaño serializado
+
+Uso (desde la raíz del proyecto):
+    python benchmarks/bench_faiss_index.py --queries 500 --k 4
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import faiss
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.directories import DB_DIR
+from src.vector_index import SOURCE_INDEX_NAME, SERVING_INDEX_NAME, build_faiss_index, set_search_params
+
+
+def load_vectors(db_dir: str) -> np.ndarray:
+    for name in (SOURCE_INDEX_NAME, SERVING_INDEX_NAME):
+        path = os.path.join(db_dir, f"{name}.faiss")
+        if os.path.exists(path):
+            index = faiss.read_index(path)
+            return index.reconstruct_n(0, index.ntotal)
+    raise FileNotFoundError(f"No FAISS index found in {db_dir}")
+
+
+def measure(index, queries: np.ndarray, truth: np.ndarray, k: int):
+    latencies = []
+    hits = 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        _, found = index.search(query[None, :], k)
+        latencies.append(time.perf_counter() - start)
+        hits += len(set(found[0]) & set(expected))
+    latencies.sort()
+    return hits / truth.size, 1000 * latencies[len(latencies) // 2], 1000 * latencies[int(0.99 * (len(latencies) - 1))]
+
+
+def main(args):
+    vectors = load_vectors(args.db_dir)
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)
+    queries = vectors[sample] + rng.normal(0, args.noise, size=(len(sample), vectors.shape[1])).astype(np.float32)
+    print(f"Chunks: {len(vectors)} | dimensión: {vectors.shape[1]} | consultas: {len(queries)} | k: {args.k}")
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, args.k)
+
+    configs = [("flat", {}, [None])]
+    configs += [("ivf", {"nlist": args.nlist}, [("nprobe", n) for n in (1, 4, 16, 64)])]
+    configs += [("hnsw", {"hnsw_m": args.hnsw_m}, [("ef_search", e) for e in (16, 32, 64, 128)])]
+    configs += [("ivfpq", {"nlist": args.nlist, "pq_m": args.pq_m}, [("nprobe", n) for n in (1, 4, 16, 64)])]
+
+    print(f"{'índice':<8} {'parámetro':<14} {'recall':>7} {'p50 ms':>8} {'p99 ms':>8} {'build s':>8} {'MB':>7}")
+    for index_type, build_params, search_params in configs:
+        start = time.perf_counter()
+        try:
+            index = build_faiss_index(vectors, index_type, **build_params)
+        except ValueError as e:
+            print(f"{index_type:<8} skipped: {e}")
+            continue
+        build_seconds = time.perf_counter() - start
+        size_mb = faiss.serialize_index(index).nbytes / 1e6
+        for param in search_params:
+            label = "-"
+            if param is not None:
+                set_search_params(index, **{param[0]: param[1]})
+                label = f"{param[0]}={param[1]}"
+            recall, p50, p99 = measure(index, queries, truth, args.k)
+            print(f"{index_type:<8} {label:<14} {recall:>7.3f} {p50:>8.3f} {p99:>8.3f} {build_seconds:>8.2f} {size_mb:>7.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db-dir", default=DB_DIR)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--noise", type=float, default=0.01, help="Desviación del ruido añadido a los chunks de consulta")
+    parser.add_argument("--nlist", type=int, default=256)
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--pq-m", type=int, default=16)
+    main(parser.parse_args())
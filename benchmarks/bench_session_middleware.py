@@ -0,0 +1,153 @@
+"""
+Benchmark del middleware de sesión: BaseHTTPMiddleware (versión anterior) frente al middleware ASGI puro.
+
+Mide, sin red ni MongoDB (backend en memoria):
+    - Peticiones/s en "/" (ruta sin sesión) y en "/chat" (ruta con sesión y StreamingResponse).
+    - Latencia hasta el primer chunk y hasta el final del stream de "/chat".
+
+Uso (desde la raíz del proyecto):
+    python benchmarks/bench_session_middleware.py --requests 2000 --chunks 50
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+from datetime import datetime, timedelta, timezone
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from starlette.applications import Starlette
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+from session_manager import SessionData, SessionMiddleware
+
+
+SESSION_ID = "00000000-0000-0000-0000-000000000001"
+
+
+# Backend en memoria para aislar el coste del middleware
+class InMemoryBackend:
+    def __init__(self):
+        now = datetime.now(timezone.utc)
+        self.session = SessionData(session_id=SESSION_ID, history=[], qa_data={}, last_active=now, expiration_time=now + timedelta(hours=1))
+
+    async def read(self, session_id, history_limit=None):
+        return self.session
+
+    async def delete(self, session_id):
+        pass
+
+
+class InMemoryCookieBackend:
+    def delete(self, response):
+        response.delete_cookie("session_id")
+
+
+# Versión anterior del middleware (BaseHTTPMiddleware), conservada aquí sólo para comparar
+class LegacySessionMiddleware(BaseHTTPMiddleware):
+    def __init__(self, app, mongo_backend, cookie_backend, session_timeout, history_limit=None):
+        super().__init__(app)
+        self.mongo_backend = mongo_backend
+        self.cookie_backend = cookie_backend
+        self.history_limit = history_limit
+
+    async def dispatch(self, request, call_next):
+        request.state.session = None
+        session_required_paths = ["/chat", "/end_session", "/update_session"]
+        if not any(request.url.path.startswith(path) for path in session_required_paths):
+            return await call_next(request)
+        session_id = request.cookies.get("session_id")
+        if not session_id:
+            return Response("Session not found", status_code=401)
+        session = await self.mongo_backend.read(session_id, history_limit=self.history_limit)
+        if not session:
+            return Response("Session not found", status_code=404)
+        request.state.session = session
+        return await call_next(request)
+
+
+def build_app(middleware_class, chunks: int) -> Starlette:
+    async def root(request):
+        return PlainTextResponse("ok")
+
+    async def chat(request):
+        assert request.state.session is not None
+        async def stream():
+            for i in range(chunks):
+                yield f"token{i} "
+        return StreamingResponse(stream(), media_type="text/plain")
+
+    app = Starlette(routes=[Route("/", root), Route("/chat", chat, methods=["POST"])])
+    app.add_middleware(middleware_class, mongo_backend=InMemoryBackend(), cookie_backend=InMemoryCookieBackend(), session_timeout=timedelta(hours=1), history_limit=4)
+    return app
+
+
+# Ejecuta una petición ASGI y devuelve (segundos hasta el primer chunk del cuerpo, segundos totales)
+async def call(app, method: str, path: str):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method, "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"cookie", f"session_id={SESSION_ID}".encode()), (b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 1234), "server": ("127.0.0.1", 8000),
+    }
+    sent_body = False
+    disconnect = asyncio.Event()
+
+    async def receive():
+        nonlocal sent_body
+        if not sent_body:
+            sent_body = True
+            return {"type": "http.request", "body": b'{"user_input": "hola"}', "more_body": False}
+        await disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    start = time.perf_counter()
+    first_chunk = None
+
+    async def send(message):
+        nonlocal first_chunk
+        if message["type"] == "http.response.body" and message.get("body") and first_chunk is None:
+            first_chunk = time.perf_counter() - start
+
+    await app(scope, receive, send)
+    disconnect.set()
+    return first_chunk, time.perf_counter() - start
+
+
+async def run_case(app, method: str, path: str, requests: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    samples = []
+
+    async def one():
+        async with semaphore:
+            samples.append(await call(app, method, path))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    first = sorted(s[0] for s in samples if s[0] is not None)
+    total = sorted(s[1] for s in samples)
+    return {
+        "req/s": requests / elapsed,
+        "first_chunk_p50_ms": 1000 * statistics.median(first),
+        "first_chunk_p99_ms": 1000 * first[int(0.99 * (len(first) - 1))],
+        "total_p50_ms": 1000 * statistics.median(total),
+    }
+
+
+async def main(args):
+    for name, middleware_class in (("BaseHTTPMiddleware", LegacySessionMiddleware), ("ASGI", SessionMiddleware)):
+        app = build_app(middleware_class, args.chunks)
+        for method, path in (("GET", "/"), ("POST", "/chat")):
+            await run_case(app, method, path, min(200, args.requests), args.concurrency) # calentamiento
+            result = await run_case(app, method, path, args.requests, args.concurrency)
+            print(f"{name:<20} {method:<5} {path:<6} " + "  ".join(f"{key}={value:.2f}" for key, value in result.items()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--chunks", type=int, default=50, help="Chunks del StreamingResponse de /chat")
+    asyncio.run(main(parser.parse_args()))
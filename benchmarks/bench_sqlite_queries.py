@@ -0,0 +1,116 @@
+"""
+Benchmark de las consultas SQL representativas del text2sql y del SQLBuilder sobre la base de datos generada.
+
+Para cada tipo de consulta muestra el plan (SEARCH usa un índice, SCAN recorre la tabla) y la latencia p50/p99
+con una conexión como la del servidor (solo lectura, immutable, mmap). Con --baseline se compara con otra base de
+datos, p.ej. una generada con la versión anterior de generate_sql_dabase.py (df.to_sql sin índices).
+    - igualdad sobre tipo, operacion y poblacion
+    - igualdad + rango de precio / habitaciones
+    - LIKE sobre poblacion
+    - texto libre (FTS5 si existe la tabla <tabla>_fts, LIKE si no)
+    - agregación por poblacion
+
+Uso (desde la raíz del proyecto):
+    python benchmarks/bench_sqlite_queries.py --repeat 200 --baseline /ruta/base_anterior.db
+"""
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+from pathlib import Path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.directories import DB_DIR, db_name
+
+
+def connect(path: str, mmap_size: int) -> sqlite3.Connection:
+    conn = sqlite3.connect(f"{Path(path).resolve().as_uri()}?mode=ro&immutable=1", uri=True)
+    conn.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+    return conn
+
+
+def columns_of(conn, table):
+    return {row[1]: (row[2] or "").upper() for row in conn.execute(f'PRAGMA table_info("{table}")')}
+
+
+def build_queries(conn, table, samples, seed=0):
+    """
+    Devuelve [(nombre, sql, parámetros)] con valores reales de la tabla.
+    """
+    rng = random.Random(seed)
+    columns = columns_of(conn, table)
+    filters = [column for column in ("tipo", "operacion", "poblacion") if column in columns]
+    if not filters:
+        raise ValueError(f"Table {table} has none of the filter columns tipo/operacion/poblacion")
+    selected = ", ".join(f'"{column}"' for column in filters)
+    combos = conn.execute(f'SELECT DISTINCT {selected} FROM "{table}"').fetchall()
+    combos = rng.sample(combos, min(samples, len(combos)))
+    equality = " AND ".join(f'"{column}" = ?' for column in filters)
+
+    queries = []
+    for combo in combos:
+        combo = list(combo)
+        queries.append(("igualdad", f'SELECT * FROM "{table}" WHERE {equality} LIMIT 3', combo))
+        if "precio" in columns:
+            queries.append(("igualdad+precio", f'SELECT * FROM "{table}" WHERE {equality} AND "precio" <= ? LIMIT 3', combo + [250000]))
+        if "habitaciones" in columns:
+            queries.append(("igualdad+habitaciones", f'SELECT * FROM "{table}" WHERE {equality} AND "habitaciones" >= ? LIMIT 3', combo + [2]))
+        if "poblacion" in columns:
+            town = combo[filters.index("poblacion")]
+            queries.append(("like poblacion", f'SELECT * FROM "{table}" WHERE "poblacion" LIKE ? LIMIT 3', [f"{str(town)[:4]}%"]))
+
+    text_columns = [column for column, column_type in columns.items() if column_type.startswith("TEXT") and column not in filters]
+    has_fts = conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (f"{table}_fts",)).fetchone() is not None
+    for word in ("terraza", "piscina", "garaje", "reformado"):
+        if has_fts:
+            queries.append(("texto libre", f'SELECT "{table}".* FROM "{table}_fts" JOIN "{table}" ON "{table}".rowid = "{table}_fts".rowid WHERE "{table}_fts" MATCH ? LIMIT 3', [word]))
+        elif text_columns:
+            queries.append(("texto libre", f'SELECT * FROM "{table}" WHERE "{text_columns[0]}" LIKE ? LIMIT 3', [f"%{word}%"]))
+    if "poblacion" in columns:
+        queries.append(("agregación", f'SELECT "poblacion", COUNT(*) FROM "{table}" GROUP BY "poblacion"', []))
+    return queries
+
+
+def plan(conn, sql, parameters):
+    details = [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", parameters)]
+    return "; ".join(details)
+
+
+def run(path, table, samples, repeat, mmap_size):
+    conn = connect(path, mmap_size)
+    queries = build_queries(conn, table, samples)
+    results = {}
+    plans = {}
+    for name, sql, parameters in queries:
+        plans.setdefault(name, plan(conn, sql, parameters))
+        latencies = results.setdefault(name, [])
+        for _ in range(repeat):
+            start = time.perf_counter()
+            conn.execute(sql, parameters).fetchall()
+            latencies.append(time.perf_counter() - start)
+    conn.close()
+
+    print(f"\n{path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+    print(f"{'consulta':<24} {'p50 ms':>8} {'p99 ms':>8}  plan")
+    for name, latencies in results.items():
+        latencies.sort()
+        p50 = 1000 * latencies[len(latencies) // 2]
+        p99 = 1000 * latencies[int(0.99 * (len(latencies) - 1))]
+        print(f"{name:<24} {p50:>8.3f} {p99:>8.3f}  {plans[name]}")
+
+
+def main(args):
+    for path in filter(None, (args.db, args.baseline)):
+        run(path, args.table, args.samples, args.repeat, args.mmap_size)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", default=os.path.join(DB_DIR, f"{db_name}.db"))
+    parser.add_argument("--baseline", default=None, help="Base de datos con la que comparar")
+    parser.add_argument("--table", default=db_name)
+    parser.add_argument("--samples", type=int, default=20, help="Combinaciones de tipo/operacion/poblacion consultadas")
+    parser.add_argument("--repeat", type=int, default=50, help="Ejecuciones de cada consulta")
+    parser.add_argument("--mmap-size", type=int, default=256 * 1024 * 1024)
+    main(parser.parse_args())
@@ -0,0 +1,82 @@
+"""
+Artefactos sintéticos para las pruebas de carga, con el mismo formato que los generados por src/config:
+    - <db_name>.db: tabla de inmuebles con índices, FTS5 sobre la descripción y su esquema precalculado (.schema.json).
+    - index.faiss / index.pkl: índice FAISS plano de chunks de texto con los embeddings del servidor simulado.
+    - bm25.pkl: índice BM25 de los mismos chunks.
+"""
+import os
+import sys
+import pickle
+import random
+import sqlite3
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from langchain_community.docstore.in_memory import InMemoryDocstore
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from src.directories import db_name
+from src.schema_catalog import build_schema_catalog, save_schema_catalog, schema_path
+from src.bm25_index import BM25Index
+from src.vector_index import SERVING_INDEX_NAME
+from mock_openai import fake_embedding
+
+TIPOS = ["piso", "casa", "chalet", "ático", "apartamento", "dúplex", "estudio", "local"]
+OPERACIONES = ["venta", "alquiler"]
+POBLACIONES = ["Madrid", "Valencia", "Sevilla", "Málaga", "Alicante", "Zaragoza", "Murcia", "Bilbao", "Granada", "Córdoba"]
+EXTRAS = ["terraza", "piscina", "garaje", "trastero", "ascensor", "jardín", "aire acondicionado", "reformado"]
+
+TOPICS = ["fianza", "contrato de alquiler", "comisión de la agencia", "documentación necesaria", "hipoteca", "seguro de impago",
+          "tasación", "horario de las oficinas", "visitas", "reserva del inmueble", "impuestos de la compraventa", "gastos de comunidad"]
+
+
+def build_database(directory: str, rows: int, rng: random.Random) -> str:
+    path = os.path.join(directory, f"{db_name}.db")
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.execute(f'''CREATE TABLE "{db_name}" (
+        "referencia" TEXT, "tipo" TEXT COLLATE NOCASE, "operacion" TEXT COLLATE NOCASE, "poblacion" TEXT COLLATE NOCASE,
+        "precio" REAL, "habitaciones" INTEGER, "banos" INTEGER, "superficie" REAL, "descripcion" TEXT)''')
+    data = []
+    for i in range(rows):
+        tipo, operacion, poblacion = rng.choice(TIPOS), rng.choice(OPERACIONES), rng.choice(POBLACIONES)
+        surface = rng.randint(35, 300)
+        price = surface * rng.randint(1500, 4500) if operacion == "venta" else surface * rng.randint(8, 20)
+        extras = ", ".join(rng.sample(EXTRAS, 3))
+        description = f"{tipo.capitalize()} en {operacion} en {poblacion} de {surface} m2 con {extras}, cerca de transporte público y servicios."
+        data.append((f"REF{i:06d}", tipo, operacion, poblacion, float(price), rng.randint(1, 5), rng.randint(1, 3), float(surface), description))
+    conn.executemany(f'INSERT INTO "{db_name}" VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', data)
+    conn.execute(f'CREATE INDEX "idx_{db_name}_filtros" ON "{db_name}" ("tipo", "operacion", "poblacion")')
+    conn.execute(f'CREATE INDEX "idx_{db_name}_precio" ON "{db_name}" ("precio")')
+    conn.execute(f'CREATE VIRTUAL TABLE "{db_name}_fts" USING fts5("descripcion", content="{db_name}", content_rowid="rowid")')
+    conn.execute(f'INSERT INTO "{db_name}_fts"("{db_name}_fts") VALUES (\'rebuild\')')
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+    save_schema_catalog(build_schema_catalog(path), schema_path(path))
+    return path
+
+
+def build_vector_store(directory: str, chunks: int, embedding_dim: int, rng: random.Random):
+    texts = []
+    for i in range(chunks):
+        topic = rng.choice(TOPICS)
+        texts.append(f"Sobre {topic}: la agencia informa a sus clientes de las condiciones de {topic} en {rng.choice(POBLACIONES)}. "
+                     f"Para más información sobre {topic} puede contactar con la oficina (referencia {i}).")
+    vectors = np.stack([fake_embedding(text, embedding_dim) for text in texts])
+    index = faiss.IndexFlatL2(embedding_dim)
+    index.add(vectors)
+    doc_ids = [str(i) for i in range(chunks)]
+    docstore = InMemoryDocstore({doc_id: Document(page_content=text, metadata={"source": "fixture.pdf", "page": i, "start_index": 0})
+                                 for i, (doc_id, text) in enumerate(zip(doc_ids, texts))})
+    faiss.write_index(index, os.path.join(directory, f"{SERVING_INDEX_NAME}.faiss"))
+    with open(os.path.join(directory, f"{SERVING_INDEX_NAME}.pkl"), "wb") as f:
+        pickle.dump((docstore, dict(enumerate(doc_ids))), f)
+    BM25Index.build(doc_ids, texts).save(os.path.join(directory, "bm25.pkl"))
+
+
+def build_fixtures(directory: str, rows: int = 20000, chunks: int = 500, embedding_dim: int = 1536, seed: int = 0):
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    build_database(directory, rows, rng)
+    build_vector_store(directory, chunks, embedding_dim, rng)
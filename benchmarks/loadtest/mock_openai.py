@@ -0,0 +1,152 @@
+"""
+Servidor simulado compatible con la API de OpenAI (chat completions y embeddings) para las pruebas de carga sin red.
+
+Las respuestas dependen del prompt, de modo que cada cadena de la aplicación recibe algo que sabe procesar:
+    - Prompt con las tres rutas (clasificación del router): la ruta según las reglas del pre-clasificador sobre el final del prompt.
+    - Prompt con "CREATE TABLE" (text2sql): una consulta SELECT sobre la tabla con los campos requeridos.
+    - Resto de peticiones sin streaming (chequeo de nueva búsqueda): "True".
+    - Peticiones con streaming (respuestas al cliente): texto de relleno a --tokens-per-second tokens por segundo.
+    - Embeddings: vectores deterministas (hashing de palabras o de ids de token) de --embedding-dim dimensiones.
+Antes del primer token (o de la respuesta completa) se espera --latency-ms milisegundos.
+
+Uso (desde la raíz del proyecto):
+    python benchmarks/loadtest/mock_openai.py --port 8100 --tokens-per-second 50 --latency-ms 300
+La aplicación se apunta al servidor con OPENAI_BASE_URL=http://127.0.0.1:8100/v1
+"""
+import os
+import re
+import sys
+import json
+import time
+import base64
+import asyncio
+import hashlib
+import argparse
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from src.intent_classifier import KeywordIntentClassifier, SEARCH_ROUTE, INFO_ROUTE, PRESENTATION_ROUTE
+
+LOREM = ("Tenemos varias opciones que encajan con lo que buscas . La vivienda está bien comunicada , "
+         "tiene mucha luz natural y se encuentra en una zona tranquila con servicios cercanos . "
+         "Si quieres , puedo darte más detalles o concertar una visita con uno de nuestros agentes .").split(" ")
+
+_CREATE_TABLE = re.compile(r'CREATE TABLE "?(\w+)"?')
+_VALUES = re.compile(r"/\* Valores de (\w+): ([^*]+?) \*/")
+REQUIRED_FIELDS = ("tipo", "operacion", "poblacion")
+
+
+def fake_embedding(value, dimension: int) -> np.ndarray:
+    """
+    Embedding determinista y normalizado: suma de vectores pseudoaleatorios por palabra (texto) o por id de token.
+    Textos con palabras en común quedan cerca, lo que basta para que la recuperación devuelva documentos.
+    """
+    units = value if isinstance(value, list) else re.findall(r"\w+", str(value).lower())
+    vector = np.zeros(dimension, dtype=np.float32)
+    for unit in units or [""]:
+        seed = int.from_bytes(hashlib.md5(str(unit).encode()).digest()[:4], "little")
+        vector += np.random.default_rng(seed).standard_normal(dimension).astype(np.float32)
+    return vector / (np.linalg.norm(vector) or 1.0)
+
+
+def _prompt_text(body) -> str:
+    return "\n".join(str(message.get("content") or "") for message in body.get("messages", []))
+
+
+def _sql_answer(prompt: str) -> str:
+    match = _CREATE_TABLE.search(prompt)
+    table = match.group(1) if match else "inmuebles"
+    listed = {field: values.split(", ")[0] for field, values in _VALUES.findall(prompt)}
+    clauses = []
+    for field in REQUIRED_FIELDS:
+        if field in listed:
+            clauses.append(f"\"{field}\" = '{listed[field]}'")
+        else:
+            clauses.append(f'"{field}" IS NOT NULL')
+    return f'SELECT * FROM "{table}" WHERE {" AND ".join(clauses)} LIMIT 3'
+
+
+def create_app(tokens_per_second: float, latency: float, answer_tokens: int, embedding_dim: int) -> FastAPI:
+    app = FastAPI()
+    classifier = KeywordIntentClassifier()
+    counters = {"chat": 0, "chat_stream": 0, "embeddings": 0}
+
+    def complete(prompt: str) -> str:
+        if all(route in prompt for route in (SEARCH_ROUTE, INFO_ROUTE, PRESENTATION_ROUTE)):
+            # El input del usuario suele ir al final del prompt de clasificación
+            return classifier.classify(prompt[-400:]).route or INFO_ROUTE
+        if "CREATE TABLE" in prompt:
+            return _sql_answer(prompt)
+        return "True"
+
+    def chunk(completion_id, model, delta, finish_reason=None):
+        payload = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                   "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    @app.get("/health")
+    async def health():
+        return counters
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "mock")
+        completion_id = f"chatcmpl-{time.monotonic_ns()}"
+        await asyncio.sleep(latency)
+
+        if not body.get("stream"):
+            counters["chat"] += 1
+            prompt = _prompt_text(body)
+            content = complete(prompt)
+            usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4}
+            usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+            return JSONResponse({
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage
+            })
+
+        counters["chat_stream"] += 1
+
+        async def stream():
+            yield chunk(completion_id, model, {"role": "assistant", "content": ""})
+            for i in range(answer_tokens):
+                yield chunk(completion_id, model, {"content": LOREM[i % len(LOREM)] + " "})
+                if tokens_per_second > 0:
+                    await asyncio.sleep(1 / tokens_per_second)
+            yield chunk(completion_id, model, {}, "stop")
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        counters["embeddings"] += 1
+        inputs = body["input"]
+        # input: texto, lista de textos, lista de ids de token o lista de listas de ids (OpenAIEmbeddings con tiktoken)
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        data = []
+        for i, value in enumerate(inputs):
+            vector = fake_embedding(value, embedding_dim)
+            embedding = base64.b64encode(vector.tobytes()).decode() if body.get("encoding_format") == "base64" else vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        return {"object": "list", "data": data, "model": body.get("model", "mock"), "usage": {"prompt_tokens": 0, "total_tokens": 0}}
+
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--tokens-per-second", type=float, default=50, help="Velocidad de las respuestas en streaming (0 = sin espera)")
+    parser.add_argument("--latency-ms", type=float, default=300, help="Espera antes del primer token o de la respuesta completa")
+    parser.add_argument("--answer-tokens", type=int, default=60, help="Tokens de cada respuesta en streaming")
+    parser.add_argument("--embedding-dim", type=int, default=1536)
+    args = parser.parse_args()
+    app = create_app(args.tokens_per_second, args.latency_ms / 1000, args.answer_tokens, args.embedding_dim)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,292 @@
+"""
+Prueba de carga de extremo a extremo de main.py sin red ni OpenAI.
+
+Levanta el servidor simulado de OpenAI (mock_openai.py) en un proceso aparte y la aplicación con uvicorn en este proceso, con:
+    - MongoDB sustituido por mongomock_motor, contando las operaciones sobre la colección de sesiones.
+    - Artefactos sintéticos (SQLite con su esquema, FAISS y BM25) generados en --fixtures-dir (ver fixtures.py).
+Después reproduce las conversaciones de --conversations (una sesión por conversación, --concurrency a la vez, --repeat veces)
+leyendo /chat en formato NDJSON, y muestra por ruta (búsqueda / información / presentación):
+    - tiempo hasta el primer token (TTFT) p50/p99, latencia total p50/p99 y tokens/s de la respuesta
+    - operaciones de MongoDB por turno
+Con --url se usa una aplicación ya arrancada (sin contar operaciones de MongoDB).
+
+Sin red, tiktoken necesita tener sus ficheros en caché (TIKTOKEN_CACHE_DIR) para los embeddings de OpenAIEmbeddings.
+
+Uso (desde la raíz del proyecto, requiere mongomock-motor):
+    python benchmarks/loadtest/run_loadtest.py --concurrency 20 --repeat 5 --tokens-per-second 50 --latency-ms 300
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from collections import Counter, defaultdict
+import httpx
+LOADTEST_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(os.path.dirname(LOADTEST_DIR))
+sys.path.append(ROOT_DIR)
+from src.context_budget import count_tokens
+from src.stream_events import TOKEN, ROUTE, ERROR
+
+
+#------MONGODB SIMULADO CON CONTEO DE OPERACIONES------
+class CountingCollection:
+    def __init__(self, collection, counter: Counter):
+        self._collection = collection
+        self._counter = counter
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if name.startswith("_") or not callable(attribute):
+            return attribute
+
+        def counted(*args, **kwargs):
+            self._counter[name] += 1
+            return attribute(*args, **kwargs)
+        return counted
+
+
+class CountingDatabase:
+    def __init__(self, database, counter: Counter):
+        self._database = database
+        self._counter = counter
+
+    def __getattr__(self, name):
+        return CountingCollection(getattr(self._database, name), self._counter)
+
+    def __getitem__(self, name):
+        return CountingCollection(self._database[name], self._counter)
+
+
+def patch_motor(counter: Counter):
+    """
+    Sustituye AsyncIOMotorClient por un cliente de mongomock_motor antes de importar main.py.
+    """
+    import motor.motor_asyncio
+    from mongomock_motor import AsyncMongoMockClient
+
+    class CountingMongoClient:
+        def __init__(self, *args, **kwargs):
+            self._client = AsyncMongoMockClient()
+
+        def __getattr__(self, name):
+            return CountingDatabase(getattr(self._client, name), counter)
+
+        def __getitem__(self, name):
+            return CountingDatabase(self._client[name], counter)
+
+    motor.motor_asyncio.AsyncIOMotorClient = CountingMongoClient
+
+
+#------ARRANQUE DE LOS SERVIDORES------
+def start_mock_server(args) -> subprocess.Popen:
+    process = subprocess.Popen([
+        sys.executable, os.path.join(LOADTEST_DIR, "mock_openai.py"),
+        "--port", str(args.mock_port),
+        "--tokens-per-second", str(args.tokens_per_second),
+        "--latency-ms", str(args.latency_ms),
+        "--answer-tokens", str(args.answer_tokens),
+        "--embedding-dim", str(args.embedding_dim)
+    ])
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{args.mock_port}/health").raise_for_status()
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Mock OpenAI server did not start")
+
+
+def configure_environment(args, fixtures_dir: str):
+    # setdefault: las variables ya definidas (p.ej. límites LLM_*) se respetan
+    environment = {
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.mock_port}/v1",
+        "OPEN_AI_API_KEY": "sk-loadtest",
+        "OPENAI_API_KEY": "sk-loadtest",
+        "LLM_HTTP2": "false",
+        "ARTIFACTS_DIR": fixtures_dir,
+        "ARTIFACTS_POLL_SECONDS": "0",
+        "EMBEDDING_CACHE_PATH": os.path.join(fixtures_dir, "embeddings_cache.sqlite"),
+        "MONGO_URI": "mongodb://loadtest",
+        "SECRET_KEY": "loadtest",
+        "SESSION_TIMEOUT": "30",
+    }
+    for name, value in environment.items():
+        os.environ.setdefault(name, value)
+
+
+async def wait_ready(base_url: str, timeout: float):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            try:
+                response = await client.get("/readyz")
+                status = response.json()
+                if response.status_code == 200:
+                    print(f"Aplicación lista en {status['elapsed_seconds']:.2f}s")
+                    return
+                if status.get("failed"):
+                    raise RuntimeError(f"Application startup failed: {status['components']}")
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("Application did not become ready")
+
+
+#------REPRODUCCIÓN DE CONVERSACIONES------
+async def replay(base_url: str, conversation: dict, results: list, timeout: float):
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout) as client:
+        (await client.post("/start_session")).raise_for_status()
+        for turn, user_input in enumerate(conversation["turns"]):
+            record = {"conversation": conversation["name"], "turn": turn, "route": None, "ttft": None, "error": None}
+            text = ""
+            start = time.perf_counter()
+            try:
+                async with client.stream("POST", "/chat", params={"format": "ndjson"}, json={"user_input": user_input}) as response:
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        if not line:
+                            continue
+                        event = json.loads(line)
+                        if event["type"] == TOKEN:
+                            if record["ttft"] is None:
+                                record["ttft"] = time.perf_counter() - start
+                            text += event["data"]
+                        elif event["type"] == ROUTE:
+                            record["route"] = event["data"]
+                        elif event["type"] == ERROR:
+                            record["error"] = event["data"]
+            except httpx.HTTPError as e:
+                record["error"] = str(e)
+            record["latency"] = time.perf_counter() - start
+            record["tokens"] = count_tokens(text)
+            streaming_seconds = record["latency"] - (record["ttft"] or record["latency"])
+            record["tokens_per_second"] = record["tokens"] / streaming_seconds if streaming_seconds > 0 else None
+            results.append(record)
+
+
+async def run_workload(base_url: str, conversations: list, concurrency: int, timeout: float) -> list:
+    results = []
+    queue = asyncio.Queue()
+    for conversation in conversations:
+        queue.put_nowait(conversation)
+
+    async def worker():
+        while not queue.empty():
+            await replay(base_url, queue.get_nowait(), results, timeout)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results
+
+
+#------INFORME------
+def percentile(values, q):
+    values = sorted(values)
+    return values[int(q * (len(values) - 1))] if values else float("nan")
+
+
+def report(results: list, wall_seconds: float, mongo_ops: Counter = None):
+    by_route = defaultdict(list)
+    for record in results:
+        by_route[record["route"] or "sin ruta"].append(record)
+
+    print(f"\n{len(results)} turnos en {wall_seconds:.1f}s ({len(results) / wall_seconds:.2f} turnos/s)")
+    print(f"{'ruta':<14} {'turnos':>6} {'errores':>7} {'TTFT p50':>9} {'TTFT p99':>9} {'total p50':>9} {'total p99':>9} {'tokens/s':>9}")
+    for route, records in sorted(by_route.items()):
+        ttft = [1000 * record["ttft"] for record in records if record["ttft"] is not None]
+        latency = [1000 * record["latency"] for record in records]
+        speed = [record["tokens_per_second"] for record in records if record["tokens_per_second"]]
+        errors = sum(record["error"] is not None for record in records)
+        print(f"{route:<14} {len(records):>6} {errors:>7} {percentile(ttft, 0.5):>9.0f} {percentile(ttft, 0.99):>9.0f} "
+              f"{percentile(latency, 0.5):>9.0f} {percentile(latency, 0.99):>9.0f} {percentile(speed, 0.5):>9.1f}")
+    print("(tiempos en ms; tokens/s desde el primer token hasta el final del stream)")
+
+    if mongo_ops is not None and results:
+        total = sum(mongo_ops.values())
+        detail = ", ".join(f"{name}={count / len(results):.2f}" for name, count in mongo_ops.most_common())
+        print(f"\nMongoDB: {total / len(results):.2f} operaciones por turno ({detail})")
+        print("(incluye la creación de la sesión de cada conversación y el volcado final de la caché de sesiones)")
+
+
+async def main(args):
+    with open(args.conversations, encoding="utf-8") as f:
+        conversations = [json.loads(line) for line in f if line.strip()]
+    workload = conversations * args.repeat
+    random.Random(args.seed).shuffle(workload)
+
+    if args.url:
+        start = time.perf_counter()
+        results = await run_workload(args.url, workload, args.concurrency, args.timeout)
+        report(results, time.perf_counter() - start)
+        return results
+
+    fixtures_dir = args.fixtures_dir or tempfile.mkdtemp(prefix="loadtest_")
+    print(f"Generando artefactos en {fixtures_dir}")
+    from fixtures import build_fixtures
+    build_fixtures(fixtures_dir, rows=args.rows, chunks=args.chunks, embedding_dim=args.embedding_dim)
+
+    mock = start_mock_server(args)
+    mongo_ops = Counter()
+    try:
+        configure_environment(args, fixtures_dir)
+        patch_motor(mongo_ops)
+        # main.py usa rutas relativas a la raíz del proyecto (logs, static, templates)
+        os.chdir(ROOT_DIR)
+        os.makedirs("logs", exist_ok=True)
+        import uvicorn
+        from main import app
+
+        server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning", lifespan="on"))
+        serve_task = asyncio.create_task(server.serve())
+        base_url = f"http://127.0.0.1:{args.port}"
+        try:
+            await wait_ready(base_url, args.ready_timeout)
+            startup_ops = sum(mongo_ops.values())
+            mongo_ops.clear()
+            start = time.perf_counter()
+            results = await run_workload(base_url, workload, args.concurrency, args.timeout)
+            wall_seconds = time.perf_counter() - start
+        finally:
+            # Al parar la aplicación se vuelca la caché de sesiones (si está activada), que también cuenta
+            server.should_exit = True
+            await serve_task
+        print(f"\nOperaciones de MongoDB durante el arranque: {startup_ops}")
+        report(results, wall_seconds, mongo_ops)
+    finally:
+        mock.terminate()
+        mock.wait()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--conversations", default=os.path.join(LOADTEST_DIR, "conversations.jsonl"))
+    parser.add_argument("--concurrency", type=int, default=10, help="Conversaciones simultáneas")
+    parser.add_argument("--repeat", type=int, default=3, help="Veces que se reproduce cada conversación")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Guarda el resultado de cada turno en JSON")
+    parser.add_argument("--url", default=None, help="Aplicación ya arrancada (no se levantan servidores ni se cuentan operaciones de MongoDB)")
+    # Aplicación y servidor simulado
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--mock-port", type=int, default=8100)
+    parser.add_argument("--tokens-per-second", type=float, default=50)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--answer-tokens", type=int, default=60)
+    parser.add_argument("--ready-timeout", type=float, default=120)
+    # Artefactos sintéticos
+    parser.add_argument("--fixtures-dir", default=None, help="Directorio de los artefactos (por defecto uno temporal)")
+    parser.add_argument("--rows", type=int, default=20000, help="Filas de la tabla de inmuebles")
+    parser.add_argument("--chunks", type=int, default=500, help="Chunks del índice FAISS")
+    parser.add_argument("--embedding-dim", type=int, default=1536)
+    asyncio.run(main(parser.parse_args()))
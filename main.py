@@ -1,20 +1,31 @@
-from fastapi import FastAPI, Depends, HTTPException, Response, Request
-from fastapi.responses import StreamingResponse, HTMLResponse
+from fastapi import FastAPI, Depends, HTTPException, Response, Request, Header
+from fastapi.responses import StreamingResponse, HTMLResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from uuid import uuid4, UUID
 import uuid
+import copy
+import asyncio
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, timezone
 from motor.motor_asyncio import AsyncIOMotorClient
-from session_manager import SessionData, MongoDBBackend, CustomSessionVerifier, CookieBackend, SessionMiddleware
+from session_manager import SessionData, MongoDBBackend, CachedSessionBackend, CustomSessionVerifier, CookieBackend, SessionMiddleware, diff_qa_data
 from src.router_chain import Router_chain
+from src.qa_chain import QAChain
+from src.rag_chain import RagChain
 from pydantic import BaseModel, UUID4
-from typing import Dict
+from typing import Dict, Optional
 import os
+import signal
 from dotenv import load_dotenv
 from pathlib import Path
 import logging
 from logging.handlers import RotatingFileHandler
 from src.directories import welcome_message
+from src.metrics import metrics
+from src.artifacts import ArtifactManager, ArtifactReloader
+from src.warmup import Warmup
+from src.config.base_models import model_registry
+from src.stream_events import StreamEvent, coalesce_tokens, to_ndjson, TOKEN, STATUS, ROUTE, ERROR, DONE
 
 
 # Configuración del logger con rotación (limitados). 20000 bytes y 5 archivos de respaldo máximos
@@ -39,8 +50,8 @@ class MainApp:
 
     #------CONSTRUCTOR------
     def __init__(self):
-        # Inicializar FastAPI
-        self.app = FastAPI()
+        # Inicializar FastAPI. Las cadenas, índices y el índice TTL se inicializan en el lifespan, después de abrir el puerto
+        self.app = FastAPI(lifespan=self.lifespan)
 
         # Ruta a la base de datos de MongoDB
         load_dotenv()
@@ -56,6 +67,30 @@ class MainApp:
         self.cookie_backend = CookieBackend(cookie_name="session_id", secret_key=os.getenv("SECRET_KEY"), backend=self.mongo_backend) # Backend de cookies
         session_timeout_minutes = int(os.getenv("SESSION_TIMEOUT")) 
         self.session_timeout = timedelta(minutes=session_timeout_minutes) # Se define el tiempo de espera de la sesión en minutos
+        self.history_cap = int(os.getenv("SESSION_HISTORY_CAP", 50)) # Máximo de entradas del historial guardadas en MongoDB
+        self.qa_list_cap = int(os.getenv("SESSION_SQL_QUERIES_CAP", 20)) # Máximo de pares input-SQL (qa_data.sql_queries) guardados
+        # Token de las rutas de administración (cabecera X-Admin-Token). Sin él quedan deshabilitadas
+        self.admin_token = os.getenv("ADMIN_TOKEN")
+
+        # Agrupación de tokens del stream de /chat: caracteres por lote y espera máxima en segundos
+        self.stream_batch_chars = int(os.getenv("STREAM_BATCH_CHARS", 64))
+        self.stream_batch_delay = float(os.getenv("STREAM_BATCH_MS", 30)) / 1000
+
+        # Capa opcional de sesiones en memoria con escritura diferida a MongoDB
+        self.session_backend = self.mongo_backend
+        if os.getenv("SESSION_CACHE_ENABLED", "false").lower() == "true":
+            validate_reads = os.getenv("SESSION_CACHE_VALIDATE_READS", "true").lower() == "true"
+            if not validate_reads and int(os.getenv("WEB_CONCURRENCY", 1)) > 1:
+                # Con varios workers sin validar, un acierto de la caché puede servir una sesión que otro worker ya ha cambiado
+                logger.warning("SESSION_CACHE_VALIDATE_READS=false ignored: WEB_CONCURRENCY > 1")
+                validate_reads = True
+            self.session_backend = CachedSessionBackend(
+                self.mongo_backend,
+                max_entries=int(os.getenv("SESSION_CACHE_MAX_ENTRIES", 1000)),
+                ttl=self.session_timeout,
+                flush_interval=float(os.getenv("SESSION_CACHE_FLUSH_INTERVAL", 2)),
+                validate_reads=validate_reads
+            )
 
         # Verificador de sesión
         self.session_verifier = CustomSessionVerifier(backend=self.mongo_backend) # Verificador de sesión
@@ -66,18 +101,90 @@ class MainApp:
         # Agregar el middleware de sesión
         self.app.add_middleware(
             SessionMiddleware,
-            mongo_backend=self.mongo_backend,
+            mongo_backend=self.session_backend,
             cookie_backend=self.cookie_backend,
-            session_timeout=self.session_timeout
+            session_timeout=self.session_timeout,
+            history_limit=Router_chain.HISTORY_WINDOW
         )
 
-        # Instancias de la lógica de la aplicación
-        self.router_chain = Router_chain()
+        # Instancias de la lógica de la aplicación. Se crean durante el arranque (warm_up)
+        self.router_chain = None
+        self.artifact_reloader = None
+        # Los componentes requeridos se reintentan con backoff. Con STARTUP_MAX_ATTEMPTS > 0, agotados los intentos el proceso
+        # termina para que el orquestador lo reinicie
+        self.warmup = Warmup(
+            retry_initial=float(os.getenv("STARTUP_RETRY_SECONDS", 1)),
+            retry_max=float(os.getenv("STARTUP_RETRY_MAX_SECONDS", 30)),
+            max_attempts=int(os.getenv("STARTUP_MAX_ATTEMPTS", 0))
+        )
+        # Con STARTUP_WAIT_READY el servidor no acepta conexiones hasta terminar el arranque (comportamiento anterior)
+        self.startup_wait_ready = os.getenv("STARTUP_WAIT_READY", "false").lower() == "true"
 
         # Registrar rutas
         self._register_routes()
 
 
+    #------ARRANQUE Y PARADA------
+    @asynccontextmanager
+    async def lifespan(self, app: FastAPI):
+        if isinstance(self.session_backend, CachedSessionBackend):
+            await self.session_backend.start()
+        warmup_task = asyncio.create_task(self.warm_up())
+        if self.startup_wait_ready:
+            await asyncio.shield(warmup_task)
+        try:
+            yield
+        finally:
+            warmup_task.cancel()
+            try:
+                await warmup_task
+            except (asyncio.CancelledError, Exception):
+                pass
+            if self.artifact_reloader is not None:
+                await self.artifact_reloader.stop()
+            if isinstance(self.session_backend, CachedSessionBackend):
+                await self.session_backend.stop()
+            # Pool de conexiones HTTP compartido por los modelos
+            await model_registry.aclose()
+
+    async def warm_up(self):
+        """
+        Inicializa en paralelo los recursos independientes:
+            - QAChain: pool SQLite, esquema precalculado, índice de valores, prompts y modelos.
+            - RagChain: índices FAISS y BM25, caché de embeddings, prompt y modelo.
+            - Índice TTL de las sesiones en MongoDB (opcional: si falla sólo se registra el error).
+        Después construye el router con las dos cadenas y arranca la recarga en caliente de artefactos.
+        """
+        for name in ("qa_chain", "rag_chain", "router_chain"):
+            self.warmup.register(name)
+        self.warmup.register("ttl_index", required=False)
+        try:
+            qa_chain, rag_chain, _ = await asyncio.gather(
+                self.warmup.run("qa_chain", QAChain),
+                self.warmup.run("rag_chain", RagChain),
+                self.warmup.run("ttl_index", self.session_backend.ensure_ttl_index)
+            )
+            router_chain = await self.warmup.run("router_chain", Router_chain, qa_chain=qa_chain, rag_chain=rag_chain)
+        except Exception as e:
+            logger.error(f"Application startup failed, shutting down: {e}")
+            os.kill(os.getpid(), signal.SIGTERM)
+            return
+
+        # Recarga en caliente de los artefactos (base de datos SQLite e índices FAISS/BM25) cuando se publica una nueva versión
+        self.artifact_reloader = ArtifactReloader(
+            ArtifactManager.from_env(),
+            [router_chain.qa_chain, router_chain.rag_chain],
+            poll_interval=float(os.getenv("ARTIFACTS_POLL_SECONDS", 10))
+        )
+        await self.artifact_reloader.start()
+        self.router_chain = router_chain
+        self.warmup.finish()
+
+    def _check_ready(self):
+        if self.router_chain is None:
+            raise HTTPException(status_code=503, detail="Service warming up", headers={"Retry-After": "5"})
+
+
     #------REGISTRO DE RUTAS------
     def _register_routes(self):
         @self.app.get("/", response_class=HTMLResponse)
@@ -100,6 +207,42 @@ class MainApp:
         async def get_welcome_message():
             return {"message": welcome_message}
 
+        @self.app.get("/metrics") # Métricas internas del proceso (cola y tiempos de SQL, etc.). Requiere ADMIN_TOKEN
+        async def get_metrics(x_admin_token: Optional[str] = Header(None)):
+            self._check_admin_token(x_admin_token)
+            return {**metrics.snapshot(), "artifacts_version": self.artifact_reloader.version if self.artifact_reloader else None}
+
+        @self.app.get("/healthz") # El proceso está vivo (aunque siga arrancando)
+        async def healthz():
+            return {"status": "ok"}
+
+        @self.app.get("/readyz") # Progreso del arranque. 503 hasta que se pueden atender conversaciones
+        async def readyz():
+            status = self.warmup.status()
+            return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+        @self.app.get("/admin/artifacts") # Versión de los artefactos cargada en este worker
+        async def get_artifacts():
+            self._check_ready()
+            return self.artifact_reloader.status()
+
+        @self.app.post("/admin/reload") # Fuerza la comprobación (y recarga) de la versión activa de los artefactos
+        async def reload_artifacts(force: bool = False, x_admin_token: Optional[str] = Header(None)):
+            self._check_admin_token(x_admin_token)
+            self._check_ready()
+            try:
+                return await self.artifact_reloader.reload(force=force)
+            except Exception as e:
+                logger.error(f"Artifact reload failed: {e}")
+                raise HTTPException(status_code=500, detail=f"Artifact reload failed: {e}")
+
+
+    #------AUTORIZACIÓN DE RUTAS DE ADMINISTRACIÓN------
+    def _check_admin_token(self, token: Optional[str]):
+        # Sin ADMIN_TOKEN configurado las rutas de administración quedan deshabilitadas
+        if not self.admin_token or token != self.admin_token:
+            raise HTTPException(status_code=403, detail="Forbidden")
+
 
     #------RESPUESTA HTML------ 
     def get_html_response(self):
@@ -123,12 +266,13 @@ class MainApp:
                 "missing_fields": [],
                 "last_query": None, 
                 "new_search": True,
-                "result": ""
+                "result": None,
+                "resolved_fields": {}
             }, 
             last_active=current_time, # Establece el instante de inicio de la sesión
             expiration_time=current_time + self.session_timeout # Establece el tiempo de expiración de la sesión
         )
-        await self.mongo_backend.create(session_data) # Creamos la sesión en la base de datos
+        await self.session_backend.create(session_data) # Creamos la sesión en la base de datos
         self.cookie_backend.write(response, session_id) # Esta función adjuntar la cookie al encabezado HTTP enviada al cliente
         logger.info("INFO: New session with id:" + str(session_id))
         return {"session_id": str(session_id)} # Se recibe el id_session en el lado del cliente en formato JSON
@@ -137,6 +281,7 @@ class MainApp:
     #------ENVÍO DE MENSAJES AL CHATBOT------
     async def _chat(self, user_input: str, request: Request) -> StreamingResponse:
 
+        self._check_ready()
         session_id = request.cookies.get("session_id")
         logger.info(f"New message from session with id: {session_id}")
 
@@ -147,24 +292,47 @@ class MainApp:
             logger.error(f"We cannot retrive session with id: {session_id}"+ str(e))
             raise HTTPException(status_code=404, detail=f"Session not found or expired: {e}")
 
-        # Generador de respuestas del chatbot en tiempo real
-        async def response_stream():
+        # Copia de qa_data para guardar después sólo las claves que cambien en este turno
+        qa_snapshot = copy.deepcopy(session.qa_data)
+
+        # Formato del stream: NDJSON con eventos tipados (?format=ndjson o Accept: application/x-ndjson) o texto plano
+        ndjson = request.query_params.get("format") == "ndjson" or "application/x-ndjson" in request.headers.get("accept", "")
+
+        # Generador de eventos del chatbot en tiempo real. Sólo el texto de la respuesta se guarda en la sesión
+        async def response_events():
+            complete_response = ""
+            route = None
             try:
-                complete_response = ""
-                # Generación la respuesta del chatbot. Es posible que en cada llamada se generen múltiples mensajes
-                async for partial_response in self.router_chain.execute(user_input, session):
-                    complete_response += partial_response
-                    yield partial_response
+                # Generación la respuesta del chatbot. Los tokens consecutivos se agrupan en lotes
+                async for event in coalesce_tokens(self.router_chain.execute(user_input, session), self.stream_batch_chars, self.stream_batch_delay):
+                    if event.type == TOKEN:
+                        complete_response += event.data
+                    elif event.type == ROUTE:
+                        route = event.data
+                    yield event
             except Exception as e:
                 logger.error(f"Logic execute failed {e}")
-                yield "ERROR: Logic failed: " + str(e)
-            await self.update_session(session, user_input, complete_response)
+                yield StreamEvent(ERROR, "ERROR: Logic failed: " + str(e))
+            yield StreamEvent(DONE, {"route": route})
+            await self.update_session(session, user_input, complete_response, qa_snapshot)
+
+        async def ndjson_stream():
+            async for event in response_events():
+                yield to_ndjson(event)
+
+        # Compatibilidad con clientes de texto plano: los eventos de estado se envían como los marcadores anteriores
+        async def text_stream():
+            async for event in response_events():
+                if event.type in (TOKEN, STATUS, ERROR):
+                    yield event.data
 
-        return StreamingResponse(response_stream(), media_type="text/plain")
+        if ndjson:
+            return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson")
+        return StreamingResponse(text_stream(), media_type="text/plain")
 
     
     #------ACTUALIZACIÓN DE LA SESIÓN------
-    async def update_session(self, session: SessionData, input:str, complete_response: str):
+    async def update_session(self, session: SessionData, input:str, complete_response: str, qa_snapshot: Dict):
         
         logger.info("QUERY GUARDADA EN SESIÓN: " + str(session.qa_data["last_query"]))
         # Actualización de la sesión después de completar la generación de la respuesta
@@ -178,7 +346,18 @@ class MainApp:
             session.history.append(conversation_entry)
             session.last_active = datetime.now(timezone.utc) # Se actualiza el instante de la última interacción
             session.expiration_time = session.last_active + self.session_timeout
-            await self.mongo_backend.update(session.session_id, session)
+            # Sólo se escriben la nueva entrada del historial, las claves de qa_data modificadas y los pares input-SQL nuevos
+            qa_changes, qa_appends = diff_qa_data(qa_snapshot, session.qa_data)
+            await self.session_backend.append_turn(
+                session.session_id,
+                conversation_entry,
+                qa_changes,
+                session.last_active,
+                session.expiration_time,
+                self.history_cap,
+                qa_appends=qa_appends,
+                qa_list_cap=self.qa_list_cap
+            )
         except Exception as e:
             logger.error(f"Session update failed: {e}")
             return "ERROR: Session update failed: " + str(e)    
@@ -187,7 +366,7 @@ class MainApp:
     #------CIERRE DE SESIÓN------  
     async def _end_session(self, response: Response, session_id: UUID):
         try:
-            await self.mongo_backend.delete(session_id) # Eliminamos la sesión del backend
+            await self.session_backend.delete(session_id) # Eliminamos la sesión del backend
             self.cookie_backend.delete(response) # Eliminar la cookie de la respuesta
             logger.info("INFO: Session removed with id:" + str(session_id))
         except Exception as e:
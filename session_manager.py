@@ -1,14 +1,19 @@
 from pydantic import BaseModel
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
+from collections import OrderedDict
+from pymongo import UpdateOne
+import asyncio
+import time
+import uuid
 from fastapi_sessions.session_verifier import SessionVerifier
 from fastapi_sessions.backends.session_backend import SessionBackend
-from starlette.middleware.base import BaseHTTPMiddleware
 from uuid import UUID
 from typing import List, Optional, Dict
 from fastapi import HTTPException, Request, Response
 from fastapi import Response
 from datetime import datetime
 import logging
+from src.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -20,6 +25,43 @@ class SessionData(BaseModel):
     qa_data: Optional[Dict] = [] # Almacena las propiedades de sesión en la herramienta QA incluidos los pares input-SQL
     last_active: datetime # Marca de tiempo de la última interacción
     expiration_time: datetime  # Marca de tiempo de expiración de la sesión
+    version: int = 0 # Se incrementa en cada escritura. Permite detectar escrituras concurrentes (compare-and-set)
+
+
+# Claves de qa_data que sólo crecen por el final. Se escriben con $push y $slice (como el historial), no con $set completo
+APPEND_ONLY_QA_KEYS = ("sql_queries",)
+
+
+def diff_qa_data(snapshot: Dict, qa_data: Dict, append_keys=APPEND_ONLY_QA_KEYS):
+    """
+    Compara qa_data con su copia al inicio del turno y devuelve (qa_changes, qa_appends):
+        - qa_changes: claves modificadas, para $set.
+        - qa_appends: elementos añadidos al final de las listas de append_keys, para $push.
+    Si una lista de append_keys no conserva su contenido anterior como prefijo se escribe completa con $set.
+    """
+    qa_changes, qa_appends = {}, {}
+    for key, value in qa_data.items():
+        previous = snapshot.get(key)
+        if previous == value:
+            continue
+        if key in append_keys and isinstance(value, list) and isinstance(previous, list) and value[:len(previous)] == previous:
+            qa_appends[key] = value[len(previous):]
+        else:
+            qa_changes[key] = value
+    return qa_changes, qa_appends
+
+
+def update_document(entries: List[Dict], qa_changes: Dict, qa_appends: Dict, last_active: datetime, expiration_time: datetime,
+                    history_cap: int, qa_list_cap: int) -> Dict:
+    """
+    Documento de actualización de un turno (o de varios acumulados): $push con $slice del historial y de las listas
+    de qa_data, $set de las claves modificadas y $inc de la versión.
+    """
+    fields = {"last_active": last_active, "expiration_time": expiration_time}
+    fields.update({f"qa_data.{key}": value for key, value in qa_changes.items()})
+    push = {"history": {"$each": entries, "$slice": -history_cap}}
+    push.update({f"qa_data.{key}": {"$each": items, "$slice": -qa_list_cap} for key, items in qa_appends.items() if items})
+    return {"$push": push, "$set": fields, "$inc": {"version": 1}}
 
 
 # Implementación de la clase MongoDBBackend con el backend de sesión y la colección de sesiones
@@ -34,9 +76,13 @@ class MongoDBBackend(SessionBackend):
             logger.error(f"Cannot creat session: {e}")
             raise HTTPException(status_code=500, detail="Internal Server Error")
 
-    async def read(self, session_id: UUID) -> SessionData:
+    async def read(self, session_id: UUID, history_limit: Optional[int] = None) -> SessionData:
+        """
+        Lee la sesión. Si se indica history_limit sólo se recuperan las últimas entradas del historial.
+        """
         try: 
-            result = await self.collection.find_one({"session_id": str(session_id)})
+            projection = {"history": {"$slice": -history_limit}} if history_limit else None
+            result = await self.collection.find_one({"session_id": str(session_id)}, projection)
             if result:
                 return SessionData(**result)
             return None
@@ -51,6 +97,23 @@ class MongoDBBackend(SessionBackend):
             logger.error(f"Cannot update session: {e}")
             raise HTTPException(status_code=500, detail="Internal Server Error")
 
+    async def append_turn(self, session_id: UUID, entry: Dict, qa_changes: Dict, last_active: datetime, expiration_time: datetime, history_cap: int,
+                          qa_appends: Optional[Dict] = None, qa_list_cap: int = 20):
+        """
+        Actualización incremental de la sesión tras un turno de conversación:
+            - $push con $slice: añade la entrada al historial y conserva sólo las últimas history_cap.
+            - $push con $slice de los elementos nuevos de las listas de qa_data (qa_appends), como mucho qa_list_cap.
+            - $set sólo de las claves de qa_data que han cambiado y de last_active/expiration_time.
+        """
+        try:
+            await self.collection.update_one(
+                {"session_id": str(session_id)},
+                update_document([entry], qa_changes, qa_appends or {}, last_active, expiration_time, history_cap, qa_list_cap)
+            )
+        except Exception as e:
+            logger.error(f"Cannot update session: {e}")
+            raise HTTPException(status_code=500, detail="Internal Server Error")
+
     async def delete(self, session_id: UUID):
         try:
             await self.collection.delete_one({"session_id": str(session_id)})
@@ -58,15 +121,245 @@ class MongoDBBackend(SessionBackend):
             logger.error(f"Cannot remove session: {e}")
             raise HTTPException(status_code=500, detail="Internal Server Error")
     
-    def ensure_ttl_index(self):
+    async def ensure_ttl_index(self):
         try:
             # Crea un índice en expiration_time con un TTL de 0 segundos.
-            self.collection.create_index("expiration_time", expireAfterSeconds=0)
+            await self.collection.create_index("expiration_time", expireAfterSeconds=0)
         except Exception as e:
             logger.error(f"Cannot create TTL index: {e}")
             raise HTTPException(status_code=500, detail="Error al configurar índice TTL")
 
 
+# Capa opcional de sesiones en memoria delante de MongoDBBackend con escritura diferida (write-behind)
+class CachedSessionBackend:
+    """
+    Mantiene un LRU de SessionData (max_entries, ttl alineado con SESSION_TIMEOUT) y acumula los cambios de cada
+    turno para volcarlos a MongoDB con bulk_write cada flush_interval segundos y al apagar la aplicación.
+    Con varios workers de uvicorn la consistencia se mantiene con el campo "version":
+        - Cada volcado sólo se aplica si la versión en MongoDB coincide con la versión cacheada (compare-and-set).
+        - Si otro worker ha escrito antes, los cambios se aplican sobre la versión actual y la sesión se expulsa
+          de la caché para que la siguiente lectura traiga el estado real.
+        - Con validate_reads (por defecto) se comprueba además la versión (sólo ese campo) en cada acierto de la caché,
+          de modo que un worker no sirve una sesión que otro worker ya ha modificado. Desactivarlo sólo es seguro con un
+          único worker o con sesiones fijadas a un worker (sticky sessions).
+    """
+
+    def __init__(self, backend: MongoDBBackend, max_entries: int = 1000, ttl: timedelta = timedelta(minutes=30), flush_interval: float = 2.0, validate_reads: bool = True):
+        self.backend = backend
+        self.collection = backend.collection
+        self.max_entries = max_entries
+        self.ttl = ttl.total_seconds()
+        self.flush_interval = flush_interval
+        self.validate_reads = validate_reads
+        self._sessions = OrderedDict() # session_id -> (SessionData, instante de carga)
+        self._pending = {} # session_id -> cambios pendientes de volcar
+        self._inflight = {} # session_id -> cambios que se están volcando (bulk_write en curso)
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+
+    #------CICLO DE VIDA------
+    async def start(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Session write-behind flush failed: {e}")
+
+    #------CACHÉ------
+    def _cache(self, session: SessionData):
+        self._sessions[session.session_id] = (session, time.monotonic())
+        self._sessions.move_to_end(session.session_id)
+        # Expulsar una sesión no pierde sus cambios: siguen en self._pending hasta el siguiente volcado
+        while len(self._sessions) > self.max_entries:
+            self._sessions.popitem(last=False)
+
+    def _cached(self, session_id: str) -> Optional[SessionData]:
+        item = self._sessions.get(session_id)
+        if item is None:
+            return None
+        session, loaded = item
+        if time.monotonic() - loaded > self.ttl:
+            del self._sessions[session_id]
+            return None
+        self._sessions.move_to_end(session_id)
+        return session
+
+    #------INTERFAZ DEL BACKEND------
+    async def create(self, data: SessionData):
+        await self.backend.create(data)
+        self._cache(data)
+
+    async def read(self, session_id: UUID, history_limit: Optional[int] = None) -> SessionData:
+        session_id = str(session_id)
+        session = self._cached(session_id)
+        if session is not None and self.validate_reads:
+            stored = await self.collection.find_one({"session_id": session_id}, {"version": 1})
+            pending = self._pending.get(session_id)
+            expected = {pending["base_version"] if pending else session.version}
+            inflight = self._inflight.get(session_id)
+            if inflight is not None and inflight["base_version"] is not None:
+                # El volcado en curso puede haberse aplicado ya o no
+                expected.add(inflight["base_version"] + 1)
+            if not stored or stored.get("version", 0) not in expected:
+                metrics.incr("session_cache.stale")
+                self._sessions.pop(session_id, None)
+                session = None
+        if session is not None:
+            metrics.incr("session_cache.hits")
+            return session
+
+        metrics.incr("session_cache.misses")
+        # Si hay cambios pendientes de esta sesión se vuelcan antes de leer
+        if session_id in self._pending:
+            await self.flush()
+        session = await self.backend.read(session_id, history_limit=history_limit)
+        if session:
+            self._cache(session)
+        return session
+
+    async def append_turn(self, session_id: UUID, entry: Dict, qa_changes: Dict, last_active: datetime, expiration_time: datetime, history_cap: int,
+                          qa_appends: Optional[Dict] = None, qa_list_cap: int = 20):
+        session_id = str(session_id)
+        session = self._cached(session_id)
+        # El historial y las listas de qa_data cacheados se recortan igual que en MongoDB ($slice)
+        if session is not None:
+            if history_cap and len(session.history) > history_cap:
+                del session.history[:-history_cap]
+            for key in qa_appends or {}:
+                if len(session.qa_data.get(key) or []) > qa_list_cap:
+                    del session.qa_data[key][:-qa_list_cap]
+        pending = self._pending.get(session_id)
+        if pending is None:
+            # Si hay un volcado en curso de esta sesión, base_version se corrige al terminar (flush)
+            pending = {"entries": [], "qa_changes": {}, "qa_appends": {}, "base_version": session.version if session else None}
+            self._pending[session_id] = pending
+        self._merge(pending, {"entries": [entry], "qa_changes": qa_changes, "qa_appends": qa_appends or {}, "last_active": last_active,
+                              "expiration_time": expiration_time, "history_cap": history_cap, "qa_list_cap": qa_list_cap})
+
+    @staticmethod
+    def _merge(pending: Dict, newer: Dict):
+        """
+        Acumula en pending los cambios de turnos posteriores. Una lista escrita con $set absorbe los elementos añadidos
+        después, y un $set posterior sustituye a los elementos añadidos antes.
+        """
+        pending["entries"] += newer["entries"]
+        for key, value in newer["qa_changes"].items():
+            pending["qa_changes"][key] = value
+            pending["qa_appends"].pop(key, None)
+        for key, items in newer["qa_appends"].items():
+            if key in pending["qa_changes"]:
+                pending["qa_changes"][key] = (list(pending["qa_changes"][key]) + items)[-newer["qa_list_cap"]:]
+            else:
+                pending["qa_appends"].setdefault(key, []).extend(items)
+        for key in ("last_active", "expiration_time", "history_cap", "qa_list_cap"):
+            pending[key] = newer[key]
+
+    async def update(self, session_id: UUID, data: SessionData):
+        await self.flush()
+        await self.backend.update(session_id, data)
+        self._sessions.pop(str(session_id), None)
+
+    async def delete(self, session_id: UUID):
+        self._sessions.pop(str(session_id), None)
+        self._pending.pop(str(session_id), None)
+        await self.backend.delete(session_id)
+
+    async def ensure_ttl_index(self):
+        return await self.backend.ensure_ttl_index()
+
+    #------VOLCADO A MONGODB------
+    @staticmethod
+    def _update_document(pending: Dict, write_id: str) -> Dict:
+        document = update_document(pending["entries"], pending["qa_changes"], pending["qa_appends"], pending["last_active"],
+                                   pending["expiration_time"], pending["history_cap"], pending["qa_list_cap"])
+        document["$set"]["last_writer"] = write_id
+        return document
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            # El lote se saca de la cola antes de cualquier await: los turnos que lleguen durante el volcado
+            # crean entradas nuevas en self._pending, que se rebasan sobre la versión escrita al terminar
+            batch, self._pending = self._pending, {}
+            self._inflight = batch
+            try:
+                await self._write_batch(batch)
+            finally:
+                self._inflight = {}
+
+    async def _write_batch(self, batch: Dict):
+        write_id = uuid.uuid4().hex
+
+        operations = []
+        for session_id, pending in batch.items():
+            query = {"session_id": session_id}
+            if pending["base_version"] is not None:
+                query["version"] = pending["base_version"]
+            operations.append(UpdateOne(query, self._update_document(pending, write_id)))
+
+        try:
+            result = await self.collection.bulk_write(operations, ordered=False)
+        except Exception as e:
+            logger.error(f"Cannot flush sessions: {e}")
+            # Los cambios se devuelven a la cola para el siguiente intento, delante de los turnos llegados durante el volcado
+            for session_id, pending in batch.items():
+                newer = self._pending.get(session_id)
+                if newer is not None:
+                    self._merge(pending, newer)
+                self._pending[session_id] = pending
+            raise HTTPException(status_code=500, detail="Internal Server Error")
+        metrics.incr("session_cache.flushed", len(operations))
+        metrics.incr("session_cache.mongo_ops")
+
+        conflicts = set()
+        if result.matched_count < len(operations):
+            conflicts = await self._resolve_conflicts(batch, write_id)
+
+        for session_id, pending in batch.items():
+            # Versión escrita por este volcado. Desconocida si se escribió sin comparar (sin versión base o tras un conflicto)
+            version = pending["base_version"] + 1 if pending["base_version"] is not None and session_id not in conflicts else None
+            session = self._cached(session_id)
+            if session is not None and version is not None:
+                session.version = version
+            newer = self._pending.get(session_id)
+            if newer is not None:
+                newer["base_version"] = version
+
+    async def _resolve_conflicts(self, batch: Dict, write_id: str) -> set:
+        # Las sesiones cuyo last_writer no es este volcado no se han escrito: otro worker las modificó antes
+        cursor = self.collection.find({"session_id": {"$in": list(batch.keys())}}, {"session_id": 1, "last_writer": 1})
+        written = {doc["session_id"] async for doc in cursor if doc.get("last_writer") == write_id}
+        metrics.incr("session_cache.mongo_ops")
+        conflicts = set()
+        for session_id, pending in batch.items():
+            if session_id in written:
+                continue
+            conflicts.add(session_id)
+            metrics.incr("session_cache.conflicts")
+            logger.info(f"Session {session_id} was modified by another worker, applying changes on latest version")
+            self._sessions.pop(session_id, None)
+            pending["base_version"] = None
+            await self.collection.update_one({"session_id": session_id}, self._update_document(pending, write_id))
+            metrics.incr("session_cache.mongo_ops")
+        return conflicts
+
+
 # Clase personalizada de SessionVerifier para verificar la sesión
 class CustomSessionVerifier(SessionVerifier):
     def __init__(self, backend: MongoDBBackend):
@@ -111,31 +404,33 @@ class CookieBackend:
             raise HTTPException(status_code=404, detail="Session not found or expired")
         
 
-# Cada vez que una solicitud HTTP llega a la aplicación, este middleware utiliza la cookie id_session para localizar la sesión en el backend.
-class SessionMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app, mongo_backend, cookie_backend, session_timeout):
-        super().__init__(app)
+# Cada vez que una solicitud HTTP llega a una ruta de sesión, este middleware utiliza la cookie id_session para localizar la sesión en el backend.
+# Es un middleware ASGI puro: no envuelve la petición ni el stream de la respuesta, de modo que StreamingResponse conserva
+# el control de flujo, y el resto de rutas (estáticos, "/") pasan directamente a la aplicación.
+class SessionMiddleware:
+    def __init__(self, app, mongo_backend, cookie_backend, session_timeout, history_limit = None, session_paths = ("/chat", "/end_session", "/update_session")):
+        self.app = app
         self.mongo_backend = mongo_backend
         self.cookie_backend = cookie_backend
         self.session_timeout = session_timeout
+        self.history_limit = history_limit # Entradas del historial que se cargan (las que usa el router)
+        self.session_paths = tuple(session_paths) # Rutas que requieren sesión
 
-    async def dispatch(self, request: Request, call_next):
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.session_paths):
+            await self.app(scope, receive, send)
+            return
 
         # Inicializar request.state.session
-        request.state.session = None
+        scope.setdefault("state", {})["session"] = None
 
-        # Rutas que no deben requerir autenticación o sesión
-        session_required_paths = ["/chat", "/end_session", "/update_session"]
-        if not any(request.url.path.startswith(path) for path in session_required_paths):
-            return await call_next(request)
-        
-        session_id = request.cookies.get("session_id")  # Acceso a la cookie de sesión
+        session_id = Request(scope).cookies.get("session_id")  # Acceso a la cookie de sesión
 
         logger.info("Retrive session from backend with id:" + str(session_id))
 
         if session_id:
             # Verificar y cargar la sesión desde MongoDB
-            session = await self.mongo_backend.read(session_id)
+            session = await self.mongo_backend.read(session_id, history_limit=self.history_limit)
             if session:
                 # Verificar si la sesión ha expirado
                 if session.expiration_time.tzinfo is None:
@@ -144,16 +439,18 @@ class SessionMiddleware(BaseHTTPMiddleware):
                     await self.mongo_backend.delete(session_id)
                     response = Response("Session expired", status_code=401)
                     self.cookie_backend.delete(response)
-                    return response
+                    await response(scope, receive, send)
+                    return
 
                 # Asignar la sesión al request.state
-                request.state.session = session
+                scope["state"]["session"] = session
             else:
                 logger.error("Session not found in session backend or session backend is down")
-                return Response("Session not found", status_code=404)
+                await Response("Session not found", status_code=404)(scope, receive, send)
+                return
         else:
             logger.error("session_id not found in cookies")
-            return Response("Session not found", status_code=401)
+            await Response("Session not found", status_code=401)(scope, receive, send)
+            return
 
-        response = await call_next(request)
-        return response
+        await self.app(scope, receive, send)
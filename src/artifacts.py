@@ -0,0 +1,193 @@
+"""
+Artefactos versionados (base de datos SQLite, esquema, índices FAISS y BM25) y recarga en caliente.
+
+Estructura de ARTIFACTS_DIR (por defecto DB_DIR):
+    versions/<versión>/   archivos de cada versión publicada
+    current               nombre de la versión activa (se reemplaza de forma atómica)
+Si no existe "current" se usan directamente los archivos de ARTIFACTS_DIR (instalaciones sin versiones).
+
+Publicar los artefactos generados por los scripts de src/config (desde la raíz del proyecto):
+    python -m src.artifacts publish --source <DB_DIR> [--version <nombre>] [--keep 3]
+"""
+import os
+import time
+import shutil
+import asyncio
+import logging
+import argparse
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from src.directories import DB_DIR, db_name
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+LEGACY_VERSION = "legacy"
+POINTER_NAME = "current"
+VERSIONS_DIR = "versions"
+
+
+def artifact_files(name: str = db_name) -> List[str]:
+    """
+    Archivos que forman una versión: base de datos y esquema del QAChain, índices del RagChain.
+    """
+    return [f"{name}.db", f"{name}.schema.json", "index.faiss", "index.pkl", "bm25.pkl"]
+
+
+class ArtifactManager:
+
+    def __init__(self, root: str):
+        self.root = root
+
+    @classmethod
+    def from_env(cls) -> "ArtifactManager":
+        return cls(os.getenv("ARTIFACTS_DIR", DB_DIR))
+
+    def current_version(self) -> str:
+        try:
+            with open(os.path.join(self.root, POINTER_NAME), encoding="utf-8") as f:
+                return f.read().strip() or LEGACY_VERSION
+        except FileNotFoundError:
+            return LEGACY_VERSION
+
+    def version_dir(self, version: str) -> str:
+        if version == LEGACY_VERSION:
+            return self.root
+        return os.path.join(self.root, VERSIONS_DIR, version)
+
+    def current_dir(self) -> str:
+        return self.version_dir(self.current_version())
+
+    def publish(self, source_dir: str, version: Optional[str] = None, keep: int = 3) -> str:
+        """
+        Copia los artefactos de source_dir a versions/<versión> y después apunta "current" a la nueva versión.
+        Los workers no ven la versión hasta que el puntero cambia, y el puntero cambia de forma atómica.
+        """
+        version = version or datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        target = self.version_dir(version)
+        tmp_target = target + ".tmp"
+        shutil.rmtree(tmp_target, ignore_errors=True)
+        os.makedirs(tmp_target)
+        copied = 0
+        for name in artifact_files():
+            path = os.path.join(source_dir, name)
+            if os.path.exists(path):
+                shutil.copy2(path, os.path.join(tmp_target, name))
+                copied += 1
+        if not copied:
+            shutil.rmtree(tmp_target)
+            raise FileNotFoundError(f"No artifacts found in {source_dir}")
+        os.replace(tmp_target, target)
+
+        pointer = os.path.join(self.root, POINTER_NAME)
+        with open(pointer + ".tmp", "w", encoding="utf-8") as f:
+            f.write(version)
+        os.replace(pointer + ".tmp", pointer)
+        self.prune(keep)
+        return version
+
+    def prune(self, keep: int = 3):
+        """
+        Borra las versiones antiguas conservando las `keep` más recientes y la activa.
+        """
+        versions_dir = os.path.join(self.root, VERSIONS_DIR)
+        if not os.path.isdir(versions_dir):
+            return
+        current = self.current_version()
+        versions = sorted((name for name in os.listdir(versions_dir) if not name.endswith(".tmp")), reverse=True)
+        for name in versions[keep:]:
+            if name != current:
+                shutil.rmtree(os.path.join(versions_dir, name), ignore_errors=True)
+
+
+class ArtifactReloader:
+    """
+    Detecta cambios del puntero "current" (sondeo cada poll_interval segundos o llamada a reload) y recarga los recursos.
+        - Cada destino expone load_resources(directorio) -> recursos y swap_resources(recursos).
+        - load_resources se ejecuta en hilos, en segundo plano, mientras se siguen atendiendo peticiones.
+        - swap_resources se llama para todos los destinos sin ceder el event loop, de modo que ninguna petición ve
+          una mezcla de versiones. Los streams en curso conservan las referencias a los recursos anteriores.
+    """
+
+    def __init__(self, manager: ArtifactManager, targets: List, poll_interval: float = 10.0):
+        self.manager = manager
+        self.targets = targets
+        self.poll_interval = poll_interval
+        self.version = manager.current_version()
+        self.loaded_at = datetime.now(timezone.utc)
+        self.last_reload_seconds = None
+        self.last_error = None
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    async def start(self):
+        if self.poll_interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            if self.manager.current_version() != self.version:
+                try:
+                    await self.reload()
+                except Exception as e:
+                    logger.error(f"Artifact reload failed: {e}")
+
+    async def reload(self, force: bool = False) -> Dict:
+        async with self._lock:
+            version = self.manager.current_version()
+            if version == self.version and not force:
+                return self.status()
+            directory = self.manager.version_dir(version)
+            start = time.perf_counter()
+            try:
+                resources = await asyncio.gather(*(asyncio.to_thread(target.load_resources, directory) for target in self.targets))
+            except Exception as e:
+                self.last_error = f"{version}: {e}"
+                metrics.incr("artifacts.reload_failures")
+                raise
+            for target, target_resources in zip(self.targets, resources):
+                target.swap_resources(target_resources)
+            self.last_reload_seconds = time.perf_counter() - start
+            self.version = version
+            self.loaded_at = datetime.now(timezone.utc)
+            self.last_error = None
+            metrics.incr("artifacts.reloads")
+            metrics.observe("artifacts.reload_seconds", self.last_reload_seconds)
+            logger.info(f"Artifacts version {version} loaded from {directory} in {self.last_reload_seconds:.2f}s")
+            return self.status()
+
+    def status(self) -> Dict:
+        return {
+            "version": self.version,
+            "directory": self.manager.version_dir(self.version),
+            "loaded_at": self.loaded_at.isoformat(),
+            "last_reload_seconds": self.last_reload_seconds,
+            "reloading": self._lock.locked(),
+            "last_error": self.last_error
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gestión de versiones de artefactos")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    publish_parser = subparsers.add_parser("publish", help="Publica los artefactos de un directorio como nueva versión")
+    publish_parser.add_argument("--source", default=DB_DIR)
+    publish_parser.add_argument("--version", default=None)
+    publish_parser.add_argument("--keep", type=int, default=3, help="Versiones que se conservan")
+    subparsers.add_parser("current", help="Muestra la versión activa")
+    args = parser.parse_args()
+    manager = ArtifactManager.from_env()
+    if args.command == "publish":
+        print(f"Versión publicada: {manager.publish(args.source, args.version, args.keep)}")
+    else:
+        print(f"{manager.current_version()} ({manager.current_dir()})")
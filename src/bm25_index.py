@@ -0,0 +1,85 @@
+import re
+import math
+import pickle
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, List, Sequence, Tuple
+
+_TOKEN = re.compile(r"\w+")
+
+
+# Tokens en minúsculas y sin tildes. Se conservan números y códigos (p.ej. referencias de inmuebles o códigos postales)
+def tokenize(text: str) -> List[str]:
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return _TOKEN.findall(text)
+
+
+class BM25Index:
+    """
+    Índice invertido BM25 sobre los chunks del índice vectorial. Se construye en la ingesta y se guarda
+    junto al índice FAISS. Recupera coincidencias exactas (códigos, calles, municipios) que la búsqueda densa pierde.
+    No importa módulos de src para poder usarse desde los scripts de src/config.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_ids: List[str] = []
+        self.doc_lengths: List[int] = []
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.idf: Dict[str, float] = {}
+        self.avg_length = 0.0
+
+    @classmethod
+    def build(cls, doc_ids: Sequence[str], texts: Sequence[str], k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        index = cls(k1, b)
+        postings = defaultdict(list)
+        for position, (doc_id, text) in enumerate(zip(doc_ids, texts)):
+            tokens = tokenize(text)
+            index.doc_ids.append(doc_id)
+            index.doc_lengths.append(len(tokens))
+            for term, frequency in Counter(tokens).items():
+                postings[term].append((position, frequency))
+        index.postings = dict(postings)
+        n = len(index.doc_ids)
+        index.avg_length = sum(index.doc_lengths) / n if n else 0.0
+        index.idf = {term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5)) for term, docs in index.postings.items()}
+        return index
+
+    def search(self, query: str, k: int = 8) -> List[Tuple[str, float]]:
+        """
+        Devuelve hasta k pares (id del chunk, puntuación) ordenados de mayor a menor puntuación.
+        """
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for position, frequency in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[position] / self.avg_length)
+                scores[position] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.doc_ids[position], score) for position, score in best]
+
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            pickle.dump(self.__dict__, f)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        index = cls()
+        with open(path, "rb") as f:
+            index.__dict__.update(pickle.load(f))
+        return index
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> List[str]:
+    """
+    Fusiona varias listas ordenadas de ids: cada id suma 1 / (k + posición) por cada lista en la que aparece.
+    """
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for position, doc_id in enumerate(ranking):
+            scores[doc_id] += 1.0 / (k + position + 1)
+    return sorted(scores, key=scores.get, reverse=True)
@@ -1,45 +1,172 @@
-from langchain_openai import ChatOpenAI
-import openai
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+import httpx
+import logging
+import threading
 import os
+from dataclasses import dataclass
+from typing import Dict, Optional
 from dotenv import load_dotenv
+from src.llm_transport import LimitedTransport
 
 
 load_dotenv()
 openai_key = os.getenv("OPEN_AI_API_KEY")
 
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ModelSpec:
+    model: Optional[str]
+    temperature: Optional[float] = 0
+    max_concurrency: int = 0 # Peticiones simultáneas (0 = sin límite)
+    requests_per_minute: float = 0 # Token bucket de peticiones (0 = sin límite)
+
+    @classmethod
+    def from_env(cls, name: str, model: Optional[str], **defaults) -> "ModelSpec":
+        """
+        Permite sobrescribir cada modelo con LLM_<NOMBRE>_MODEL, LLM_<NOMBRE>_MAX_CONCURRENCY y LLM_<NOMBRE>_RPM.
+        """
+        prefix = f"LLM_{name.upper()}_"
+        spec = cls(model, **defaults)
+        spec.model = os.getenv(prefix + "MODEL", spec.model)
+        spec.max_concurrency = int(os.getenv(prefix + "MAX_CONCURRENCY", os.getenv("LLM_MAX_CONCURRENCY", spec.max_concurrency)))
+        spec.requests_per_minute = float(os.getenv(prefix + "RPM", os.getenv("LLM_RPM", spec.requests_per_minute)))
+        return spec
+
+
+#------REGISTRO DE MODELOS------
+class ModelRegistry:
+    """
+    Crea los modelos de lenguaje y de embeddings de la aplicación sobre un único pool de conexiones HTTP (keep-alive, HTTP/2)
+    compartido. Cada modelo tiene su propio límite de concurrencia y de peticiones por minuto (LimitedTransport).
+    Los timeouts y los reintentos con backoff exponencial los aplica el cliente de OpenAI (timeout, max_retries).
+    Con OPENAI_BASE_URL se apunta a un servidor compatible con la API de OpenAI (p.ej. el servidor simulado de benchmarks/loadtest).
+    """
+
+    def __init__(self, specs: Dict[str, ModelSpec], api_key: Optional[str] = None, base_url: Optional[str] = None, timeout: float = 60.0,
+                 connect_timeout: float = 5.0, max_retries: int = 2, max_connections: int = 100, http2: bool = True):
+        self.specs = specs
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("h2 is not installed (pip install httpx[http2]), using HTTP/1.1")
+                http2 = False
+        self.http2 = http2
+        self.http_timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections, keepalive_expiry=60)
+        # Las cadenas se construyen en paralelo en hilos durante el arranque
+        self._lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        self.transport = httpx.AsyncHTTPTransport(http2=self.http2, limits=self.limits, retries=0)
+        # Cliente síncrono compartido para las llamadas no asíncronas (invoke, embed_documents)
+        self.sync_client = httpx.Client(http2=self.http2, limits=self.limits, timeout=self.http_timeout)
+        self._clients = {}
+        self._models = {}
+
+    @classmethod
+    def from_env(cls) -> "ModelRegistry":
+        specs = {
+            "router": ModelSpec.from_env("router", "gpt-4"),
+            "check": ModelSpec.from_env("check", "gpt-4o"),
+            "qa": ModelSpec.from_env("qa", "gpt-4o"),
+            "rag": ModelSpec.from_env("rag", "gpt-4o"),
+            # Sin modelo explícito se usa el de OpenAIEmbeddings, el mismo con el que se construyen los índices FAISS
+            "embeddings": ModelSpec.from_env("embeddings", None, temperature=None),
+        }
+        return cls(
+            specs,
+            api_key=openai_key,
+            base_url=os.getenv("OPENAI_BASE_URL") or None,
+            timeout=float(os.getenv("LLM_TIMEOUT", 60)),
+            connect_timeout=float(os.getenv("LLM_CONNECT_TIMEOUT", 5)),
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", 2)),
+            max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", 100)),
+            http2=os.getenv("LLM_HTTP2", "true").lower() == "true"
+        )
+
+    def async_client(self, name: str) -> httpx.AsyncClient:
+        """
+        Cliente asíncrono del modelo: comparte el pool de conexiones y aplica los límites del modelo.
+        """
+        client = self._clients.get(name)
+        if client is None:
+            spec = self.specs[name]
+            transport = LimitedTransport(self.transport, name, spec.max_concurrency, spec.requests_per_minute)
+            client = httpx.AsyncClient(transport=transport, timeout=self.http_timeout)
+            self._clients[name] = client
+        return client
+
+    def _common_kwargs(self, name: str) -> Dict:
+        kwargs = {
+            "api_key": self.api_key,
+            "timeout": self.timeout,
+            "max_retries": self.max_retries,
+            "http_client": self.sync_client,
+            "http_async_client": self.async_client(name),
+        }
+        if self.base_url:
+            kwargs["base_url"] = self.base_url
+        return kwargs
+
+    def chat(self, name: str) -> ChatOpenAI:
+        # Los modelos no guardan estado entre peticiones: se reutiliza la misma instancia en todas las cadenas
+        with self._lock:
+            if name not in self._models:
+                spec = self.specs[name]
+                self._models[name] = ChatOpenAI(model=spec.model, temperature=spec.temperature, **self._common_kwargs(name))
+            return self._models[name]
+
+    def embeddings(self, name: str = "embeddings") -> OpenAIEmbeddings:
+        with self._lock:
+            if name not in self._models:
+                spec = self.specs[name]
+                kwargs = self._common_kwargs(name)
+                if spec.model:
+                    kwargs["model"] = spec.model
+                self._models[name] = OpenAIEmbeddings(**kwargs)
+            return self._models[name]
+
+    async def aclose(self):
+        """
+        Cierra el pool de conexiones y deja el registro listo para reutilizarse: un nuevo arranque de la aplicación
+        en el mismo proceso (tests, prueba de carga en proceso) obtiene modelos con clientes nuevos.
+        """
+        with self._lock:
+            clients, transport, sync_client = list(self._clients.values()), self.transport, self.sync_client
+            self._open()
+        for client in clients:
+            await client.aclose()
+        await transport.aclose()
+        sync_client.close()
+
+
+model_registry = ModelRegistry.from_env()
+
 
 #GENERACIÓN DEL MODELO DE LENGUAJE PARA ROUTER
 def generate_router_llm():
-    llm = ChatOpenAI(
-        model="gpt-4", 
-        temperature = 0,
-        openai_api_key=openai_key
-    )
-    return llm
+    return model_registry.chat("router")
 
 # GENERACIÓN DEL MODELO DE LENGUAJE PARA CHEQUEO DE CONSULTAS
 def generate_check_llm():
-    llm = ChatOpenAI(
-        model="gpt-4o", 
-        temperature = 0,
-        openai_api_key=openai_key
-    )
-    return llm
+    return model_registry.chat("check")
 
 #GENERACIÓN DEL MODELO DE LENGUAJE PARA QA
 def generate_qa_llm():
-    llm = ChatOpenAI(
-        model="gpt-4o", 
-        temperature = 0,
-        openai_api_key=openai_key
-    )
-    return llm
+    return model_registry.chat("qa")
 
 #GENERACIÓN DEL MODELO DE LENGUAJE PARA RAG
 def generate_rag_llm():
-    llm = ChatOpenAI(
-        temperature = 0, 
-        model= 'gpt-4o',
-        openai_api_key=openai_key
-    )
-    return llm
\ No newline at end of file
+    return model_registry.chat("rag")
+
+#GENERACIÓN DEL MODELO DE EMBEDDINGS (consultas del RagChain)
+def generate_embeddings():
+    return model_registry.embeddings()
@@ -1,124 +1,370 @@
+"""
+ETL de los libros Excel de EXCEL_dir a bases de datos SQLite (una por libro) en DB_DIR.
+
+Límite de memoria: la lectura del Excel, el esquema y la inserción van por bloques de --chunk-size filas, pero los
+libros con función de limpieza en clean_csv_functions se limpian enteros, porque las funciones reciben la ruta del CSV
+completo y devuelven un único DataFrame. Para esos libros la memoria de cada proceso es la del DataFrame completo
+(y con --workers N puede haber N libros cargados a la vez), independientemente de --chunk-size.
+"""
 import os
-import pandas as pd
-import sqlite3
 import sys
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import pandas as pd
+from openpyxl import load_workbook
+from concurrent.futures import ProcessPoolExecutor, as_completed
 current_script_path = os.path.abspath(__file__)
 app_directory_path = os.path.dirname(os.path.dirname(current_script_path))
 sys.path.append(app_directory_path)
 from utilities import *
 from directories import EXCEL_dir, CSV_dir, DB_DIR
 from config.clean_csv_functions import get_clean_functions
+from schema_catalog import build_schema_catalog, save_schema_catalog, schema_path
 
 #-------------------------------------------------------------------------------------------------------------------
 
-#Obtener las funciones de limpieza (indexadas por el nombre del dataframe que limpian)
-clean_df_functions = get_clean_functions()
+MANIFEST_NAME = "sql_manifest.json"
+CLEANERS_PATH = os.path.join(os.path.dirname(current_script_path), "clean_csv_functions.py")
+
+# Columnas que filtran las consultas del text2sql y del SQLBuilder. Se indexan las que existan en la tabla
+EQUALITY_COLUMNS = ["tipo", "operacion", "poblacion"]
+RANGE_COLUMNS = ["precio", "habitaciones"]
+# Las columnas de texto con una longitud media mayor se indexan también en una tabla FTS5
+FTS_MIN_AVG_LENGTH = 60
+
+
+#HASH DEL CONTENIDO DE UN ARCHIVO
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
 
-#CONVERSOR DE EXCEL A CSV
-def get_csv_dict(excel_directory):
+
+#MANIFIESTO DE LIBROS PROCESADOS
+def load_manifest(db_dir):
+    """
+    Devuelve el manifiesto de la última ejecución: {"cleaners_sha256": ..., "files": {nombre: {"sha256": ..., "rows": ...}}}.
     """
-    Función para convertir excels en csv.
+    path = os.path.join(db_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {"files": {}}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
 
-    Parámetros: 
-        -excel_diectory: str. Directorio de reposición de excel.
 
-    Devuelve_ 
-        -csv_dict: dict. Diccionario con el nombre del archivo como clave y la ruta del archivo csv como valor.
+def save_manifest(db_dir, manifest):
+    # Escritura atómica: el manifiesto nunca queda a medias
+    path = os.path.join(db_dir, MANIFEST_NAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
 
+
+#LECTURA POR BLOQUES DEL EXCEL
+def read_excel_chunks(path, chunk_size):
+    """
+    Genera DataFrames de como mucho chunk_size filas de la primera hoja del libro (la misma que leía pd.read_excel).
+    Los .xlsx se leen en streaming con openpyxl (read_only). Los .xls (formato antiguo) se leen completos.
     """
-    csv_dict = {}  # Asegúrate de que este diccionario esté definido
+    if path.lower().endswith(".xls"):
+        df = pd.read_excel(path)
+        for start in range(0, len(df), chunk_size):
+            yield df.iloc[start:start + chunk_size]
+        return
 
-    for file in os.listdir(excel_directory):
-        for file in os.listdir(excel_directory):
-            if file.endswith(".xlsx") or file.endswith(".xls"):
-                name_file = file.rsplit('.', 1)[0]
-                path_excel = os.path.join(excel_directory, file)
-                try:
-                    # Especificar 'encoding' puede no ser necesario para archivos Excel, pero es un buen hábito cuando se manejan archivos CSV o de texto.
-                    excel = pd.read_excel(path_excel, engine='openpyxl')
-                    print(f"Archivo '{file}' leído correctamente.")
-                except Exception as e:
-                    print(f"Error al leer el archivo '{file}': {e}")
-        try:
-            path_csv = os.path.join(CSV_dir, name_file, name_file + ".csv")
-            excel.to_csv(path_csv, index=False, encoding='utf-8')
-            csv_dict[name_file] = path_csv  # Almacenamos la ruta del archivo CSV en el diccionario
-            print(f"El archivo excel {name_file}.xls ha sido guardado como CSV en {path_csv}")
-        except Exception as e:
-            print(f"Error al guardar el archivo CSV {name_file}.csv {e}")
-    
-    return csv_dict
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = [str(column) if column is not None else f"Unnamed: {i}" for i, column in enumerate(header)]
+        chunk = []
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield pd.DataFrame(chunk, columns=header)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=header)
+    finally:
+        workbook.close()
 
 
-# LIMPIEZA DEL CSV
-def clean_csv(csv_dict, clean_df_functions, csv_directory):
+#CONVERSIÓN DEL EXCEL A UN CSV TEMPORAL
+def excel_to_csv(excel_path, csv_path, chunk_size):
+    """
+    Escribe la primera hoja del libro en csv_path por bloques (la memoria depende del tamaño del bloque).
+    Es el mismo CSV que generaba la conversión Excel -> CSV anterior. Devuelve el número de filas.
     """
-    Función para limpiar los archivos csv.
+    rows = 0
+    for df in read_excel_chunks(excel_path, chunk_size):
+        df.to_csv(csv_path, index=False, encoding="utf-8", mode="a" if rows else "w", header=not rows)
+        rows += len(df)
+    return rows
 
-    Parámetros: 
-        -csv_dict: dict. Diccionario con el nombre del archivo como clave y la ruta del archivo csv como valor.
-        -list_name_csv: list. Lista de tuplas, donde cada tupla contiene un nombre de DataFrame (que coincide con las claves en csv_dict)
-                          y una función de limpieza para aplicar a ese DataFrame.
 
-    Devuelve
-        -None
+#ESQUEMA EXPLÍCITO
+# Orden de generalización de los tipos: una columna con enteros y decimales es REAL; con texto en algún bloque, TEXT
+TYPE_ORDER = {"INTEGER": 0, "REAL": 1, "TEXT": 2}
+PANDAS_DTYPES = {"INTEGER": "Int64", "REAL": "float64", "TEXT": "string"}
 
+
+def sqlite_type(dtype):
+    """
+    Tipo SQLite explícito para un dtype de pandas.
     """
-    # Iterar sobre las tuplas de nombres de DataFrame y funciones de limpieza
-    for df_name, clean_func in clean_df_functions:
-        if df_name in csv_dict:
-            # Construir la ruta completa al archivo CSV usando el directorio y el nombre del archivo
-            path = os.path.join(csv_directory, df_name, df_name+ ".csv")
-            # Aplicar la función de limpieza al archivo CSV
-            cleaned_df = clean_func(path)
-            # Sobrescribir el archivo CSV con el DataFrame limpio
-            cleaned_df.to_csv(path, index=False, encoding='utf-8')
-            print(f"El archivo CSV {df_name}.csv ha sido limpiado y guardado en {path}")
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(dtype):
+        return "REAL"
+    return "TEXT"
+
+
+def infer_schema(chunks):
+    """
+    Esquema {columna: tipo SQLite} de todo el archivo: el tipo de cada columna es el más general de los inferidos
+    en cada bloque. Los bloques en los que la columna está vacía no cuentan.
+    """
+    schema = {}
+    for df in chunks:
+        for column, dtype in df.dtypes.items():
+            column_type = sqlite_type(dtype) if df[column].notna().any() else None
+            current = schema.get(column)
+            if current is None or (column_type is not None and TYPE_ORDER[column_type] > TYPE_ORDER[current]):
+                schema[column] = column_type
+    return {column: column_type or "TEXT" for column, column_type in schema.items()}
+
+
+def apply_schema(df, schema):
+    # Cada bloque se convierte a los tipos declarados de la tabla antes de insertarlo
+    return df.astype({column: PANDAS_DTYPES[column_type] for column, column_type in schema.items()})
+
+
+#LIMPIEZA
+def cleaned_chunks(raw_csv_path, clean_func, chunk_size):
+    """
+    Devuelve (esquema, generador de bloques limpios con los tipos del esquema).
+        - Con función de limpieza: la función recibe la ruta del CSV completo, como antes, de modo que las operaciones
+          sobre todo el conjunto (duplicados, rellenos por grupo, cabeceras) se mantienen. El esquema sale del DataFrame limpio.
+          El libro completo se carga en memoria: chunk_size sólo limita los bloques de inserción.
+        - Sin función de limpieza: el CSV se lee dos veces por bloques, una para el esquema y otra para insertar.
+    """
+    if clean_func is not None:
+        df = clean_func(raw_csv_path)
+        schema = infer_schema([df])
+        return schema, (apply_schema(df.iloc[start:start + chunk_size], schema) for start in range(0, len(df), chunk_size))
+
+    schema = infer_schema(pd.read_csv(raw_csv_path, chunksize=chunk_size))
+    dtypes = {column: PANDAS_DTYPES[column_type] for column, column_type in schema.items()}
+    return schema, pd.read_csv(raw_csv_path, chunksize=chunk_size, dtype=dtypes)
 
 
 #CREACIÓN DE BASE DE DATOS SQL
-def create_ddbb_path(csv_dict):
-    """
-    Función para crear la base de datos SQLite a partir de csv
-
-    Parámetros: 
-        -csv_dict: dict. Diccionario con el nombre del archivo como clave y el archivo csv como valor.
-
-    Devuelve_ 
-        -None.
-    """
-    db_dict = {}
-
-    if not os.path.exists(DB_DIR):
-        os.makedirs(DB_DIR)
-    
-    for name_db, csv_path in csv_dict.items():
-        # Construir la ruta de la base de datos
-        database_path = os.path.join(DB_DIR, f"{name_db}.db")
-        db_dict[name_db] = f"sqlite:///{database_path}"  # SQLite no requiere autenticación
-        
-        # Leer el archivo CSV en un DataFrame de pandas
-        df = pd.read_csv(csv_path)
-        
-        # Conectar a la base de datos SQLite (se crea si no existe)
-        conn = sqlite3.connect(database_path)
-        
-        # Guardar el DataFrame en la base de datos como una tabla
-        df.to_sql(name_db, conn, if_exists='replace', index=False)
-        
-        # Optimización: Compactar la base de datos
-        conn.execute("VACUUM;")
-        
-        # Deshabilitar journaling si la base de datos será solo lectura
+def create_table(conn, name_db, schema):
+    """
+    Crea la tabla con los tipos del esquema de todo el archivo. Las columnas de texto filtradas no distinguen
+    mayúsculas, de modo que `tipo = 'Piso'` usa el índice.
+    """
+    columns = []
+    for column, column_type in schema.items():
+        if column_type == "TEXT" and column in EQUALITY_COLUMNS:
+            column_type += " COLLATE NOCASE"
+        columns.append(f'"{column}" {column_type}')
+    conn.execute(f'CREATE TABLE "{name_db}" ({", ".join(columns)})')
+
+
+def insert_rows(conn, name_db, df):
+    rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+    columns = ", ".join(f'"{column}"' for column in df.columns)
+    conn.executemany(f'INSERT INTO "{name_db}" ({columns}) VALUES ({", ".join("?" * len(df.columns))})', rows)
+
+
+def create_indexes(conn, name_db):
+    """
+    Índice compuesto sobre los campos de igualdad (tipo, operacion, poblacion), índices sobre poblacion y las
+    columnas de rango, y una tabla FTS5 para las columnas de texto libre.
+    """
+    column_types = {row[1]: (row[2] or "").upper() for row in conn.execute(f'PRAGMA table_info("{name_db}")')}
+    equality = [column for column in EQUALITY_COLUMNS if column in column_types]
+    if equality:
+        indexed = ", ".join(f'"{column}"' for column in equality)
+        conn.execute(f'CREATE INDEX "idx_{name_db}_filters" ON "{name_db}" ({indexed})')
+    for column in ["poblacion"] + RANGE_COLUMNS:
+        if column in column_types and not (equality and equality[0] == column):
+            conn.execute(f'CREATE INDEX "idx_{name_db}_{column}" ON "{name_db}" ("{column}")')
+
+    text_columns = []
+    for column, column_type in column_types.items():
+        if column_type == "TEXT" and column not in EQUALITY_COLUMNS:
+            average = conn.execute(f'SELECT AVG(LENGTH("{column}")) FROM "{name_db}" WHERE "{column}" IS NOT NULL').fetchone()[0]
+            if average is not None and average > FTS_MIN_AVG_LENGTH:
+                text_columns.append(column)
+    if text_columns:
+        fts_columns = ", ".join(f'"{column}"' for column in text_columns)
+        try:
+            conn.execute(f'CREATE VIRTUAL TABLE "{name_db}_fts" USING fts5({fts_columns}, content="{name_db}", tokenize="unicode61 remove_diacritics 2")')
+            conn.execute(f'INSERT INTO "{name_db}_fts" ("{name_db}_fts") VALUES (\'rebuild\')')
+            print(f"Tabla FTS5 {name_db}_fts creada sobre {text_columns}")
+        except sqlite3.OperationalError as e:
+            print(f"FTS5 no disponible, no se crea {name_db}_fts: {e}")
+
+
+#ETL DE UN LIBRO (se ejecuta en un proceso del pool)
+def build_database(excel_path, name_db, db_dir, chunk_size=20000, page_size=8192, csv_dir=None):
+    """
+    Convierte el libro por bloques en un CSV temporal, lo limpia con su función de limpieza (sobre el archivo completo,
+    como antes) y lo inserta por bloques con executemany (una transacción por bloque).
+    Sin función de limpieza la memoria depende del tamaño del bloque, no del libro.
+    El esquema de la tabla se declara a partir de todo el archivo, no del primer bloque.
+    La base de datos se construye en un archivo temporal con tipos explícitos, índices, FTS5 y estadísticas (ANALYZE)
+    y se publica con un reemplazo atómico. El servidor la abre en solo lectura (mode=ro, immutable=1) con mmap.
+
+    Parámetros:
+        -excel_path: str. Ruta del libro.
+        -name_db: str. Nombre de la tabla y de la base de datos.
+        -db_dir: str. Directorio de las bases de datos.
+        -chunk_size: int. Filas por bloque.
+        -page_size: int. Tamaño de página. Páginas grandes reducen lecturas en consultas de solo lectura.
+        -csv_dir: str. Si se indica, también se escribe el CSV limpio en csv_dir/name_db/name_db.csv.
+
+    Devuelve:
+        -(name_db, filas insertadas, segundos por etapa)
+    """
+    clean_func = dict(get_clean_functions()).get(name_db)
+    database_path = os.path.join(db_dir, f"{name_db}.db")
+    tmp_path = database_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    raw_csv_path = database_path + ".raw.csv"
+    csv_path = os.path.join(csv_dir, name_db, name_db + ".csv") if csv_dir else None
+    if csv_path:
+        os.makedirs(os.path.dirname(csv_path), exist_ok=True)
+
+    timings = {"read": 0.0, "clean": 0.0, "load": 0.0}
+    rows = 0
+    conn = sqlite3.connect(tmp_path)
+    try:
+        # El tamaño de página se fija antes de crear ninguna tabla. Sin journal durante la construcción (el archivo es temporal)
+        conn.execute(f"PRAGMA page_size = {int(page_size)};")
         conn.execute("PRAGMA journal_mode = OFF;")
-        
-        # Cerrar la conexión
+        conn.execute("PRAGMA synchronous = OFF;")
+
+        start = time.perf_counter()
+        if excel_to_csv(excel_path, raw_csv_path, chunk_size) == 0:
+            raise ValueError(f"Workbook {excel_path} has no rows")
+        timings["read"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        schema, chunks = cleaned_chunks(raw_csv_path, clean_func, chunk_size)
+        with conn:
+            create_table(conn, name_db, schema)
+        timings["clean"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for df in chunks:
+            with conn:
+                insert_rows(conn, name_db, df)
+            if csv_path:
+                df.to_csv(csv_path, index=False, encoding="utf-8", mode="a" if rows else "w", header=not rows)
+            rows += len(df)
+        timings["load"] = time.perf_counter() - start
+
+        if rows == 0:
+            raise ValueError(f"Workbook {excel_path} has no rows after cleaning")
+
+        start = time.perf_counter()
+        with conn:
+            create_indexes(conn, name_db)
+        timings["index"] = time.perf_counter() - start
+
+        # Estadísticas para el planificador y compactación
+        start = time.perf_counter()
+        conn.execute("ANALYZE;")
+        conn.execute("VACUUM;")
+        # Modo de journal persistente por defecto: la base de datos se abre en solo lectura
+        conn.execute("PRAGMA journal_mode = DELETE;")
+        timings["analyze"] = time.perf_counter() - start
+    finally:
         conn.close()
-        print(f"El archivo CSV {csv_path} ha generado una base de datos en {database_path}")
-    
-    return db_dict
+        if os.path.exists(raw_csv_path):
+            os.remove(raw_csv_path)
+    os.replace(tmp_path, database_path)
+
+    # Esquema precalculado (tipos, filas de ejemplo y valores de los campos requeridos) para los prompts de text2sql
+    start = time.perf_counter()
+    save_schema_catalog(build_schema_catalog(database_path), schema_path(database_path))
+    timings["schema"] = time.perf_counter() - start
+    return name_db, rows, timings
+
+
+#ETL INCREMENTAL
+def build_databases(excel_dir, db_dir, workers=None, chunk_size=20000, page_size=8192, full=False, csv_dir=None):
+    """
+    Genera una base de datos SQLite por cada libro Excel de excel_dir procesando sólo los libros nuevos o modificados
+    (por hash de contenido). Si cambian las funciones de limpieza se regeneran todas.
+
+    Devuelve:
+        -db_dict: dict. Diccionario con el nombre de la base de datos como clave y su URI como valor.
+    """
+    os.makedirs(db_dir, exist_ok=True)
+    manifest = {"files": {}} if full else load_manifest(db_dir)
+    cleaners_sha256 = file_sha256(CLEANERS_PATH) if os.path.exists(CLEANERS_PATH) else None
+    previous = manifest["files"] if manifest.get("cleaners_sha256") == cleaners_sha256 else {}
+
+    start = time.perf_counter()
+    workbooks = {}
+    for file in sorted(os.listdir(excel_dir)):
+        if file.endswith(".xlsx") or file.endswith(".xls"):
+            workbooks[file.rsplit('.', 1)[0]] = (os.path.join(excel_dir, file), file_sha256(os.path.join(excel_dir, file)))
+    to_process = [
+        name for name, (_, sha) in workbooks.items()
+        if previous.get(name, {}).get("sha256") != sha or not os.path.exists(os.path.join(db_dir, f"{name}.db"))
+    ]
+    print(f"Libros: {len(workbooks)} | nuevos o modificados: {len(to_process)} | hash: {time.perf_counter() - start:.1f}s")
+
+    files = {name: entry for name, entry in previous.items() if name in workbooks and name not in to_process}
+    totals = {}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(build_database, workbooks[name][0], name, db_dir, chunk_size, page_size, csv_dir): name
+            for name in to_process
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                name, rows, timings = future.result()
+            except Exception as e:
+                print(f"Error al procesar el libro '{name}': {e}")
+                continue
+            files[name] = {"sha256": workbooks[name][1], "rows": rows}
+            for stage, seconds in timings.items():
+                totals[stage] = totals.get(stage, 0.0) + seconds
+            print(f"  {name}: {rows} filas | " + " | ".join(f"{stage} {seconds:.1f}s" for stage, seconds in timings.items()))
+    if to_process:
+        print(f"ETL en {time.perf_counter() - start:.1f}s | suma por etapa: " + " | ".join(f"{stage} {seconds:.1f}s" for stage, seconds in totals.items()))
+
+    save_manifest(db_dir, {"cleaners_sha256": cleaners_sha256, "files": files})
+    return {name: f"sqlite:///{os.path.join(db_dir, f'{name}.db')}" for name in files}
 
 
-csv_dict = get_csv_dict(EXCEL_dir)
-clean_csv(csv_dict, clean_df_functions, CSV_dir)
-db_dict = create_ddbb_path(csv_dict)
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ETL de libros Excel a bases de datos SQLite")
+    parser.add_argument("--excel-dir", default=EXCEL_dir)
+    parser.add_argument("--db-dir", default=DB_DIR)
+    parser.add_argument("--workers", type=int, default=None, help="Procesos (un libro por proceso)")
+    parser.add_argument("--chunk-size", type=int, default=20000, help="Filas por bloque de lectura e inserción. Los libros con función de limpieza se limpian enteros en memoria")
+    parser.add_argument("--page-size", type=int, default=8192, help="Tamaño de página de SQLite")
+    parser.add_argument("--full", action="store_true", help="Regenera todas las bases de datos")
+    parser.add_argument("--write-csv", action="store_true", help=f"Escribe también los CSV limpios en {CSV_dir}")
+    args = parser.parse_args()
+    build_databases(args.excel_dir, args.db_dir, args.workers, args.chunk_size, args.page_size, args.full, CSV_dir if args.write_csv else None)
@@ -1,33 +1,75 @@
 #CARGA DE DOCUMENTOS PDF
-from langchain_community.document_loaders import PyPDFDirectoryLoader
+from langchain_community.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
 from langchain_openai import OpenAIEmbeddings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import openai
 import os
 import sys
+import json
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+from dotenv import load_dotenv
 current_script_path = os.path.abspath(__file__)
 app_directory_path = os.path.dirname(os.path.dirname(current_script_path))
 sys.path.append(app_directory_path)
 from directories import PDF_dir, DB_DIR
+from embedding_store import CachedEmbeddings
+from bm25_index import BM25Index
+from vector_index import INDEX_TYPES, SOURCE_INDEX_NAME, SERVING_INDEX_NAME, publish_serving_index
 
 
 
 #-----------------------------------------------------------------------------------------------------
 
-#CARGA DE DOCUMENTOS PDF
-def get_pdf_docs(PDF_dir):
+# El servidor lee el .env al cargar base_models: la ingesta usa la misma configuración
+load_dotenv()
+
+MANIFEST_NAME = "ingest_manifest.json"
+
+
+#MODELO DE EMBEDDINGS
+def embeddings_model():
+    """
+    Mismo modelo que ModelRegistry.embeddings() en el servidor (LLM_EMBEDDINGS_MODEL o, sin él, el de OpenAIEmbeddings):
+    la clave de la caché incluye el modelo y el índice FAISS sólo sirve para consultas embebidas con el mismo.
     """
-    Genera una lista de textos a partir de archivos PDF en un directorio.
+    model = os.getenv("LLM_EMBEDDINGS_MODEL")
+    return OpenAIEmbeddings(model=model) if model else OpenAIEmbeddings()
 
-    Parametros:
-        - PDF_dir: String indicando la localización del directorio de pdfs.
 
-    Devuelve:
-        - list_docs: Lista de Documents, uno por cada página (no por documento). Cada uno contiene page_content y algunos metadatos.
+#HASH DEL CONTENIDO DE UN ARCHIVO
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+#MANIFIESTO DE ARCHIVOS INDEXADOS
+def load_manifest(db_dir):
     """
-    loader = PyPDFDirectoryLoader(PDF_dir)
-    list_docs = loader.load()
-    return list_docs
+    Devuelve el manifiesto de la última ingesta: {"files": {ruta relativa: {"sha256": ..., "ids": [...], "pages": ...}}}.
+    """
+    path = os.path.join(db_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {"files": {}}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(db_dir, manifest):
+    # Escritura atómica: el manifiesto nunca queda a medias
+    path = os.path.join(db_dir, MANIFEST_NAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
 
 
 #DIVISIÓN EN CHUNKS
@@ -50,15 +92,177 @@ def get_docs_chunk(list_docs):
     return chunked_docs
 
 
-embeddings = OpenAIEmbeddings()
-list_docs = get_pdf_docs(PDF_dir)
-print("Número de páginas cargadas: ", len(list_docs))
-chunked_docs = get_docs_chunk(list_docs)
-print("Número de chunks generados: ", len(chunked_docs))
-db = FAISS.from_documents(chunked_docs, embeddings) #FAISS.from_documents ya que los chunks tienen un contenido y metadata.
-db.save_local(DB_DIR)
-print(db.index.ntotal)
+#CARGA Y DIVISIÓN DE UN PDF (se ejecuta en un proceso del pool)
+def load_and_chunk(path, relative_path, sha256):
+    """
+    Lee un PDF y lo divide en chunks.
+
+    Parámetros:
+        - path: ruta del PDF.
+        - relative_path: ruta relativa al directorio de PDFs. Se guarda como "source" en los metadatos.
+        - sha256: hash del contenido. Se usa para generar ids estables de los chunks.
+
+    Devuelve:
+        - (relative_path, número de páginas, lista de (id, texto, metadatos))
+    """
+    pages = PyPDFLoader(path).load()
+    for page in pages:
+        page.metadata["source"] = relative_path
+    chunks = get_docs_chunk(pages)
+    items = [(f"{sha256[:16]}-{i}", chunk.page_content, chunk.metadata) for i, chunk in enumerate(chunks)]
+    return relative_path, len(pages), items
+
+
+#EMBEDDINGS POR LOTES
+async def embed_texts(embeddings, texts, batch_size=64, concurrency=4, max_retries=6):
+    """
+    Calcula los embeddings por lotes con concurrencia acotada. Los errores de límite de peticiones
+    y de conexión se reintentan con espera exponencial (con jitter).
+
+    Devuelve:
+        - Lista de vectores en el mismo orden que texts.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    done = 0
+    start = time.perf_counter()
+
+    async def embed_batch(batch):
+        nonlocal done
+        async with semaphore:
+            for attempt in range(max_retries):
+                try:
+                    vectors = await embeddings.aembed_documents(batch)
+                    break
+                except (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError) as e:
+                    if attempt == max_retries - 1:
+                        raise
+                    delay = min(60, 2 ** attempt) + random.random()
+                    print(f"Embedding retry {attempt + 1}/{max_retries} in {delay:.1f}s: {e}")
+                    await asyncio.sleep(delay)
+        done += len(batch)
+        print(f"  embeddings: {done}/{len(texts)} chunks ({done / (time.perf_counter() - start):.1f} chunks/s)")
+        return vectors
+
+    results = await asyncio.gather(*(embed_batch(batch) for batch in batches))
+    return [vector for batch_vectors in results for vector in batch_vectors]
+
+
+#INGESTA INCREMENTAL
+def ingest(pdf_dir, db_dir, workers=None, batch_size=64, concurrency=4, full=False, index_config=None):
+    """
+    Actualiza el índice FAISS de db_dir con los PDFs de pdf_dir procesando sólo los archivos nuevos o modificados.
+        - Los archivos se comparan con el manifiesto por hash de contenido.
+        - Los chunks de archivos modificados o eliminados se borran del índice plano (flat.faiss).
+        - Los archivos nuevos o modificados se leen y dividen en un pool de procesos y se embeben por lotes.
+        - A partir del índice plano se publica el índice del servidor (index.faiss) del tipo indicado en
+          index_config: {"index_type": flat|ivf|hnsw|ivfpq, "nlist": ..., "hnsw_m": ..., "pq_m": ...}.
+    """
+    index_config = index_config or {"index_type": "flat"}
+    os.makedirs(db_dir, exist_ok=True)
+    # Caché persistente de embeddings: los chunks ya embebidos en ingestas anteriores no se vuelven a pedir
+    embeddings = CachedEmbeddings(
+        embeddings_model(),
+        store_path=os.getenv("EMBEDDING_CACHE_PATH", os.path.join(DB_DIR, "embeddings_cache.sqlite"))
+    )
+    manifest = {"files": {}} if full else load_manifest(db_dir)
+    # El índice plano es la fuente de la ingesta incremental. En instalaciones antiguas sólo existe index.faiss (plano)
+    source_name = SOURCE_INDEX_NAME
+    if not os.path.exists(os.path.join(db_dir, f"{SOURCE_INDEX_NAME}.faiss")):
+        source_name = SERVING_INDEX_NAME
+    index_exists = os.path.exists(os.path.join(db_dir, f"{source_name}.faiss")) and not full
+
+    # 1. Detección de cambios
+    current = {}
+    for root, _, files in os.walk(pdf_dir):
+        for file in files:
+            if file.lower().endswith(".pdf"):
+                path = os.path.join(root, file)
+                current[os.path.relpath(path, pdf_dir)] = file_sha256(path)
+
+    previous = manifest["files"] if index_exists else {}
+    to_process = [name for name, sha in current.items() if previous.get(name, {}).get("sha256") != sha]
+    to_remove = [name for name in previous if name not in current or name in to_process]
+    print(f"PDFs: {len(current)} | nuevos o modificados: {len(to_process)} | eliminados o a reemplazar: {len(to_remove)}")
+
+    # 2. Lectura y división en chunks en paralelo
+    start = time.perf_counter()
+    total_pages = 0
+    parsed = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(load_and_chunk, os.path.join(pdf_dir, name), name, current[name]) for name in to_process]
+        for future in as_completed(futures):
+            name, pages, items = future.result()
+            parsed[name] = (pages, items)
+            total_pages += pages
+            elapsed = time.perf_counter() - start
+            print(f"  {name}: {pages} páginas, {len(items)} chunks ({total_pages / elapsed:.1f} páginas/s)")
+    parse_seconds = time.perf_counter() - start
+
+    items = [item for name in to_process for item in parsed[name][1]]
+    print(f"Lectura: {total_pages} páginas y {len(items)} chunks en {parse_seconds:.1f}s")
+
+    # 3. Embeddings por lotes
+    start = time.perf_counter()
+    vectors = asyncio.run(embed_texts(embeddings, [text for _, text, _ in items], batch_size, concurrency)) if items else []
+    embed_seconds = time.perf_counter() - start
+    if items:
+        print(f"Embeddings: {len(items)} chunks en {embed_seconds:.1f}s ({len(items) / embed_seconds:.1f} chunks/s, {embeddings.hits} desde caché)")
+
+    # 4. Actualización del índice: se borran los chunks antiguos y se añaden los nuevos
+    ids = [chunk_id for chunk_id, _, _ in items]
+    text_embeddings = [(text, vector) for (_, text, _), vector in zip(items, vectors)]
+    metadatas = [metadata for _, _, metadata in items]
+    if index_exists:
+        db = FAISS.load_local(db_dir, embeddings, index_name=source_name, allow_dangerous_deserialization=True)
+        stale_ids = [chunk_id for name in to_remove for chunk_id in previous[name]["ids"]]
+        if stale_ids:
+            db.delete(stale_ids)
+        if items:
+            db.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+    elif items:
+        db = FAISS.from_embeddings(text_embeddings, embeddings, metadatas=metadatas, ids=ids)
+    else:
+        print("No hay documentos que indexar")
+        return None
+
+    changed = bool(to_process or to_remove) or source_name != SOURCE_INDEX_NAME
+    if changed:
+        db.save_local(db_dir, index_name=SOURCE_INDEX_NAME)
+
+    # Índice léxico BM25 sobre los mismos chunks para la recuperación híbrida
+    bm25_path = os.path.join(db_dir, "bm25.pkl")
+    if changed or not os.path.exists(bm25_path):
+        start = time.perf_counter()
+        doc_ids = list(db.index_to_docstore_id.values())
+        BM25Index.build(doc_ids, [db.docstore.search(doc_id).page_content for doc_id in doc_ids]).save(bm25_path)
+        print(f"Índice BM25 de {len(doc_ids)} chunks construido en {time.perf_counter() - start:.1f}s")
+
+    # 5. Publicación del índice del servidor si cambian los documentos o la configuración del índice
+    if changed or manifest.get("index") != index_config or not os.path.exists(os.path.join(db_dir, f"{SERVING_INDEX_NAME}.faiss")):
+        start = time.perf_counter()
+        publish_serving_index(db, db_dir, **index_config)
+        print(f"Índice '{index_config['index_type']}' publicado en {time.perf_counter() - start:.1f}s")
+
+    files = {name: entry for name, entry in previous.items() if name in current and name not in to_process}
+    files.update({name: {"sha256": current[name], "ids": [chunk_id for chunk_id, _, _ in parsed[name][1]], "pages": parsed[name][0]} for name in to_process})
+    save_manifest(db_dir, {"files": files, "index": index_config})
+    print(f"Vectores en el índice: {db.index.ntotal}")
+    return db
 
-#local_index.merge_from(faiss_db) Para incorporar nueva información
-#local_index.save_local(FAISS_USERGUIDE_INDEX)
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingesta incremental de PDFs en el índice FAISS")
+    parser.add_argument("--pdf-dir", default=PDF_dir)
+    parser.add_argument("--db-dir", default=DB_DIR)
+    parser.add_argument("--workers", type=int, default=None, help="Procesos para leer y dividir los PDFs")
+    parser.add_argument("--batch-size", type=int, default=64, help="Chunks por llamada de embeddings")
+    parser.add_argument("--concurrency", type=int, default=4, help="Llamadas de embeddings simultáneas")
+    parser.add_argument("--full", action="store_true", help="Reconstruye el índice desde cero")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat", help="Tipo del índice que carga el servidor")
+    parser.add_argument("--nlist", type=int, default=256, help="Listas de los índices IVF")
+    parser.add_argument("--hnsw-m", type=int, default=32, help="Vecinos por nodo del índice HNSW")
+    parser.add_argument("--pq-m", type=int, default=16, help="Subvectores de la cuantización PQ")
+    args = parser.parse_args()
+    index_config = {"index_type": args.index_type, "nlist": args.nlist, "hnsw_m": args.hnsw_m, "pq_m": args.pq_m}
+    ingest(args.pdf_dir, args.db_dir, args.workers, args.batch_size, args.concurrency, args.full, index_config)
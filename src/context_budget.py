@@ -0,0 +1,181 @@
+import os
+import ast
+import logging
+from typing import Dict, List, Optional
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableLambda
+from src.metrics import metrics
+from src.sql_executor import QueryResult
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except Exception: # tiktoken no instalado o sin acceso a la codificación: se estima con ~4 caracteres por token
+    _ENCODING = None
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def truncate_tokens(text: str, budget: int) -> str:
+    """
+    Recorta el texto a `budget` tokens añadiendo "…" si se ha recortado.
+    """
+    if budget <= 0:
+        return ""
+    if count_tokens(text) <= budget:
+        return text
+    if _ENCODING is not None:
+        return _ENCODING.decode(_ENCODING.encode(text, disallowed_special=())[:budget]) + "…"
+    return text[:budget * 4] + "…"
+
+
+# Runnable que se coloca entre el prompt y el LLM para registrar los tokens del prompt de cada cadena
+def prompt_token_meter(chain_name: str) -> RunnableLambda:
+    def measure(prompt_value):
+        metrics.observe(f"prompt_tokens.{chain_name}", count_tokens(prompt_value.to_string()))
+        return prompt_value
+    return RunnableLambda(measure)
+
+
+class ContextAssembler:
+    """
+    Construye las partes variables de los prompts respetando un presupuesto de tokens:
+        - history: últimos turnos, con las respuestas del bot recortadas, hasta history_tokens.
+        - documents: chunks del RAG sin duplicados ni solapes, hasta context_tokens.
+        - sql_result: filas de la consulta SQL en forma de tabla compacta, hasta max_rows filas y result_tokens.
+    """
+
+    def __init__(self, history_tokens: int = 600, bot_turn_tokens: int = 150, context_tokens: int = 1500, result_tokens: int = 1500, max_rows: int = 20):
+        self.history_tokens = history_tokens
+        self.bot_turn_tokens = bot_turn_tokens
+        self.context_tokens = context_tokens
+        self.result_tokens = result_tokens
+        self.max_rows = max_rows
+
+    @classmethod
+    def from_env(cls) -> "ContextAssembler":
+        return cls(
+            history_tokens=int(os.getenv("PROMPT_HISTORY_TOKENS", 600)),
+            bot_turn_tokens=int(os.getenv("PROMPT_BOT_TURN_TOKENS", 150)),
+            context_tokens=int(os.getenv("PROMPT_CONTEXT_TOKENS", 1500)),
+            result_tokens=int(os.getenv("PROMPT_RESULT_TOKENS", 1500)),
+            max_rows=int(os.getenv("PROMPT_MAX_ROWS", 20)),
+        )
+
+    #------HISTORIAL------
+    def history(self, entries: List[Dict]) -> str:
+        """
+        Recorre los turnos del más reciente al más antiguo hasta agotar el presupuesto y los devuelve en orden cronológico.
+        """
+        lines = []
+        used = 0
+        for entry in reversed(entries):
+            turn = [f"user: {entry['user']}", f"bot: {truncate_tokens(entry['bot'], self.bot_turn_tokens)}"]
+            tokens = count_tokens("\n".join(turn))
+            if used + tokens > self.history_tokens:
+                break
+            lines = turn + lines
+            used += tokens
+        return "\n".join(lines)
+
+    #------DOCUMENTOS DEL RAG------
+    @staticmethod
+    def _span(document: Document):
+        start = document.metadata.get("start_index")
+        if start is None:
+            return None
+        return (document.metadata.get("source"), document.metadata.get("page"), start, start + len(document.page_content))
+
+    def documents(self, documents: List[Document]) -> str:
+        """
+        Elimina chunks repetidos, une los chunks contiguos que se solapan (mismo archivo y página) y
+        devuelve el texto de los chunks en orden de relevancia hasta agotar el presupuesto.
+        """
+        kept = [] # [texto, span]
+        seen = set()
+        for document in documents:
+            normalized = " ".join(document.page_content.split())
+            if normalized in seen:
+                continue
+            seen.add(normalized)
+            span = self._span(document)
+            for item in kept:
+                other = item[1]
+                if span and other and span[:2] == other[:2] and span[2] < other[3] and other[2] < span[3]:
+                    # Se añade sólo la parte que no se solapa
+                    if span[2] >= other[2]:
+                        item[0] += document.page_content[other[3] - span[2]:]
+                    else:
+                        item[0] = document.page_content[:other[2] - span[2]] + item[0]
+                    item[1] = (span[0], span[1], min(span[2], other[2]), max(span[3], other[3]))
+                    break
+            else:
+                kept.append([document.page_content, span])
+
+        parts = []
+        used = 0
+        for text, span in kept:
+            source = f"[{span[0]} p.{span[1]}]\n" if span else ""
+            budget = self.context_tokens - used
+            if budget <= 0:
+                break
+            part = truncate_tokens(source + text, budget)
+            parts.append(part)
+            used += count_tokens(part)
+        return "\n\n".join(parts)
+
+    #------RESULTADO SQL------
+    def sql_result(self, result, columns: Optional[List[str]] = None) -> str:
+        """
+        Devuelve las filas como una tabla separada por "|" con una cabecera con los nombres de columna,
+        limitada a max_rows filas y al presupuesto de tokens. Acepta un QueryResult, su resumen guardado en sesión
+        o (sesiones antiguas) la representación en texto de la lista de filas.
+        """
+        truncated = False
+        if isinstance(result, dict):
+            result = QueryResult.from_summary(result)
+        if isinstance(result, QueryResult):
+            columns = result.columns
+            rows = result.rows()
+            total = result.row_count
+            truncated = result.truncated
+        else:
+            rows = result
+            if isinstance(result, str):
+                try:
+                    rows = ast.literal_eval(result) if result else []
+                except (ValueError, SyntaxError):
+                    return truncate_tokens(result, self.result_tokens)
+            rows = rows or []
+            total = len(rows)
+        if not total:
+            return "Sin resultados"
+
+        lines = [" | ".join(columns)] if columns else []
+        used = count_tokens(lines[0]) if lines else 0
+        shown = 0
+        for row in rows[:self.max_rows]:
+            line = " | ".join("" if value is None else str(value) for value in row)
+            tokens = count_tokens(line)
+            if used + tokens > self.result_tokens:
+                break
+            lines.append(line)
+            used += tokens
+            shown += 1
+        if truncated:
+            lines.append(f"(se muestran {shown} filas de más de {total})")
+        elif shown < total:
+            lines.append(f"({total - shown} filas más)")
+        return "\n".join(lines)
+
+
+# Instancia compartida por las cadenas
+context_assembler = ContextAssembler.from_env()
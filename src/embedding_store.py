@@ -0,0 +1,165 @@
+import os
+import sqlite3
+import asyncio
+import hashlib
+import logging
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Envoltorio de un modelo de embeddings con caché persistente direccionada por contenido.
+        - Clave: sha256(nombre del modelo + texto). Cambiar de modelo no reutiliza vectores de otro modelo.
+        - Nivel 1: LRU en memoria (memory_entries) para las preguntas repetidas.
+        - Nivel 2: SQLite (WAL) compartido por la ingesta de PDFs y por los workers del servidor.
+    Sólo se llama al modelo para los textos que no están en ninguno de los dos niveles.
+    En la interfaz asíncrona el acceso a SQLite se hace en un hilo dedicado (nunca en el event loop) y la escritura
+    de los vectores nuevos no se espera: ya están en el nivel 1.
+    No importa módulos de src para poder usarse desde los scripts de src/config.
+    """
+
+    def __init__(self, embeddings: Embeddings, store_path: str, model_name: Optional[str] = None, memory_entries: int = 2048):
+        self.embeddings = embeddings
+        self.model_name = model_name or getattr(embeddings, "model", embeddings.__class__.__name__)
+        self.store_path = store_path
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock() # Protege el nivel 1. Nunca se mantiene durante el acceso a SQLite
+        self._db_lock = threading.Lock() # Serializa el uso de la conexión entre la interfaz síncrona y el hilo dedicado
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding-store")
+        self.hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(store_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(store_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL)")
+        self._conn.commit()
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vector: List[float]):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    #------LECTURA Y ESCRITURA DE LA CACHÉ------
+    def _lookup_memory(self, texts: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self._lock:
+            for text in texts:
+                key = self._key(text)
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[text] = self._memory[key]
+        return found
+
+    def _lookup_store(self, texts: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        keys = {self._key(text): text for text in texts}
+        pending = list(keys)
+        rows = []
+        with self._db_lock:
+            # Lotes para no superar el límite de variables de SQLite
+            for i in range(0, len(pending), 500):
+                batch = pending[i:i + 500]
+                rows += self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+        with self._lock:
+            for key, blob in rows:
+                vector = np.frombuffer(blob, dtype=np.float32).tolist()
+                self._remember(key, vector)
+                found[keys[key]] = vector
+        return found
+
+    def _remember_all(self, texts: List[str], vectors: List[List[float]]) -> List[tuple]:
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                key = self._key(text)
+                self._remember(key, vector)
+                rows.append((key, self.model_name, np.asarray(vector, dtype=np.float32).tobytes()))
+        return rows
+
+    def _write(self, rows: List[tuple]):
+        with self._db_lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, model, vector) VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+
+    def _lookup(self, texts: List[str]) -> Dict[str, List[float]]:
+        found = self._lookup_memory(texts)
+        remaining = [text for text in texts if text not in found]
+        if remaining:
+            found.update(self._lookup_store(remaining))
+        self.hits += len(found)
+        return found
+
+    async def _alookup(self, texts: List[str]) -> Dict[str, List[float]]:
+        found = self._lookup_memory(texts)
+        remaining = [text for text in texts if text not in found]
+        if remaining:
+            found.update(await asyncio.get_running_loop().run_in_executor(self._executor, self._lookup_store, remaining))
+        self.hits += len(found)
+        return found
+
+    def _store(self, texts: List[str], vectors: List[List[float]]):
+        self._write(self._remember_all(texts, vectors))
+
+    def _astore(self, texts: List[str], vectors: List[List[float]]):
+        # La escritura se encola en el hilo dedicado sin esperarla; un bloqueo del escritor no retrasa la respuesta
+        future = asyncio.get_running_loop().run_in_executor(self._executor, self._write, self._remember_all(texts, vectors))
+        future.add_done_callback(self._log_write_error)
+
+    @staticmethod
+    def _log_write_error(future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Cannot persist embeddings: {future.exception()}")
+
+    def _missing(self, texts: List[str], found: Dict[str, List[float]]) -> List[str]:
+        # Textos sin embedding, sin duplicados y en el orden original
+        missing = list(dict.fromkeys(text for text in texts if text not in found))
+        self.misses += len(missing)
+        return missing
+
+    #------INTERFAZ DE EMBEDDINGS------
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        found = self._lookup(texts)
+        missing = self._missing(texts, found)
+        if missing:
+            vectors = self.embeddings.embed_documents(missing)
+            self._store(missing, vectors)
+            found.update(zip(missing, vectors))
+        return [found[text] for text in texts]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        found = await self._alookup(texts)
+        missing = self._missing(texts, found)
+        if missing:
+            vectors = await self.embeddings.aembed_documents(missing)
+            self._astore(missing, vectors)
+            found.update(zip(missing, vectors))
+        return [found[text] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+    def close(self):
+        # Espera a las escrituras pendientes antes de cerrar la conexión
+        self._executor.shutdown(wait=True)
+        self._conn.close()
@@ -0,0 +1,87 @@
+import re
+import json
+import logging
+import unicodedata
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+# Registro de decisiones (JSON por línea) para ajustar el clasificador offline
+decision_logger = logging.getLogger("router.preclassifier")
+
+SEARCH_ROUTE = "búsqueda"
+INFO_ROUTE = "información"
+PRESENTATION_ROUTE = "presentación"
+
+
+def normalize_text(text: str) -> str:
+    """
+    Pasa el texto a minúsculas y elimina tildes y diéresis (búsqueda -> busqueda).
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+
+class IntentPrediction(NamedTuple):
+    route: Optional[str] # Ruta propuesta. None si no hay ninguna regla que aplique
+    confidence: float # Confianza entre 0 y 1
+    scores: Dict[str, float] # Puntuación acumulada por ruta
+
+
+# Reglas (ruta, patrón sobre texto normalizado, peso). Los patrones de búsqueda cubren los campos tipo/operacion/poblacion
+DEFAULT_RULES: List[Tuple[str, str, float]] = [
+    # tipo
+    (SEARCH_ROUTE, r"\b(piso|pisos|casa|casas|chalet|chalets|atico|aticos|apartamento|apartamentos|duplex|estudio|estudios|local|locales|garaje|garajes|vivienda|viviendas|adosado|adosados|oficina|oficinas|trastero|trasteros)\b", 1.5),
+    # operacion
+    (SEARCH_ROUTE, r"\b(alquiler|alquilar|alquilo|en renta|comprar|compro|compra|venta|vender)\b", 1.5),
+    # poblacion y filtros típicos
+    (SEARCH_ROUTE, r"\b(en|por|cerca de) [a-z]+\b.*\b(habitacion|habitaciones|dormitorio|dormitorios|banos|metros|m2)\b", 1.0),
+    (SEARCH_ROUTE, r"\b(busco|buscando|quiero (un|una)|me interesa (un|una)|hay (algun|alguna)|tienes (algun|alguna))\b", 1.0),
+    (SEARCH_ROUTE, r"\d+\s*(€|euros|eur)\b|\b(menos de|mas de|hasta|entre) \d+", 1.0),
+    (SEARCH_ROUTE, r"\b\d+\s*(habitacion|habitaciones|dormitorio|dormitorios|banos)\b", 1.0),
+    # información sobre la empresa y sus servicios
+    (INFO_ROUTE, r"\b(politica|politicas|condiciones|requisitos|documentacion|documentos|contrato|contratos|fianza|aval|garantia|hipoteca|hipotecas|comision|comisiones|honorarios|impuestos|seguro|seguros|tasacion)\b", 1.5),
+    (INFO_ROUTE, r"\b(como funciona|que necesito|que pasa si|como puedo|horario|horarios|oficina central|contacto|telefono)\b", 1.0),
+    # presentación / saludos
+    (PRESENTATION_ROUTE, r"^\s*(hola|buenas|buenos dias|buenas tardes|buenas noches|hey|saludos)\b", 1.5),
+    (PRESENTATION_ROUTE, r"\b(quien eres|que eres|que puedes hacer|en que me puedes ayudar|gracias|adios|hasta luego)\b", 1.5),
+]
+
+
+class KeywordIntentClassifier:
+    """
+    Pre-clasificador local basado en reglas. Cada regla que coincide suma su peso a su ruta.
+    La confianza mide el margen entre la ruta ganadora y la segunda: (primera - segunda) / (primera + smoothing).
+    """
+
+    def __init__(self, rules: List[Tuple[str, str, float]] = DEFAULT_RULES, smoothing: float = 0.5):
+        self.rules = [(route, re.compile(pattern), weight) for route, pattern, weight in rules]
+        self.smoothing = smoothing
+
+    def classify(self, input: str, history: str = "") -> IntentPrediction:
+        text = normalize_text(input)
+        scores = {}
+        for route, pattern, weight in self.rules:
+            if pattern.search(text):
+                scores[route] = scores.get(route, 0.0) + weight
+        if not scores:
+            return IntentPrediction(None, 0.0, scores)
+
+        ranking = sorted(scores.values(), reverse=True)
+        best_route = max(scores, key=scores.get)
+        second = ranking[1] if len(ranking) > 1 else 0.0
+        confidence = (ranking[0] - second) / (ranking[0] + self.smoothing)
+        return IntentPrediction(best_route, confidence, scores)
+
+
+# Registra la decisión del pre-clasificador y, si se conoce, la del LLM para medir su concordancia
+def log_decision(input: str, prediction: IntentPrediction, source: str, llm_route: Optional[str] = None):
+    record = {
+        "input": input,
+        "pre_route": prediction.route,
+        "confidence": round(prediction.confidence, 3),
+        "scores": prediction.scores,
+        "source": source, # "pre_classifier" | "llm" | "shadow"
+        "llm_route": llm_route,
+        "agreement": None if llm_route is None or prediction.route is None else prediction.route == llm_route,
+    }
+    decision_logger.info(json.dumps(record, ensure_ascii=False))
@@ -0,0 +1,109 @@
+import time
+import asyncio
+import httpx
+from typing import Optional
+from src.metrics import metrics
+
+
+class TokenBucket:
+    """
+    Limitador de peticiones por token bucket: `rate` peticiones por segundo con ráfagas de hasta `capacity`.
+    Sólo se usa desde el event loop, por lo que no necesita lock.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """
+    Cuerpo de la respuesta que libera el hueco de concurrencia al cerrarse. En las respuestas en streaming
+    el hueco se mantiene hasta que se termina (o se abandona) el stream, no sólo hasta recibir las cabeceras.
+    """
+
+    def __init__(self, stream: httpx.AsyncByteStream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
+
+
+class LimitedTransport(httpx.AsyncBaseTransport):
+    """
+    Transporte de un modelo sobre el transporte compartido (un único pool de conexiones keep-alive para todos los modelos):
+        - max_concurrency: peticiones simultáneas del modelo (0 = sin límite).
+        - requests_per_minute: token bucket de peticiones (0 = sin límite). Cada reintento del cliente de OpenAI cuenta.
+    Cerrar el cliente del modelo no cierra el transporte compartido; lo cierra el ModelRegistry.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, name: str, max_concurrency: int = 0, requests_per_minute: float = 0):
+        self.transport = transport
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.bucket = TokenBucket(requests_per_minute / 60) if requests_per_minute > 0 else None
+        self.in_flight = 0
+        # El semáforo se crea en el primer uso, dentro del event loop (los modelos se construyen en hilos durante el arranque)
+        self._semaphore = None
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        start = time.perf_counter()
+        if self.max_concurrency > 0:
+            if self._semaphore is None:
+                self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            await self._semaphore.acquire()
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self.in_flight -= 1
+                metrics.gauge(f"llm.{self.name}.in_flight", self.in_flight)
+                if self._semaphore is not None:
+                    self._semaphore.release()
+
+        self.in_flight += 1
+        metrics.gauge(f"llm.{self.name}.in_flight", self.in_flight)
+        try:
+            if self.bucket is not None:
+                await self.bucket.acquire()
+            metrics.observe(f"llm.{self.name}.wait_seconds", time.perf_counter() - start)
+            metrics.incr(f"llm.{self.name}.requests")
+            response = await self.transport.handle_async_request(request)
+        except BaseException:
+            release()
+            raise
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_ReleasingStream(response.stream, release),
+            extensions=response.extensions,
+            request=request
+        )
+
+    async def aclose(self):
+        pass
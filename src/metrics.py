@@ -0,0 +1,64 @@
+import time
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Dict
+
+
+class Metrics:
+    """
+    Registro de métricas en memoria del proceso (contadores, gauges y tiempos).
+    Es seguro entre hilos, ya que algunas métricas se registran desde el pool de ejecución SQL.
+    """
+
+    def __init__(self, window: int = 1024):
+        self._lock = threading.Lock()
+        self._window = window
+        self._counters = defaultdict(int)
+        self._gauges = {}
+        self._timings = {}
+
+    def incr(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    def gauge(self, name: str, value: float):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                timing = {"count": 0, "total": 0.0, "max": 0.0, "window": deque(maxlen=self._window)}
+                self._timings[name] = timing
+            timing["count"] += 1
+            timing["total"] += value
+            timing["max"] = max(timing["max"], value)
+            timing["window"].append(value)
+
+    @contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            timings = {}
+            for name, timing in self._timings.items():
+                window = sorted(timing["window"])
+                timings[name] = {
+                    "count": timing["count"],
+                    "avg": timing["total"] / timing["count"],
+                    "max": timing["max"],
+                    "p50": window[int(0.50 * (len(window) - 1))],
+                    "p99": window[int(0.99 * (len(window) - 1))],
+                }
+            return {"counters": dict(self._counters), "gauges": dict(self._gauges), "timings": timings}
+
+
+# Instancia compartida por todos los componentes de la aplicación
+metrics = Metrics()
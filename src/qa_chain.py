@@ -1,14 +1,17 @@
 import os
 import re
+import copy
 import asyncio
-from sqlalchemy.exc import OperationalError, IntegrityError, SQLAlchemyError
+import sqlite3
+import weakref
+from fastapi import HTTPException
 from langchain_core.runnables import RunnableLambda
 from langchain_community.utilities.sql_database import SQLDatabase
 from langchain_core.output_parsers import StrOutputParser
 from langchain.output_parsers import BooleanOutputParser
 from langchain_core.prompts import PromptTemplate
 from langchain_core.messages import AIMessage
-from typing import Dict, AsyncGenerator, List
+from typing import Dict, AsyncGenerator, Awaitable, List, Optional, Sequence, Union
 from session_manager import SessionData
 from src.utilities import *
 from src.directories import (
@@ -21,6 +24,15 @@ from src.directories import (
 )
 from src.config.base_models import generate_qa_llm, generate_check_llm
 from src.format_answer import qa_format_text
+from src.sql_executor import SQLExecutor, QueryResult
+from src.metrics import metrics
+from src.sql_cache import Text2SQLCache
+from src.schema_catalog import SchemaCatalog
+from src.value_index import ValueIndex
+from src.sql_builder import SQLBuilder
+from src.artifacts import ArtifactManager
+from src.stream_events import StreamEvent, LOADING_DB_START, LOADING_DB_END
+from src.context_budget import context_assembler, prompt_token_meter
 import logging
 
 
@@ -40,9 +52,9 @@ logger = logging.getLogger(__name__)
 
 class QAChain:
     
-    def __init__(self):
-        # Inicializamos el lock para la clase
-        self.lock = asyncio.Lock()
+    def __init__(self, artifacts_dir: str = None):
+        # Locks por sesión (session_id). Las sesiones distintas ejecutan text2sql en paralelo
+        self._session_locks = weakref.WeakValueDictionary()
 
         # Campos requeridos para ejecutar una consulta SQL
         self.required_fields = ["tipo", "operacion", "poblacion"]
@@ -52,11 +64,16 @@ class QAChain:
 
         self.check_llm = generate_check_llm()
 
-        # CONEXIÓN A BASE DE DATOS
-        self.database_path = os.path.join(DB_DIR, f"{db_name}.db")
-        self.db = None
-        self._dialect = None
-        self._table_info = None
+        # Número de resultados que se piden al text2sql (y al SQLBuilder). El diccionario del prompt se construye en cada petición
+        self.top_k = 3
+        # Filas del resultado que se guardan en la sesión (el resto queda referenciado por la consulta)
+        self.session_result_rows = int(os.getenv("SESSION_RESULT_ROWS", 20))
+        # Segundos que se mantiene abierto el pool de una versión anterior tras una recarga (consultas en curso)
+        self.retire_seconds = float(os.getenv("ARTIFACT_RETIRE_SECONDS", 30))
+
+        # RECURSOS DE LA BASE DE DATOS. Se recargan en caliente al publicar una nueva versión (src/artifacts.py)
+        self.sql_executor = None
+        self.swap_resources(self.load_resources(artifacts_dir or ArtifactManager.from_env().current_dir()))
 
         # PROMPTS
         self.text2sql_prompt = PromptTemplate.from_template(GENERATE_SQL_QUERY_PROMPT) # Prompt para la tarea text2sql
@@ -64,21 +81,12 @@ class QAChain:
         self.answer_query_prompt = PromptTemplate.from_template(ANSWER_QUERY_PROMPT) # Prompt para responder a la consulta SQL 
         self.check_query_prompt = PromptTemplate.from_template(CHECK_QUERY_PROMPT) # Prompt para indicar al cliente que es necesaria más información.
         
-        # Diccionario para arrancar la búsqueda en base de datos
-        self.dict_text2sql = {
-            "input": "",
-            "dialect": None,
-            "table_info": None,
-            "top_k": 3,
-            "last_query": ""
-        }
-    
         # CADENAS
         # Cadena para para chequear si se requiere o no nueva búsqueda
-        self.check_new_search_chain = self.new_search_prompt | self.check_llm | BooleanOutputParser(false_val="False", true_val="True")
+        self.check_new_search_chain = self.new_search_prompt | prompt_token_meter("new_search") | self.check_llm | BooleanOutputParser(false_val="False", true_val="True")
 
         # Cadena text2sql con un parsing final para evitar consultas SQL sintácticamente incorrectas
-        self.text2sql_chain = self.text2sql_prompt | self.text2sql_llm | RunnableLambda(self.parsing_sql_query)
+        self.text2sql_chain = self.text2sql_prompt | prompt_token_meter("text2sql") | self.text2sql_llm | RunnableLambda(self.parsing_sql_query)
 
         # Convertimos la función de chequear la consulta en un Runnable
         self.check_query = RunnableLambda(lambda x: self.check_fields_in_query(x))
@@ -87,15 +95,110 @@ class QAChain:
         self.route_check_query_chain = self.text2sql_chain | self.check_query
 
         # Cadena cuando falta en la consulta SQL alguno de los campos requeridos 
-        self.missing_fields_chain = self.check_query_prompt | self.check_llm | StrOutputParser()
+        self.missing_fields_chain = self.check_query_prompt | prompt_token_meter("missing_fields") | self.check_llm | StrOutputParser()
 
         # Cadena cuando se considera que ya se ha recuperado información de la base de datos y se trata de responder al cliente
-        self.answer_chain = self.answer_query_prompt | self.text2sql_llm | StrOutputParser()
+        self.answer_chain = self.answer_query_prompt | prompt_token_meter("answer") | self.text2sql_llm | StrOutputParser()
 
  
+    #------RECURSOS RECARGABLES------
+    def load_resources(self, artifacts_dir: str) -> Dict:
+        """
+        Construye los recursos que dependen de la base de datos de artifacts_dir sin modificar la instancia.
+        Se puede ejecutar en un hilo mientras se atienden peticiones con los recursos actuales.
+        """
+        database_path = os.path.join(artifacts_dir, f"{db_name}.db")
+        if not os.path.exists(database_path):
+            raise FileNotFoundError(f"Database {database_path} not found")
+
+        # Las consultas se ejecutan fuera del event loop, en un pool de conexiones de solo lectura
+        sql_executor = SQLExecutor(
+            database_path,
+            pool_size=int(os.getenv("SQL_POOL_SIZE", 4)),
+            timeout=float(os.getenv("SQL_QUERY_TIMEOUT", 10)),
+            max_rows=int(os.getenv("SQL_MAX_ROWS", 200)),
+            mmap_size=int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+        )
+
+        # Esquema precalculado por generate_sql_dabase.py. Si no existe o está desactualizado se usa la reflexión de SQLDatabase
+        schema_catalog = None
+        if os.getenv("SCHEMA_CATALOG_ENABLED", "true").lower() == "true":
+            schema_catalog = SchemaCatalog.load(
+                database_path,
+                max_listed_values=int(os.getenv("SCHEMA_MAX_LISTED_VALUES", 30))
+            )
+            if schema_catalog is None:
+                logger.warning(f"No up-to-date schema artifact for {database_path}, falling back to SQLDatabase reflection")
+
+        # Índice local de valores de los campos requeridos: detecta campos faltantes antes de llamar al LLM
+        value_index = None
+        if os.getenv("LOCAL_FIELD_RESOLUTION", "true").lower() == "true":
+            try:
+                if schema_catalog is not None:
+                    value_index = ValueIndex.from_catalog(schema_catalog, self.required_fields)
+                else:
+                    value_index = ValueIndex.from_database(database_path, db_name, self.required_fields)
+            except sqlite3.Error as e:
+                logger.error(f"Cannot build the local value index, required fields will be checked by the LLM: {e}")
+
+        # Consultas estructuradas (campos requeridos, precio y habitaciones) compiladas sin LLM
+        sql_builder = None
+        if os.getenv("SQL_BUILDER_ENABLED", "true").lower() == "true" and value_index is not None \
+                and schema_catalog is not None and db_name in schema_catalog.tables:
+            sql_builder = SQLBuilder(
+                db_name,
+                [column["name"] for column in schema_catalog.tables[db_name]["columns"]],
+                value_index,
+                self.required_fields,
+                price_column=os.getenv("SQL_PRICE_COLUMN", "precio"),
+                rooms_column=os.getenv("SQL_ROOMS_COLUMN", "habitaciones"),
+                min_score=float(os.getenv("SQL_BUILDER_MIN_SCORE", 0.85)),
+                limit=self.top_k
+            )
+
+        # Caché input -> SQL y SQL -> resultado. Cada versión de la base de datos empieza con la caché vacía
+        sql_cache = None
+        if os.getenv("SQL_CACHE_ENABLED", "true").lower() == "true":
+            sql_cache = Text2SQLCache(
+                database_path,
+                max_entries=int(os.getenv("SQL_CACHE_MAX_ENTRIES", 256)),
+                ttl=float(os.getenv("SQL_CACHE_TTL", 600))
+            )
+
+        return {
+            "database_path": database_path,
+            "sql_executor": sql_executor,
+            "schema_catalog": schema_catalog,
+            "value_index": value_index,
+            "sql_builder": sql_builder,
+            "sql_cache": sql_cache,
+            "db": None, # Sólo se usa para obtener el dialecto y table_info de los prompts si no hay esquema precalculado
+            "_dialect": None,
+            "_table_info": None
+        }
+
+    def swap_resources(self, resources: Dict):
+        """
+        Sustituye los recursos en un único paso síncrono (sin ceder el event loop). El pool de la versión anterior
+        se cierra pasados retire_seconds para no cortar las consultas en curso.
+        """
+        old_executor = self.sql_executor
+        for name, value in resources.items():
+            setattr(self, name, value)
+        if old_executor is not None:
+            self._retire_executor(old_executor)
+
+    def _retire_executor(self, executor: SQLExecutor):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            executor.close()
+            return
+        loop.call_later(self.retire_seconds, lambda: loop.run_in_executor(None, executor.close))
+
+
     # Función para chequear que la consulta SQL contiene los campos requeridos. Si no hay campos requeridos, retorna una lista vacía
     def check_fields_in_query(self, info: Dict) -> List[str]:
-        self.last_query = info["sql_query"]
         query = info["sql_query"]
         fields_in_query = []
         try:
@@ -128,29 +231,43 @@ class QAChain:
     
 
     #-----EJECUCIÓN CONTRA LA BASE DE DATOS------
-    def execute_query(self, sql_query: str):
+    async def execute_query(self, sql_query: str, sql_template: Optional[str] = None, parameters: Sequence = ()) -> QueryResult:
+        """
+        Ejecuta la consulta en el pool de solo lectura sin bloquear el event loop. Si el cliente se desconecta,
+        la cancelación de la tarea interrumpe la consulta en curso.
+        Las consultas del SQLBuilder se ejecutan parametrizadas (sql_template y parameters); sql_query es su versión
+        con literales y se usa como clave de la caché.
+        Devuelve las filas (como mucho SQL_MAX_ROWS) en formato columnar.
+        """
+        if self.sql_cache is not None:
+            cached_result = self.sql_cache.get_result(sql_query)
+            if cached_result is not None:
+                return cached_result
         try:
-            return self.db.run(sql_query) 
-        except OperationalError as op_err:
+            result = await self.sql_executor.run(sql_template or sql_query, parameters)
+        except asyncio.TimeoutError as timeout_err:
+            logger.error(f"Timeout during SQL execution: {timeout_err}")
+            raise HTTPException(status_code=504, detail="ERROR: SQL execution timed out.")
+        except sqlite3.OperationalError as op_err:
             logger.error(f"OperationalError during SQL execution: {op_err}")
-            raise Exception(status_code=500, detail="ERROR: Operational error during SQL execution.")
-        except IntegrityError as int_err:
+            raise HTTPException(status_code=500, detail="ERROR: Operational error during SQL execution.")
+        except sqlite3.IntegrityError as int_err:
             logger.error(f"IntegrityError during SQL execution: {int_err}")
-            raise Exception(status_code=500, detail="ERROR: Integrity constraint violated during SQL execution.")
-        except TimeoutError as timeout_err:
-            logger.error(f"Timeout during SQL execution: {timeout_err}")
-            raise Exception(status_code=504, detail="ERROR: SQL execution timed out.")
-        except SQLAlchemyError as sql_err:
-            logger.error(f"General SQLAlchemy error during SQL execution: {sql_err}")
-            raise Exception(status_code=500, detail="ERROR: A database error occurred during SQL execution.")
+            raise HTTPException(status_code=500, detail="ERROR: Integrity constraint violated during SQL execution.")
+        except sqlite3.DatabaseError as sql_err:
+            logger.error(f"General database error during SQL execution: {sql_err}")
+            raise HTTPException(status_code=500, detail="ERROR: A database error occurred during SQL execution.")
         except Exception as e:
             logger.info("SQL execution against database failed")
-            raise Exception(status_code=500, detail=f"ERROR: SQL execution against database failed:" + str(e))
+            raise HTTPException(status_code=500, detail=f"ERROR: SQL execution against database failed:" + str(e))
+        if self.sql_cache is not None:
+            self.sql_cache.set_result(sql_query, result)
+        return result
 
 
 
     #------ENRUTADOR------
-    async def route(self, info: Dict, input: str, session: SessionData, history: str) -> AsyncGenerator[str, None]:
+    async def route(self, info: Dict, input: str, session: SessionData, history: str) -> AsyncGenerator[Union[str, StreamEvent], None]:
         """
         Esta función enruta hacia la ejecución y respuesta de la consulta si no hay campos faltantes, o
         hacia una cadena específica para pedir información al usuario. Toma estos parámetros:
@@ -159,20 +276,17 @@ class QAChain:
             - missing_fields(List): campos faltantes. Pasado en el dict "info".
         Devuelve un generador asincrónico.
         """
-        result = ""
         if not info["missing_fields"]:
             # Ejecutamos la consulta SQL
-            yield "loading-db:start"
-            result = self.execute_query(info["sql_query"])
-
-            # Actualizamos la sesión
-            async with self.lock:
-                if(result):
-                    session.qa_data["result"] = result # Actualización de "result" en sesión
-                    text_sql = {"input": input, "sql": info["sql_query"]}
-                    session.qa_data["sql_queries"].append(text_sql) # Actualización de "sql_queries" en sesión
-            logger.info("RESULTADO: "+ str(result))
-            logger.info("RESULTADO EN SESIÓN: "+str(session.qa_data["result"]))
+            yield LOADING_DB_START
+            result = await self.execute_query(info["sql_query"], info.get("sql_template"), info.get("parameters", ()))
+
+            # Actualizamos la sesión (el lock de la sesión ya está tomado en execute)
+            if(result):
+                session.qa_data["result"] = result.summary(self.session_result_rows) # Actualización de "result" en sesión (resumen acotado)
+                text_sql = {"input": input, "sql": info["sql_query"]}
+                session.qa_data["sql_queries"].append(text_sql) # Actualización de "sql_queries" en sesión
+            logger.info(f"RESULTADO: {result.row_count} filas{' (truncado)' if result.truncated else ''}, columnas {result.columns}")
 
             # Respondemos
             async for partial_message in self.answer_result(input, history, session):
@@ -187,8 +301,88 @@ class QAChain:
 
     
 
+    #------ESTADO POR PETICIÓN------
+    def session_lock(self, session_id: str) -> asyncio.Lock:
+        """
+        Devuelve el lock de la sesión. Sólo se serializan los turnos de una misma sesión.
+        El lock desaparece del registro cuando ningún turno lo está usando.
+        """
+        lock = self._session_locks.get(session_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._session_locks[session_id] = lock
+        return lock
+
+    # Campos de qa_data que leen las ramas especulativas (check_new_search y build_query)
+    SPECULATIVE_FIELDS = ("last_query", "missing_fields", "resolved_fields")
+
+    async def snapshot_session(self, session: SessionData) -> SessionData:
+        """
+        Copia de la sesión con los campos que leen las ramas especulativas, tomada con el lock de la sesión.
+        Las ramas especulativas trabajan sobre la copia, nunca sobre un qa_data que otro turno está modificando.
+        """
+        async with self.session_lock(session.session_id):
+            qa_data = {field: copy.deepcopy(session.qa_data.get(field)) for field in self.SPECULATIVE_FIELDS}
+        return session.model_copy(update={"qa_data": qa_data})
+
+    def is_snapshot_current(self, snapshot: SessionData, session: SessionData) -> bool:
+        return all(snapshot.qa_data[field] == session.qa_data.get(field) for field in self.SPECULATIVE_FIELDS)
+
+    def resolve_fields(self, input: str, session: SessionData) -> Dict[str, str]:
+        """
+        Campos requeridos resueltos con el índice local: los del input y los acumulados en la sesión
+        en turnos anteriores en los que faltaban campos. Los del input tienen prioridad.
+        """
+        if self.value_index is None:
+            return {}
+        resolved = dict(session.qa_data.get("resolved_fields") or {})
+        resolved.update(self.value_index.resolve(input))
+        return resolved
+
+    def local_missing_fields(self, input: str, session: SessionData) -> List[str]:
+        """
+        Campos requeridos que no están ni en el input, ni en turnos anteriores, ni en las cláusulas de la última consulta.
+        Si el input tiene palabras que el índice no reconoce (una población con errata o ausente de la base de datos)
+        devuelve una lista vacía: decide el text2sql, de modo que no se pide al usuario el mismo campo en cada turno.
+        """
+        resolved = self.resolve_fields(input, session)
+        last_query = str(session.qa_data["last_query"] or "").lower()
+        missing_fields = [field for field in self.required_fields if field not in resolved and not re.search(rf"\b{field}\b", last_query)]
+        if missing_fields and self.value_index.unknown_words(input):
+            metrics.incr("qa.local_missing_fields.unknown_words")
+            return []
+        return missing_fields
+
+    def build_text2sql_input(self, input: str, session: SessionData) -> Dict:
+        """
+        Construye un diccionario nuevo con las variables del prompt text2sql para esta petición.
+        No se comparte entre peticiones, por lo que ninguna otra sesión puede modificarlo.
+        """
+        last_query = session.qa_data["last_query"]
+        last_query = str(last_query) if last_query is not None else ""
+        if self.schema_catalog is not None:
+            # Sólo se envían ejemplos de las columnas relevantes para el input
+            dialect = self.schema_catalog.dialect
+            table_info = self.schema_catalog.table_info(input, last_query, always=self.required_fields)
+        else:
+            self.open_db_connection()
+            dialect = self._dialect
+            table_info = self._table_info
+        resolved = self.resolve_fields(input, session)
+        if resolved:
+            # Filtros ya resueltos localmente (con el valor exacto de la base de datos) como pista para el text2sql
+            input = f"{input}\n(Filtros detectados: {', '.join(f'{field} = {value!r}' for field, value in resolved.items())})"
+        return {
+            "input": input,
+            "dialect": dialect,
+            "table_info": table_info,
+            "top_k": self.top_k,
+            "last_query": last_query
+        }
+
+
     #------GENERACIÓN DE SQL------
-    async def generate_query(self, input: str, session: SessionData) -> str:
+    async def generate_query(self, input: str, session: SessionData) -> Dict:
         """
         Esta función genera la consulta SQL tomando estos parámetros:
             - input(str): input del cliente.
@@ -197,50 +391,73 @@ class QAChain:
             - missing_fields(List): campos faltantes necesarios para ejecutar la consulta SQL
             - sql_query(str): consulta SQL.
         """
-        self.open_db_connection()
-        dict_prompt = self.dict_text2sql
-        dict_prompt["input"] = input
-        if(session.qa_data["last_query"]!=None):
-            dict_prompt["last_query"] = str(session.qa_data["last_query"])
+        answer = await self.build_query(input, session)
+        self.commit_query(answer, session)
+        return answer
+
+    # Camino rápido: consulta parametrizada generada sin LLM. Devuelve None si la consulta es libre
+    def build_structured_query(self, input: str, session: SessionData) -> Optional[Dict]:
+        if self.sql_builder is None:
+            return None
+        with metrics.timer("qa.sql_builder_seconds"):
+            info = self.sql_builder.build(input, session.qa_data.get("resolved_fields"))
+        metrics.incr("qa.fast_path.hits" if info is not None else "qa.fast_path.misses")
+        return info
+
+    # Genera la consulta SQL sin modificar la sesión. Se puede lanzar de forma especulativa
+    async def build_query(self, input: str, session: SessionData) -> Dict:
+        dict_prompt = self.build_text2sql_input(input, session)
+        # Los filtros resueltos en turnos anteriores cambian el prompt: dos sesiones con el mismo input no comparten consulta
+        resolved = self.resolve_fields(input, session)
+        if self.sql_cache is not None:
+            cached_answer = self.sql_cache.get_query(input, dict_prompt["last_query"], resolved)
+            if cached_answer is not None:
+                return cached_answer
 
         answer = None
         # Generamos la consulta SQL
         try:
             logger.info("COMPLETE PROMPT "+ str(dict_prompt))
-            answer = await self.route_check_query_chain.ainvoke(dict_prompt) # Esta cadena devuelve el la consulta SQL y los campos faltantes si los hubiera
+            with metrics.timer("qa.text2sql_seconds"):
+                answer = await self.route_check_query_chain.ainvoke(dict_prompt) # Esta cadena devuelve el la consulta SQL y los campos faltantes si los hubiera
         except Exception as e:
             logger.error("Text2SQL chain failed: "+ str(e))
-            raise Exception(status_code=500, detail="ERROR: Text2SQL chain failed:" + str(e))
-        async with self.lock:
-            logger.info("NUEVA QUERY: "+ answer["sql_query"])
-            session.qa_data["missing_fields"] = answer["missing_fields"]    # Actualización de "missing_fields" en sesión
-            logger.info("DICT DE CLAUSULAS: "+ str(extract_where_clauses(answer["sql_query"])))
-            session.qa_data["last_query"] = extract_where_clauses(answer["sql_query"])     # Actualización de "last_query" en sesión:
+            raise HTTPException(status_code=500, detail="ERROR: Text2SQL chain failed:" + str(e))
+        if self.sql_cache is not None:
+            self.sql_cache.set_query(input, dict_prompt["last_query"], answer, resolved)
         return answer
 
+    # Vuelca en la sesión el resultado del text2sql. Se llama con el lock de la sesión tomado
+    def commit_query(self, answer: Dict, session: SessionData):
+        logger.info("NUEVA QUERY: "+ answer["sql_query"])
+        session.qa_data["missing_fields"] = answer["missing_fields"]    # Actualización de "missing_fields" en sesión
+        logger.info("DICT DE CLAUSULAS: "+ str(extract_where_clauses(answer["sql_query"])))
+        session.qa_data["last_query"] = extract_where_clauses(answer["sql_query"])     # Actualización de "last_query" en sesión:
+        if not answer["missing_fields"]:
+            session.qa_data["resolved_fields"] = {} # La consulta ya contiene todos los campos requeridos
+
 
 
     #------GENERACIÓN DE RESPUESTA------
-    async def answer_result(self, input: str, history: str, session: SessionData) -> AsyncGenerator[str, None]:
+    async def answer_result(self, input: str, history: str, session: SessionData) -> AsyncGenerator[Union[str, StreamEvent], None]:
         """
         Esta función genera la consulta SQL tomando estos parámetros:
             - input (str): input del cliente.
-            - result (str): resultado obtenido previamente. Recogida de la sesión.
+            - result (Dict): resumen del resultado obtenido previamente. Recogido de la sesión.
             - history (str): historial de conversación
         Devuelve un generador asincrónico.
         """
         try:
-            yield "loading-db:end"
-            async for partial_answer in self.answer_chain.astream({"input": input, "result": str(session.qa_data["result"]), "history": history}):
+            yield LOADING_DB_END
+            async for partial_answer in self.answer_chain.astream({"input": input, "result": context_assembler.sql_result(session.qa_data["result"]), "history": history}):
                 yield partial_answer
         except Exception as e:
             logger.error(f"ERROR: answer chain failed: {e}")
-            raise Exception(status_code=500, detail=f"ERROR: answer chain chain failed: {e}")
+            raise HTTPException(status_code=500, detail=f"ERROR: answer chain chain failed: {e}")
 
 
-    # Función que enruta toda la herramienta QA
-    async def execute(self, input: str, history: str, session: SessionData) -> AsyncGenerator[str, None]:
-        
+    # ¿Está el usuario solicitando una nueva búsqueda? No modifica la sesión, por lo que se puede lanzar de forma especulativa
+    async def check_new_search(self, input: str, history: str, session: SessionData) -> bool:
         # Comprobamos si hay campos faltantes
         missing_fields = None
         if(len(session.qa_data["missing_fields"])>0):
@@ -248,23 +465,73 @@ class QAChain:
         else:
             missing_fields = ''
 
-        # ¿Está el usuario solicitando una nueva búsqueda?
-        new_search_answer = True
         try:
-            new_search_answer = await self.check_new_search_chain.ainvoke({"input": input, "history": history, "missing_fields": missing_fields})
-            async with self.lock:
-                session.qa_data["new_search"] = new_search_answer   # Actualización de "new_search" en sesión
+            with metrics.timer("qa.new_search_seconds"):
+                return await self.check_new_search_chain.ainvoke({"input": input, "history": history, "missing_fields": missing_fields})
         except Exception as e:
             logger.error(f"'checking new search' chain failed: {e}")
-            raise Exception(status_code=500, detail="ERROR: 'checking new search' chain failed:" + str(e))
+            raise HTTPException(status_code=500, detail="ERROR: 'checking new search' chain failed:" + str(e))
+
+
+    # Función que enruta toda la herramienta QA
+    async def execute(self, input: str, history: str, session: SessionData, new_search: Awaitable = None, query: Awaitable = None, snapshot: SessionData = None) -> AsyncGenerator[Union[str, StreamEvent], None]:
+        """
+        Ejecuta un turno de búsqueda. Parámetros opcionales para el modo especulativo:
+            - new_search (Awaitable): tarea ya lanzada con check_new_search.
+            - query (Awaitable): tarea ya lanzada con build_query. Se cancela si no se necesita una nueva búsqueda.
+            - snapshot (SessionData): copia de la sesión (snapshot_session) con la que se lanzaron las tareas.
+              Si otro turno ha cambiado la sesión desde entonces, las tareas se descartan y se repiten.
+        """
+        # Los turnos de una misma sesión se serializan. El resto de sesiones no esperan
+        async with self.session_lock(session.session_id):
+            if snapshot is not None and not self.is_snapshot_current(snapshot, session):
+                for task in (new_search, query):
+                    if task is not None and hasattr(task, "cancel"):
+                        task.cancel()
+                metrics.incr("qa.speculative.stale")
+                new_search, query = None, None
+            async for partial_answer in self._execute(input, history, session, new_search, query):
+                yield partial_answer
+
+    async def _execute(self, input: str, history: str, session: SessionData, new_search: Awaitable = None, query: Awaitable = None) -> AsyncGenerator[Union[str, StreamEvent], None]:
+
+        # ¿Está el usuario solicitando una nueva búsqueda?
+        if new_search is None:
+            new_search = self.check_new_search(input, history, session)
+        session.qa_data["new_search"] = await new_search   # Actualización de "new_search" en sesión
 
         # Si consulta ya se ha ejecutado: "new_search" = False.
         if session.qa_data["new_search"] == False:
+            if query is not None and hasattr(query, "cancel"):
+                query.cancel()
+                metrics.incr("qa.speculative_text2sql.cancelled")
             async for partial_answer in self.answer_result(input = input, session = session, history = history):
                 yield partial_answer
         # Si el cliente reclama una nueva búsqueda o que todavía no se ha completado la consulta: "new_search" = True.
         else:
-            info = await self.generate_query(input, session)
+            # Si el índice local detecta que faltan campos requeridos se piden al usuario sin llamar al text2sql
+            missing_fields = self.local_missing_fields(input, session) if self.value_index is not None else []
+            if missing_fields:
+                if query is not None and hasattr(query, "cancel"):
+                    query.cancel()
+                    metrics.incr("qa.speculative_text2sql.cancelled")
+                metrics.incr("qa.local_missing_fields")
+                session.qa_data["missing_fields"] = missing_fields
+                session.qa_data["resolved_fields"] = self.resolve_fields(input, session)
+                async for partial_answer in self.route(info = {"sql_query": None, "missing_fields": missing_fields}, input = input, session = session, history = history):
+                    yield partial_answer
+                return
+            info = self.build_structured_query(input, session)
+            if info is not None:
+                if query is not None and hasattr(query, "cancel"):
+                    query.cancel()
+                    metrics.incr("qa.speculative_text2sql.cancelled")
+                self.commit_query(info, session)
+            elif query is None:
+                info = await self.generate_query(input, session)
+            else:
+                info = await query
+                self.commit_query(info, session)
             async for partial_answer in self.route(info = info, input = input, session = session, history = history):
                 yield partial_answer
 
@@ -280,9 +547,6 @@ class QAChain:
             self._dialect = self.db.dialect
             self._table_info = self.db.table_info
 
-            self.dict_text2sql["dialect"] = self._dialect
-            self.dict_text2sql["table_info"] = self._table_info
-
 
                 
 
@@ -1,39 +1,158 @@
-from langchain_core.runnables import RunnablePassthrough
-from langchain_community.vectorstores import FAISS
-from operator import itemgetter
-from langchain_openai import OpenAIEmbeddings
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import PromptTemplate
 from src.utilities import *
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Dict, List
 from src.directories import RAG_CHAIN_PROMPT_dir, DB_DIR
-from src.config.base_models import generate_rag_llm
+from src.config.base_models import generate_rag_llm, generate_embeddings
+from src.semantic_cache import SemanticCache
+from src.embedding_store import CachedEmbeddings
+from src.vector_index import load_vector_store
+from src.bm25_index import BM25Index, reciprocal_rank_fusion
+from src.metrics import metrics
+from src.artifacts import ArtifactManager
+from src.context_budget import context_assembler, prompt_token_meter
+from langchain_core.documents import Document
+import numpy as np
+import asyncio
+import os
+import logging
 
 #-------------------------------------------------------------------------------------------------
 
 
 RAG_CHAIN_PROMPT = txt_to_str(filepath = RAG_CHAIN_PROMPT_dir)
 
+logger = logging.getLogger(__name__)
+
 
 class RagChain:
 
-    def __init__(self):
-        self.embeddings = OpenAIEmbeddings()
-        self.vector_db = FAISS.load_local(DB_DIR, self.embeddings, allow_dangerous_deserialization=True)
-        self.retriever = self.vector_db.as_retriever(search_kwargs={"k": 4}) # 4 documentos de texto a recuperar
+    def __init__(self, artifacts_dir: str = None):
+        # Embeddings con caché persistente compartida con la ingesta de PDFs
+        self.embeddings = CachedEmbeddings(
+            generate_embeddings(),
+            store_path=os.getenv("EMBEDDING_CACHE_PATH", os.path.join(DB_DIR, "embeddings_cache.sqlite")),
+            memory_entries=int(os.getenv("EMBEDDING_CACHE_MEMORY_ENTRIES", 2048))
+        )
+        self.k = int(os.getenv("RAG_K", 4)) # Documentos de texto que se pasan al prompt
+        self.candidate_k = int(os.getenv("RAG_CANDIDATE_K", 8)) # Candidatos de cada retriever antes de la fusión
+
+        # Reranker opcional (cross-encoder local en CPU). Requiere sentence-transformers
+        self.reranker = None
+        reranker_model = os.getenv("RAG_RERANKER_MODEL")
+        if reranker_model:
+            from sentence_transformers import CrossEncoder
+            self.reranker = CrossEncoder(reranker_model, device="cpu")
+
+        # Índices (FAISS y BM25) y caché semántica. Se recargan en caliente al publicar una nueva versión (src/artifacts.py)
+        self.swap_resources(self.load_resources(artifacts_dir or ArtifactManager.from_env().current_dir()))
         self.rag_prompt = PromptTemplate.from_template(RAG_CHAIN_PROMPT)
         self.rag_llm = generate_rag_llm()
         """
-         - Se toma el input del usuario y se selecciona la información relevante.
-         - Esa información se pasa al retriever, que busca datos relevantes en la base de datos vectorial
-         - Tanto el input del usuario como los datos recuperados y el historial se pasan al prompt de RAG
+         - Se toma el input del usuario y se calcula su embedding.
+         - Si una pregunta casi idéntica ya se respondió, se devuelve la respuesta de la caché semántica.
+         - Si no, se recuperan candidatos con ese embedding (FAISS) y con BM25, se fusionan por RRF y opcionalmente se reordenan
+         - Tanto el input del usuario como los datos recuperados (sin chunks duplicados y dentro del presupuesto de tokens) y el historial se pasan al prompt de RAG
          - El prompt pasa a través de un modelo de lenguaje
          - Finalmente, la respuesta se procesa como una cadena de texto que se puede mostrar o usar en la aplicación.
          """
-        self.rag_chain = {"context": itemgetter("input") | self.retriever, "input": RunnablePassthrough(), "history": RunnablePassthrough()} | self.rag_prompt | self.rag_llm | StrOutputParser()
+        self.rag_chain = self.rag_prompt | prompt_token_meter("rag") | self.rag_llm | StrOutputParser()
+
+
+
+    #------RECURSOS RECARGABLES------
+    def load_resources(self, artifacts_dir: str) -> Dict:
+        """
+        Carga los índices de artifacts_dir sin modificar la instancia. Se puede ejecutar en un hilo.
+        """
+        # Índice memory-mapped (las páginas se comparten entre workers) con parámetros de búsqueda de IVF/HNSW
+        vector_db = load_vector_store(
+            artifacts_dir,
+            self.embeddings,
+            mmap=os.getenv("FAISS_MMAP", "true").lower() == "true",
+            nprobe=int(os.getenv("FAISS_NPROBE", 16)),
+            ef_search=int(os.getenv("FAISS_EF_SEARCH", 64))
+        )
+
+        # Índice BM25 construido en la ingesta. Si no existe la recuperación es sólo densa
+        bm25 = None
+        bm25_path = os.path.join(artifacts_dir, "bm25.pkl")
+        if os.path.exists(bm25_path):
+            bm25 = BM25Index.load(bm25_path)
+
+        # Caché semántica de respuestas. Cada versión de los índices empieza con la caché vacía
+        answer_cache = None
+        if os.getenv("RAG_CACHE_ENABLED", "true").lower() == "true":
+            answer_cache = SemanticCache(
+                threshold=float(os.getenv("RAG_CACHE_THRESHOLD", 0.95)),
+                max_entries=int(os.getenv("RAG_CACHE_MAX_ENTRIES", 512)),
+                ttl=float(os.getenv("RAG_CACHE_TTL", 3600)),
+                index_path=os.path.join(artifacts_dir, "index.faiss")
+            )
+        return {"vector_db": vector_db, "bm25": bm25, "answer_cache": answer_cache}
+
+    def swap_resources(self, resources: Dict):
+        # Asignación síncrona: las consultas en curso conservan sus referencias a los índices anteriores
+        self.resources = resources
+        self.vector_db = resources["vector_db"]
+        self.bm25 = resources["bm25"]
+        self.answer_cache = resources["answer_cache"]
 
 
     # FUNCIÓN PARA REALIZAR UNA CONSULTA RAG
     async def query_rag(self, input: str, history: str) -> AsyncGenerator[str, None]:
-        async for message in self.rag_chain.astream({"input": input, "history": history}):
-            yield message
\ No newline at end of file
+        # Los índices y la caché de esta consulta son los de la versión activa al empezar, aunque haya una recarga
+        resources = self.resources
+        answer_cache = resources["answer_cache"]
+
+        # El embedding se calcula una sola vez y sirve para la caché y para el retriever
+        embedding = await self.embeddings.aembed_query(input)
+
+        # Las respuestas sólo se reutilizan con el mismo historial reciente (o sin historial)
+        context_signature = SemanticCache.context_signature(history)
+        if answer_cache is not None:
+            cached_answer = answer_cache.lookup(embedding, context_signature)
+            if cached_answer is not None:
+                yield cached_answer
+                return
+
+        context = context_assembler.documents(await self.retrieve(input, embedding, resources))
+        answer = ""
+        async for message in self.rag_chain.astream({"context": context, "input": input, "history": history}):
+            answer += message
+            yield message
+
+        if answer_cache is not None and answer:
+            answer_cache.store(embedding, input, answer, context_signature)
+
+
+
+    #------RECUPERACIÓN HÍBRIDA------
+    def _dense_ids(self, vector_db, embedding: List[float]) -> List[str]:
+        _, positions = vector_db.index.search(np.asarray([embedding], dtype=np.float32), self.candidate_k)
+        return [vector_db.index_to_docstore_id[position] for position in positions[0] if position != -1]
+
+    async def retrieve(self, input: str, embedding: List[float], resources: Dict = None) -> List[Document]:
+        """
+        Recuperación híbrida: candidatos densos (FAISS) y léxicos (BM25) fusionados por reciprocal rank fusion.
+        Si hay reranker, reordena los candidatos fusionados. Devuelve los self.k mejores documentos.
+        """
+        resources = resources or self.resources
+        vector_db, bm25 = resources["vector_db"], resources["bm25"]
+        with metrics.timer("rag.retrieval_seconds"):
+            with metrics.timer("rag.dense_seconds"):
+                dense_ids = await asyncio.to_thread(self._dense_ids, vector_db, embedding)
+            rankings = [dense_ids]
+            if bm25 is not None:
+                with metrics.timer("rag.bm25_seconds"):
+                    rankings.append([doc_id for doc_id, _ in bm25.search(input, self.candidate_k)])
+
+            fused_ids = reciprocal_rank_fusion(rankings)
+            documents = [vector_db.docstore.search(doc_id) for doc_id in fused_ids]
+            documents = [document for document in documents if isinstance(document, Document)]
+
+            if self.reranker is not None and len(documents) > self.k:
+                with metrics.timer("rag.rerank_seconds"):
+                    scores = await asyncio.to_thread(self.reranker.predict, [(input, document.page_content) for document in documents])
+                documents = [document for _, document in sorted(zip(scores, documents), key=lambda item: item[0], reverse=True)]
+        return documents[:self.k]
@@ -5,60 +5,171 @@ from src.utilities import *
 from src.directories import CLASSIFICATION_PROMPT_dir, welcome_dir, PRESENTATION_PROMPT_dir
 from src.qa_chain import QAChain
 from src.rag_chain import RagChain
-from typing import AsyncGenerator, List
+from src.intent_classifier import KeywordIntentClassifier, log_decision, SEARCH_ROUTE, INFO_ROUTE
+from typing import AsyncGenerator, List, Union
 from session_manager import SessionData
+import os
+import time
+import asyncio
 import logging
 from src.config.base_models import generate_router_llm
+from src.metrics import metrics
+from src.stream_events import StreamEvent, ROUTE
+from src.context_budget import context_assembler, prompt_token_meter
 
 logger = logging.getLogger(__name__)
 
 
 class Router_chain:
 
-    def __init__(self):
-        self.qa_chain = QAChain()
-        self.rag_chain = RagChain()
+    # Número de turnos del historial que se pasan a las cadenas
+    HISTORY_WINDOW = 4
+
+    def __init__(self, pre_classifier = None, qa_chain: QAChain = None, rag_chain: RagChain = None):
+        # Las cadenas se pueden construir por separado (en paralelo durante el arranque, ver main.py)
+        self.qa_chain = qa_chain or QAChain()
+        self.rag_chain = rag_chain or RagChain()
         self.llm = generate_router_llm()
         self.CLASSIFICATION_PROMPT = txt_to_str(filepath = CLASSIFICATION_PROMPT_dir)
         self.classification_prompt = PromptTemplate.from_template(self.CLASSIFICATION_PROMPT)
-        self.classification_chain = self.classification_prompt | self.llm | StrOutputParser() #Cadena clasificadora
+        self.classification_chain = self.classification_prompt | prompt_token_meter("router") | self.llm | StrOutputParser() #Cadena clasificadora
         #self.enrouting_chain = {"route": self.classification_chain, "input": lambda x: x["input"], "history": lambda x: x["history"] } | RunnableLambda(self.route) # Cadena de enrutamiento
         self.welcome_document = txt_to_str(welcome_dir)
         self.PRESENTATION_PROMPT = txt_to_str(PRESENTATION_PROMPT_dir)
         self.presentation_prompt = PromptTemplate.from_template(self.PRESENTATION_PROMPT)
-        self.presentation_chain = self.presentation_prompt | self.llm | StrOutputParser()
+        self.presentation_chain = self.presentation_prompt | prompt_token_meter("presentation") | self.llm | StrOutputParser()
+
+        # Pre-clasificador local. Debe exponer classify(input, history) -> IntentPrediction
+        if pre_classifier is None and os.getenv("ROUTER_PRECLASSIFIER_ENABLED", "true").lower() == "true":
+            pre_classifier = KeywordIntentClassifier()
+        self.pre_classifier = pre_classifier
+        self.pre_classifier_threshold = float(os.getenv("ROUTER_PRECLASSIFIER_THRESHOLD", 0.8))
+        # En modo sombra también se consulta al LLM (sin esperar su respuesta) para medir la concordancia
+        self.pre_classifier_shadow = os.getenv("ROUTER_PRECLASSIFIER_SHADOW", "false").lower() == "true"
+        self._shadow_tasks = set()
+
+        # Ejecución especulativa de las cadenas de búsqueda en paralelo a la clasificación
+        self.speculative = os.getenv("SPECULATIVE_ROUTING", "false").lower() == "true"
+        self.speculative_text2sql = os.getenv("SPECULATIVE_TEXT2SQL", "false").lower() == "true"
     
 
-    async def execute(self, input: str, session: SessionData) -> AsyncGenerator[str, None]:
+    async def execute(self, input: str, session: SessionData) -> AsyncGenerator[Union[str, StreamEvent], None]:
+        """
+        Genera la respuesta del turno: los tokens como str y los eventos (ruta, estado de carga) como StreamEvent.
+        """
+        start = time.perf_counter()
+        first_token = True
+        async for message in self._execute(input, session):
+            if first_token and isinstance(message, str):
+                metrics.observe("turn.first_token_seconds", time.perf_counter() - start)
+                first_token = False
+            yield message
+        metrics.observe("turn.total_seconds", time.perf_counter() - start)
+
+    async def _execute(self, input: str, session: SessionData) -> AsyncGenerator[Union[str, StreamEvent], None]:
         
-        history = self.get_conversation_history(session.history, 4) # Accedemos al historial de conversación
+        history = self.get_conversation_history(session.history, self.HISTORY_WINDOW) # Accedemos al historial de conversación
+
+        if self.speculative:
+            async for message in self.execute_speculative(input, history, session):
+                yield message
+            return
 
         # Cadena enrutadora
-        result = await self.classification_chain.ainvoke({"input": input, "history": history})
+        result = await self.classify(input, history)
+        yield StreamEvent(ROUTE, result)
 
-        if result == "búsqueda":
+        if result == SEARCH_ROUTE:
             async for message in self.qa_chain.execute(input, history, session): # Herramienta Text2SQL
                 yield message
-        elif result == "información":
+        elif result == INFO_ROUTE:
             async for message in self.rag_chain.query_rag(input, history): # Herramienta RAG
                 yield message
         else:
             async for message in self.presentation_chain.astream({"input": input, "welcome": self.welcome_document}):
                 yield message
 
+
+    # Modo especulativo: la clasificación, el chequeo de nueva búsqueda y (opcionalmente) el text2sql se lanzan a la vez
+    async def execute_speculative(self, input: str, history: str, session: SessionData) -> AsyncGenerator[Union[str, StreamEvent], None]:
+        classification = asyncio.create_task(self.classify(input, history))
+        speculative_tasks = []
+        try:
+            # Las ramas de búsqueda leen qa_data: se lanzan sobre una copia tomada con el lock de la sesión
+            snapshot = await self.qa_chain.snapshot_session(session)
+            new_search = asyncio.create_task(self.qa_chain.check_new_search(input, history, snapshot))
+            query = asyncio.create_task(self.qa_chain.build_query(input, snapshot)) if self.speculative_text2sql else None
+            speculative_tasks = [task for task in (new_search, query) if task is not None]
+
+            result = await classification
+            yield StreamEvent(ROUTE, result)
+
+            if result == SEARCH_ROUTE:
+                async for message in self.qa_chain.execute(input, history, session, new_search=new_search, query=query, snapshot=snapshot): # Herramienta Text2SQL
+                    yield message
+                return
+
+            # Las ramas especulativas de búsqueda ya no son necesarias
+            self._cancel(speculative_tasks)
+            if result == INFO_ROUTE:
+                async for message in self.rag_chain.query_rag(input, history): # Herramienta RAG
+                    yield message
+            else:
+                async for message in self.presentation_chain.astream({"input": input, "welcome": self.welcome_document}):
+                    yield message
+        finally:
+            # Si el turno falla o el cliente se desconecta no dejamos tareas huérfanas
+            self._cancel([classification] + speculative_tasks)
+
+    @staticmethod
+    def _cancel(tasks: List[asyncio.Task]):
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+                metrics.incr("router.speculative.cancelled")
+            elif not task.cancelled():
+                task.exception() # Evita avisos de excepciones no recuperadas en ramas descartadas
+
     
+    # Clasificación del input. Sólo se llama al LLM si el pre-clasificador local no tiene suficiente confianza
+    async def classify(self, input: str, history: str) -> str:
+        prediction = None
+        if self.pre_classifier is not None:
+            prediction = self.pre_classifier.classify(input, history)
+            if prediction.route is not None and prediction.confidence >= self.pre_classifier_threshold:
+                metrics.incr("router.pre_classifier.routed")
+                if self.pre_classifier_shadow:
+                    task = asyncio.create_task(self._shadow_classify(input, history, prediction))
+                    self._shadow_tasks.add(task)
+                    task.add_done_callback(self._shadow_tasks.discard)
+                else:
+                    log_decision(input, prediction, source="pre_classifier")
+                return prediction.route
+
+        metrics.incr("router.llm.routed")
+        with metrics.timer("router.llm_classification_seconds"):
+            result = await self.classification_chain.ainvoke({"input": input, "history": history})
+        if prediction is not None:
+            log_decision(input, prediction, source="llm", llm_route=result)
+        return result
+
+    async def _shadow_classify(self, input: str, history: str, prediction):
+        try:
+            llm_route = await self.classification_chain.ainvoke({"input": input, "history": history})
+            log_decision(input, prediction, source="shadow", llm_route=llm_route)
+        except Exception as e:
+            logger.error(f"Shadow classification failed: {e}")
+
+
     # Esta función recupera el historial de mensages de la sesión
     def get_conversation_history(self, data: List, k: int) -> str:
         # Ordenamos el diccionario por el campo 'timestamp' en orden descendente
         sorted_entries = sorted(data, key=lambda x: x['timestamp'], reverse=True)[:k]
         sorted_entries.reverse()
 
-        conversation_history = []
-        
-        for entry in sorted_entries:
-            conversation_history.append(f"user: {entry['user']}")
-            conversation_history.append(f"bot: {entry['bot']}")
-        logger.info("HISTORY: "+str(conversation_history))
-        return str(conversation_history)
+        # Se conservan los turnos más recientes que caben en el presupuesto de tokens del historial
+        conversation_history = context_assembler.history(sorted_entries)
+        logger.info("HISTORY: "+conversation_history)
+        return conversation_history
 
 
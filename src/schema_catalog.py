@@ -0,0 +1,155 @@
+import os
+import re
+import json
+import sqlite3
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Sequence
+
+SCHEMA_SUFFIX = ".schema.json"
+
+_TOKEN = re.compile(r"\w+")
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", str(text).lower())
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+
+def schema_path(database_path: str) -> str:
+    return os.path.splitext(database_path)[0] + SCHEMA_SUFFIX
+
+
+#------CONSTRUCCIÓN DEL ARTEFACTO (en la generación de la base de datos)------
+def build_schema_catalog(database_path: str, distinct_fields: Sequence[str] = ("tipo", "operacion", "poblacion"), sample_rows: int = 4, max_distinct: int = 2000) -> Dict:
+    """
+    Lee el esquema de todas las tablas de la base de datos SQLite y devuelve un diccionario serializable con:
+        - columnas y tipos de cada tabla y filas de ejemplo.
+        - valores distintos (con su frecuencia) de los campos de distinct_fields que existan en la tabla.
+        - tamaño y fecha de modificación de la base de datos, para detectar artefactos desactualizados.
+    No importa módulos de src para poder usarse desde los scripts de src/config.
+    """
+    conn = sqlite3.connect(database_path)
+    try:
+        tables = {}
+        # Las tablas FTS5 (virtuales) y sus tablas internas (<fts>_data, <fts>_idx...) no se describen como tablas
+        virtual = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND sql LIKE 'CREATE VIRTUAL TABLE%'")]
+        names = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")
+                 if row[0] not in virtual and not any(row[0].startswith(f"{name}_") for name in virtual)]
+        for table in names:
+            columns = [{"name": row[1], "type": row[2] or "TEXT"} for row in conn.execute(f'PRAGMA table_info("{table}")')]
+            samples = [list(row) for row in conn.execute(f'SELECT * FROM "{table}" LIMIT {int(sample_rows)}')]
+            distinct = {}
+            for field in distinct_fields:
+                if any(column["name"] == field for column in columns):
+                    rows = conn.execute(
+                        f'SELECT "{field}", COUNT(*) FROM "{table}" WHERE "{field}" IS NOT NULL GROUP BY "{field}" ORDER BY COUNT(*) DESC LIMIT {int(max_distinct)}'
+                    )
+                    distinct[field] = {str(value): count for value, count in rows}
+            fts = f"{table}_fts"
+            fts_columns = [row[1] for row in conn.execute(f'PRAGMA table_info("{fts}")')] if fts in virtual else []
+            tables[table] = {"columns": columns, "sample_rows": samples, "distinct": distinct, "fts": {"table": fts, "columns": fts_columns} if fts_columns else None}
+    finally:
+        conn.close()
+    stat = os.stat(database_path)
+    return {"dialect": "sqlite", "database": {"size": stat.st_size, "mtime": stat.st_mtime}, "tables": tables}
+
+
+def save_schema_catalog(catalog: Dict, path: str):
+    # Escritura atómica: el servidor nunca lee un artefacto a medias
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(catalog, f, ensure_ascii=False, default=str)
+    os.replace(tmp_path, path)
+
+
+#------USO EN EL SERVIDOR------
+class SchemaCatalog:
+    """
+    Esquema precalculado de la base de datos para los prompts de text2sql. Sustituye a la reflexión de SQLDatabase:
+        - Todas las columnas aparecen en el CREATE TABLE (nombre y tipo, pocos tokens).
+        - Las filas de ejemplo sólo incluyen las columnas relevantes para el input.
+        - Los valores admitidos de los campos requeridos se listan completos si son pocos; si no, sólo los que aparecen en el input.
+    """
+
+    def __init__(self, catalog: Dict, max_listed_values: int = 30, max_value_chars: int = 100):
+        self.catalog = catalog
+        self.dialect = catalog.get("dialect", "sqlite")
+        self.max_listed_values = max_listed_values
+        self.max_value_chars = max_value_chars
+
+    @classmethod
+    def load(cls, database_path: str, **kwargs) -> Optional["SchemaCatalog"]:
+        """
+        Carga el artefacto de la base de datos. Devuelve None si no existe o si la base de datos ha cambiado desde que se generó.
+        """
+        path = schema_path(database_path)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            catalog = json.load(f)
+        stat = os.stat(database_path)
+        database = catalog.get("database", {})
+        if database.get("size") != stat.st_size or database.get("mtime") != stat.st_mtime:
+            return None
+        return cls(catalog, **kwargs)
+
+    @property
+    def tables(self) -> Dict:
+        return self.catalog["tables"]
+
+    def distinct_values(self, field: str) -> List[str]:
+        values = []
+        for table in self.tables.values():
+            values += list(table["distinct"].get(field, {}))
+        return values
+
+    def relevant_columns(self, table: str, input: str, last_query: str = "", always: Iterable[str] = ()) -> List[str]:
+        """
+        Columnas cuyo nombre aparece en el input o en la consulta anterior (comparando prefijos para admitir plurales),
+        además de las columnas de `always`.
+        """
+        words = set(_TOKEN.findall(_normalize(f"{input} {last_query}")))
+        relevant = []
+        for column in self.tables[table]["columns"]:
+            name = column["name"]
+            parts = [part for part in _TOKEN.findall(_normalize(name.replace("_", " "))) if len(part) >= 3]
+            if name in always or any(word.startswith(part[:5]) or part.startswith(word[:5]) for part in parts for word in words if len(word) >= 3):
+                relevant.append(name)
+        return relevant
+
+    def _format_value(self, value) -> str:
+        value = "" if value is None else str(value)
+        return value[:self.max_value_chars]
+
+    def table_info(self, input: str = "", last_query: str = "", always: Iterable[str] = ()) -> str:
+        """
+        Devuelve la descripción de las tablas para el prompt (mismo formato que SQLDatabase.table_info).
+        """
+        always = list(always)
+        normalized_input = _normalize(input)
+        blocks = []
+        for name, table in self.tables.items():
+            columns = ",\n".join(f'\t"{column["name"]}" {column["type"]}' for column in table["columns"])
+            block = f'CREATE TABLE "{name}" (\n{columns}\n)'
+
+            relevant = self.relevant_columns(name, input, last_query, always)
+            positions = [i for i, column in enumerate(table["columns"]) if column["name"] in relevant]
+            if positions and table["sample_rows"]:
+                rows = "\n".join("\t".join(self._format_value(row[i]) for i in positions) for row in table["sample_rows"])
+                header = "\t".join(table["columns"][i]["name"] for i in positions)
+                block += f"\n\n/*\n{len(table['sample_rows'])} rows from {name} table:\n{header}\n{rows}\n*/"
+
+            for field, counts in table["distinct"].items():
+                values = list(counts)
+                if len(values) > self.max_listed_values:
+                    # Sólo los valores mencionados en el input
+                    values = [value for value in values if _normalize(value) and _normalize(value) in normalized_input]
+                    if not values:
+                        continue
+                block += f"\n/* Valores de {field}: {', '.join(values)} */"
+            fts = table.get("fts")
+            if fts:
+                block += (f"\n/* Búsqueda de texto en {', '.join(fts['columns'])}: SELECT \"{name}\".* FROM \"{fts['table']}\" "
+                          f"JOIN \"{name}\" ON \"{name}\".rowid = \"{fts['table']}\".rowid WHERE \"{fts['table']}\" MATCH 'palabra' */")
+            blocks.append(block)
+        return "\n\n".join(blocks)
@@ -0,0 +1,115 @@
+import os
+import time
+import hashlib
+import logging
+import numpy as np
+from collections import OrderedDict
+from typing import List, Optional
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticCache:
+    """
+    Caché de respuestas indexada por el embedding de la pregunta.
+        - Una pregunta se considera repetida si la similitud coseno con una pregunta previa supera `threshold`.
+        - Las entradas caducan tras `ttl` segundos y se expulsan por LRU al superar `max_entries`.
+        - Si cambia el archivo `index_path` (índice vectorial reconstruido) se vacía la caché.
+        - Cada entrada guarda la firma del contexto de la conversación (context_signature del historial reciente) y sólo
+          se reutiliza con la misma firma: una pregunta de seguimiento ("¿y el precio?") no recibe la respuesta de otra conversación.
+    """
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 512, ttl: float = 3600, index_path: str = None, name: str = "rag_cache"):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.index_path = index_path
+        self.name = name
+        self._entries = OrderedDict() # (firma del contexto, pregunta) -> (vector normalizado, respuesta, instante de creación)
+        self._matrix = None # Matriz de vectores en el orden de self._keys. Se reconstruye al cambiar las entradas
+        self._keys = []
+        self._contexts = None # Firmas del contexto en el orden de self._keys
+        self._index_version = self._current_index_version()
+
+    def _current_index_version(self):
+        if not self.index_path:
+            return None
+        try:
+            stat = os.stat(self.index_path)
+            return (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+    def _check_index_version(self):
+        version = self._current_index_version()
+        if version != self._index_version:
+            logger.info(f"Vector index changed, clearing {self.name}")
+            self.clear()
+            self._index_version = version
+
+    def clear(self):
+        self._entries.clear()
+        self._matrix = None
+        self._keys = []
+        self._contexts = None
+
+    @staticmethod
+    def context_signature(history: str) -> str:
+        """
+        Firma del historial reciente. Sin historial la firma es vacía y las preguntas se comparten entre conversaciones.
+        """
+        history = " ".join((history or "").split())
+        return hashlib.sha1(history.encode("utf-8")).hexdigest() if history else ""
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expire(self):
+        now = time.monotonic()
+        expired = [key for key, (_, _, created) in self._entries.items() if now - created > self.ttl]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+            metrics.incr(f"{self.name}.expired", len(expired))
+
+    def lookup(self, vector: List[float], context: str = "") -> Optional[str]:
+        """
+        Devuelve la respuesta de la pregunta más parecida con la misma firma de contexto si supera el umbral.
+        En caso contrario devuelve None.
+        """
+        self._check_index_version()
+        self._expire()
+        if not self._entries:
+            metrics.incr(f"{self.name}.misses")
+            return None
+        if self._matrix is None:
+            self._keys = list(self._entries.keys())
+            self._matrix = np.vstack([self._entries[key][0] for key in self._keys])
+            self._contexts = np.array([key[0] for key in self._keys], dtype=object)
+
+        scores = np.where(self._contexts == context, self._matrix @ self._normalize(vector), -np.inf)
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            metrics.incr(f"{self.name}.misses")
+            return None
+
+        key = self._keys[best]
+        self._entries.move_to_end(key) # Marcamos la entrada como usada recientemente (LRU)
+        metrics.incr(f"{self.name}.hits")
+        logger.info(f"{self.name} hit (score {scores[best]:.3f}): {key[1]}")
+        return self._entries[key][1]
+
+    def store(self, vector: List[float], question: str, answer: str, context: str = ""):
+        self._check_index_version()
+        key = (context, question)
+        self._entries[key] = (self._normalize(vector), answer, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            metrics.incr(f"{self.name}.evictions")
+        self._matrix = None
@@ -0,0 +1,136 @@
+import re
+import unicodedata
+from typing import Dict, List, Optional, Sequence, Tuple
+from src.value_index import ValueIndex, normalize_value
+
+# Importe: "200.000", "200 000", "1,5 millones", "150k", "150 mil"
+_NUMBER = r"(\d{1,3}(?:[.\s]\d{3})+|\d+(?:[.,]\d+)?)\s*(k|mil|millones|millon|m)?\b\s*(€|eur\b|euros\b)?"
+_MULTIPLIERS = {"k": 1e3, "mil": 1e3, "m": 1e6, "millon": 1e6, "millones": 1e6}
+
+_NUMBER_WORDS = {"un": 1, "una": 1, "uno": 1, "dos": 2, "tres": 3, "cuatro": 4, "cinco": 5, "seis": 6}
+_ROOMS = re.compile(
+    r"(?:(al menos|como minimo|minimo|mas de|desde)\s+)?(\d+|" + "|".join(_NUMBER_WORDS) + r")\s+(o mas\s+)?(?:habitaciones|habitacion|dormitorios|dormitorio|habs?)\b(\s+o mas)?"
+)
+_PRICE_BETWEEN = re.compile(r"entre\s+" + _NUMBER + r"\s*y\s+" + _NUMBER)
+_PRICE_MAX = re.compile(r"(?:por menos de|menos de|por debajo de|hasta|maximo|como mucho|como maximo|no mas de|max)\s+" + _NUMBER)
+_PRICE_MIN = re.compile(r"(?:por mas de|mas de|desde|minimo|como minimo|a partir de|por encima de)\s+" + _NUMBER)
+
+# Palabras de relleno que no cambian la consulta. Cualquier otra palabra que quede sin interpretar
+# (p.ej. "piscina", "cerca de la playa", "ordenados") hace que la consulta se trate como libre y vaya al LLM
+FILLER_WORDS = set("""
+quiero queria quisiera busco buscando buscar buscamos estoy estamos me nos gustaria interesa interesan necesito necesitamos
+un una unos unas el la los las en de del para por con y o a al que hay tienes tiene teneis tienen algun alguna algunos algunas
+ver ensename ensenadme muestrame mostrar dame dime hola buenas buenos dias tardes noches favor porfa gracias
+zona municipio localidad pueblo ciudad inmueble inmuebles propiedad propiedades vivienda viviendas precio euros eur
+disponible disponibles se vende venden alquila alquilan mi nuestra familia ahora tambien otra otro
+""".split())
+
+
+def _strip_accents(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+
+def parse_amount(number: str, multiplier: Optional[str]) -> float:
+    if re.fullmatch(r"\d{1,3}(?:[.\s]\d{3})+", number):
+        value = float(re.sub(r"[.\s]", "", number))
+    else:
+        value = float(number.replace(",", "."))
+    return value * _MULTIPLIERS.get(multiplier or "", 1)
+
+
+def render_literal(sql: str, parameters: Sequence) -> str:
+    """
+    Sustituye los "?" de la consulta por sus valores como literales SQL. Sólo se usa para guardar y registrar
+    la consulta (sesión, last_query, caché); la ejecución siempre usa la consulta parametrizada.
+    """
+    values = iter(parameters)
+
+    def literal(_):
+        value = next(values)
+        if isinstance(value, str):
+            return "'" + value.replace("'", "''") + "'"
+        return repr(value)
+    return re.sub(r"\?", literal, sql)
+
+
+class SQLBuilder:
+    """
+    Genera sin LLM la consulta SQL de las búsquedas estructuradas: filtros de igualdad sobre los campos requeridos
+    (resueltos con el ValueIndex), rango de precio y número de habitaciones.
+    Devuelve None si la consulta no es estructurada (campos sin resolver con confianza o palabras sin interpretar)
+    para que la genere el text2sql.
+    """
+
+    def __init__(self, table: str, columns: Sequence[str], value_index: ValueIndex, required_fields: Sequence[str],
+                 price_column: str = "precio", rooms_column: str = "habitaciones", min_score: float = 0.85, limit: int = 3):
+        self.table = table
+        self.value_index = value_index
+        self.required_fields = list(required_fields)
+        self.price_column = price_column if price_column in columns else None
+        self.rooms_column = rooms_column if rooms_column in columns else None
+        self.min_score = min_score
+        self.limit = limit
+
+    def _extract_ranges(self, text: str) -> Tuple[Optional[List[Tuple[str, str, float]]], str]:
+        """
+        Extrae las condiciones de habitaciones y precio. Devuelve (condiciones, texto sin las expresiones reconocidas)
+        o (None, texto) si se mencionan y no existe la columna correspondiente.
+        """
+        conditions = []
+        for match in list(_ROOMS.finditer(text)):
+            if self.rooms_column is None:
+                return None, text
+            qualifier, number = match.group(1), match.group(2)
+            rooms = _NUMBER_WORDS.get(number) or int(number)
+            if qualifier == "mas de":
+                conditions.append((">=", self.rooms_column, rooms + 1))
+            elif qualifier or match.group(3) or match.group(4):
+                conditions.append((">=", self.rooms_column, rooms))
+            else:
+                conditions.append(("=", self.rooms_column, rooms))
+        text = _ROOMS.sub(" ", text)
+
+        for pattern, operators in ((_PRICE_BETWEEN, (">=", "<=")), (_PRICE_MAX, ("<=",)), (_PRICE_MIN, (">=",))):
+            for match in list(pattern.finditer(text)):
+                groups = match.groups()
+                amounts = [(parse_amount(groups[i], groups[i + 1]), groups[i + 1] or groups[i + 2]) for i in range(0, len(groups), 3)]
+                # Cifras pequeñas sin unidad ("menos de 3") no son precios: la consulta se trata como libre
+                if self.price_column is None or any(amount < 100 and not unit for amount, unit in amounts):
+                    return None, text
+                amounts = [amount for amount, _ in amounts]
+                conditions += [(operator, self.price_column, amount) for operator, amount in zip(operators, amounts)]
+            text = pattern.sub(" ", text)
+        return conditions, text
+
+    def build(self, input: str, known: Optional[Dict[str, str]] = None) -> Optional[Dict]:
+        """
+        Devuelve {"sql_query", "sql_template", "parameters", "missing_fields"} o None si la consulta debe ir al LLM.
+            - known: campos resueltos en turnos anteriores. Los del input tienen prioridad.
+        """
+        conditions, text = self._extract_ranges(_strip_accents(input))
+        if conditions is None:
+            return None
+
+        matches = self.value_index.match(text)
+        if any(match.score < self.min_score for match in matches.values()):
+            return None
+        values = dict(known or {})
+        values.update({field: match.value for field, match in matches.items()})
+        if any(field not in values for field in self.required_fields):
+            return None
+
+        # Todas las palabras restantes deben ser de relleno
+        words = normalize_value(text).split()
+        consumed = {match.start + i for match in matches.values() for i in range(match.size)}
+        residual = [word for position, word in enumerate(words) if position not in consumed and word not in FILLER_WORDS]
+        if residual:
+            return None
+
+        clauses = [f'"{field}" = ?' for field in self.required_fields]
+        parameters = [values[field] for field in self.required_fields]
+        for operator, column, value in conditions:
+            clauses.append(f'"{column}" {operator} ?')
+            parameters.append(value)
+        sql = f'SELECT * FROM "{self.table}" WHERE {" AND ".join(clauses)} LIMIT {int(self.limit)}'
+        return {"sql_query": render_literal(sql, parameters), "sql_template": sql, "parameters": parameters, "missing_fields": []}
@@ -0,0 +1,152 @@
+import os
+import re
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+from src.intent_classifier import normalize_text
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_WHERE_TAIL = re.compile(r"\s+(group by|order by|limit)\s+")
+
+
+class LRUTTLCache:
+    """
+    Diccionario acotado: expulsa la entrada usada hace más tiempo al superar `max_entries`
+    y descarta las entradas con más de `ttl` segundos.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._entries.get(key, _MISSING)
+        if item is _MISSING:
+            return default
+        value, created = item
+        if time.monotonic() - created > self.ttl:
+            del self._entries[key]
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self._entries[key] = (value, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Normaliza el input del usuario: minúsculas, sin tildes, sin signos de puntuación y con espacios simples
+def normalize_input(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", normalize_text(text)).split())
+
+
+def canonicalize_sql(sql: str) -> str:
+    """
+    Forma canónica de una consulta SQL para usarla como clave:
+        - Espacios simples, sin ";" final y palabras clave en minúsculas (los literales se respetan).
+        - Las condiciones del WHERE unidas sólo por AND se ordenan, de modo que
+          "tipo='piso' AND poblacion='Madrid'" y "poblacion='Madrid' AND tipo='piso'" dan la misma clave.
+    """
+    sql = " ".join(sql.strip().rstrip(";").split())
+
+    # Se sustituyen los literales para poder pasar a minúsculas el resto
+    literals = _STRING_LITERAL.findall(sql)
+    skeleton = _STRING_LITERAL.sub("\x00", sql).lower()
+
+    where_at = skeleton.find(" where ")
+    if where_at != -1:
+        head, clause = skeleton[:where_at], skeleton[where_at + len(" where "):]
+        tail_match = _WHERE_TAIL.search(clause)
+        tail = ""
+        if tail_match:
+            clause, tail = clause[:tail_match.start()], clause[tail_match.start():]
+        if " or " not in clause and "(" not in clause:
+            # Los literales viajan con su condición al ordenar. Los de la parte anterior al WHERE (SELECT, FROM)
+            # y los posteriores (GROUP BY, ORDER BY, LIMIT) se quedan en su sitio
+            head_count = head.count("\x00")
+            head_literals, clause_literals = literals[:head_count], literals[head_count:]
+            conditions = []
+            for condition in clause.split(" and "):
+                count = condition.count("\x00")
+                conditions.append((condition, clause_literals[:count]))
+                clause_literals = clause_literals[count:]
+            conditions.sort()
+            clause = " and ".join(condition for condition, _ in conditions)
+            literals = head_literals + [literal for _, condition_literals in conditions for literal in condition_literals] + clause_literals
+        skeleton = f"{head} where {clause}{tail}"
+
+    parts = skeleton.split("\x00")
+    canonical = parts[0]
+    for literal, part in zip(literals, parts[1:]):
+        canonical += literal + part
+    return canonical
+
+
+class Text2SQLCache:
+    """
+    Caché de dos niveles para la herramienta QA:
+        - queries: (input normalizado, cláusulas previas, campos resueltos) -> resultado del text2sql (sql_query y missing_fields).
+          Los campos resueltos en turnos anteriores van en el prompt, por lo que forman parte de la clave.
+        - results: consulta SQL canónica -> resultado de su ejecución.
+    Ambos niveles se vacían cuando cambia el archivo de la base de datos (mtime o tamaño).
+    """
+
+    def __init__(self, database_path: str, max_entries: int = 256, ttl: float = 600):
+        self.database_path = database_path
+        self.queries = LRUTTLCache(max_entries, ttl)
+        self.results = LRUTTLCache(max_entries, ttl)
+        self._database_version = self._current_database_version()
+
+    def _current_database_version(self):
+        try:
+            stat = os.stat(self.database_path)
+            return (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+    def _check_database_version(self):
+        version = self._current_database_version()
+        if version != self._database_version:
+            logger.info("SQLite database changed, clearing text2sql cache")
+            self.clear()
+            self._database_version = version
+
+    def clear(self):
+        self.queries.clear()
+        self.results.clear()
+
+    @staticmethod
+    def query_key(input: str, last_query: str, resolved_fields: Optional[Dict[str, str]] = None) -> tuple:
+        return (normalize_input(input), last_query or "", tuple(sorted((resolved_fields or {}).items())))
+
+    def get_query(self, input: str, last_query: str, resolved_fields: Optional[Dict[str, str]] = None) -> Optional[Dict]:
+        self._check_database_version()
+        answer = self.queries.get(self.query_key(input, last_query, resolved_fields))
+        metrics.incr("sql_cache.query.hits" if answer is not None else "sql_cache.query.misses")
+        return dict(answer) if answer is not None else None
+
+    def set_query(self, input: str, last_query: str, answer: Dict, resolved_fields: Optional[Dict[str, str]] = None):
+        self.queries.set(self.query_key(input, last_query, resolved_fields), dict(answer))
+
+    def get_result(self, sql_query: str) -> Any:
+        self._check_database_version()
+        result = self.results.get(canonicalize_sql(sql_query), _MISSING)
+        metrics.incr("sql_cache.result.hits" if result is not _MISSING else "sql_cache.result.misses")
+        return None if result is _MISSING else result
+
+    def set_result(self, sql_query: str, result: Any):
+        self.results.set(canonicalize_sql(sql_query), result)
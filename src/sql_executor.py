@@ -0,0 +1,164 @@
+import asyncio
+import sqlite3
+import queue
+import time
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class QueryResult:
+    """
+    Resultado de una consulta en formato columnar: nombres de columna y una lista de valores por columna.
+        - row_count: filas leídas (como mucho el límite de filas del executor).
+        - truncated: True si la consulta devolvía más filas que el límite.
+        - sql: consulta que lo generó. Sirve de referencia para volver a ejecutarla.
+    """
+    columns: List[str]
+    data: List[List[Any]] = field(default_factory=list)
+    row_count: int = 0
+    truncated: bool = False
+    sql: str = ""
+
+    @classmethod
+    def from_rows(cls, columns: List[str], rows: List[Tuple], truncated: bool = False, sql: str = "") -> "QueryResult":
+        data = [list(column) for column in zip(*rows)] if rows else [[] for _ in columns]
+        return cls(columns, data, len(rows), truncated, sql)
+
+    def rows(self, limit: Optional[int] = None) -> List[Tuple]:
+        rows = list(zip(*self.data)) if self.columns else []
+        return rows if limit is None else rows[:limit]
+
+    def __bool__(self) -> bool:
+        return self.row_count > 0
+
+    def summary(self, max_rows: int) -> Dict:
+        """
+        Versión acotada para guardar en la sesión: como mucho max_rows filas más el número de filas y la consulta.
+        """
+        return {
+            "sql": self.sql,
+            "columns": self.columns,
+            "data": [column[:max_rows] for column in self.data],
+            "row_count": self.row_count,
+            "truncated": self.truncated
+        }
+
+    @classmethod
+    def from_summary(cls, summary: Dict) -> "QueryResult":
+        return cls(summary["columns"], summary["data"], summary["row_count"], summary["truncated"], summary.get("sql", ""))
+
+
+class SQLExecutor:
+    """
+    Ejecuta consultas SQL contra una base de datos SQLite sin bloquear el event loop.
+        - Las consultas se ejecutan en un pool de hilos acotado (pool_size).
+        - Cada hilo usa una conexión de solo lectura (mode=ro, immutable=1, con mmap) tomada de un pool.
+        - Las filas se leen del cursor hasta max_rows y se devuelven como QueryResult (columnar).
+        - Cada consulta tiene un timeout. Si vence o la tarea se cancela (p.ej. el cliente se desconecta),
+          se interrumpe la consulta en SQLite.
+    Publica en `metrics` la profundidad de la cola de espera y el tiempo de ejecución.
+    """
+
+    def __init__(self, database_path: str, pool_size: int = 4, timeout: float = 10.0, max_rows: int = 200, mmap_size: int = 256 * 1024 * 1024):
+        self.database_path = database_path
+        self.mmap_size = mmap_size
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="sqlite-ro")
+        self._connections = queue.LifoQueue()
+        self._semaphore = None
+        self._waiting = 0
+        self._closed = False
+        self._lock = threading.Lock()
+
+    # Conexión de solo lectura. "immutable=1" evita bloqueos y comprobaciones de cambios del archivo
+    def _connect(self) -> sqlite3.Connection:
+        uri = f"{Path(self.database_path).resolve().as_uri()}?mode=ro&immutable=1"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        # Lectura por mmap: las páginas se comparten entre conexiones y workers a través de la caché del sistema
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        return conn
+
+    def _acquire_connection(self) -> sqlite3.Connection:
+        try:
+            return self._connections.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def _release_connection(self, conn: sqlite3.Connection):
+        # Una consulta que termina después de close() ya no devuelve su conexión al pool: se cierra
+        with self._lock:
+            if not self._closed:
+                self._connections.put(conn)
+                return
+        conn.close()
+
+    # Se ejecuta en el hilo del pool
+    @staticmethod
+    def _fetch(conn: sqlite3.Connection, sql: str, parameters: Sequence, max_rows: int) -> QueryResult:
+        cursor = conn.execute(sql, parameters)
+        try:
+            # Se pide una fila más del límite para saber si el resultado está truncado
+            rows = cursor.fetchmany(max_rows + 1)
+            columns = [column[0] for column in cursor.description or ()]
+        finally:
+            cursor.close()
+        return QueryResult.from_rows(columns, rows[:max_rows], truncated=len(rows) > max_rows, sql=sql)
+
+    async def run(self, sql: str, parameters: Sequence = (), timeout: float = None, max_rows: int = None) -> QueryResult:
+        """
+        Ejecuta la consulta y devuelve como mucho max_rows filas. Lanza asyncio.TimeoutError si vence el timeout.
+        """
+        # El semáforo se crea dentro del event loop que lo usa
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.pool_size)
+        timeout = self.timeout if timeout is None else timeout
+        max_rows = self.max_rows if max_rows is None else max_rows
+
+        self._waiting += 1
+        metrics.gauge("sql.queue_depth", self._waiting)
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+            metrics.gauge("sql.queue_depth", self._waiting)
+
+        conn = self._acquire_connection()
+        start = time.perf_counter()
+        future = asyncio.get_running_loop().run_in_executor(self._executor, self._fetch, conn, sql, parameters, max_rows)
+
+        # La conexión y el hueco del pool sólo se liberan cuando el hilo ha terminado de verdad
+        def _on_done(fut):
+            metrics.observe("sql.execution_seconds", time.perf_counter() - start)
+            if not fut.cancelled():
+                fut.exception()
+            self._release_connection(conn)
+            self._semaphore.release()
+        future.add_done_callback(_on_done)
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            metrics.incr("sql.timeouts")
+            conn.interrupt()
+            raise
+        except asyncio.CancelledError:
+            metrics.incr("sql.cancelled")
+            conn.interrupt()
+            raise
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            self._closed = True
+        while not self._connections.empty():
+            self._connections.get_nowait().close()
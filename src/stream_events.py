@@ -0,0 +1,94 @@
+import json
+import asyncio
+from typing import Any, AsyncGenerator, AsyncIterable, NamedTuple, Union
+
+
+class StreamEvent(NamedTuple):
+    """
+    Evento tipado del stream de /chat. Las cadenas generan los tokens como str y el resto de eventos con esta clase.
+        - token: fragmento de la respuesta (data: str).
+        - status: cambio de estado de la interfaz, p.ej. "loading-db:start" (data: str).
+        - route: ruta elegida por el router (data: str).
+        - error: error durante la generación (data: str).
+        - done: fin de la respuesta (data: dict).
+    """
+    type: str
+    data: Any
+
+
+TOKEN = "token"
+STATUS = "status"
+ROUTE = "route"
+ERROR = "error"
+DONE = "done"
+
+LOADING_DB_START = StreamEvent(STATUS, "loading-db:start")
+LOADING_DB_END = StreamEvent(STATUS, "loading-db:end")
+
+
+async def coalesce_tokens(stream: AsyncIterable[Union[str, StreamEvent]], max_chars: int = 64, max_delay: float = 0.03) -> AsyncGenerator[StreamEvent, None]:
+    """
+    Convierte el stream de las cadenas en StreamEvents y agrupa los tokens consecutivos en lotes de hasta
+    max_chars caracteres o max_delay segundos, para reducir el número de frames enviados al cliente.
+        - El primer token se envía sin esperar, para no retrasar el tiempo hasta el primer token.
+        - max_delay es un temporizador real: un lote se envía al vencer aunque la cadena no genere más tokens.
+        - Antes de cualquier otro evento se envía el lote pendiente, de modo que el orden se conserva.
+    """
+    loop = asyncio.get_running_loop()
+    iterator = stream.__aiter__()
+    buffer = []
+    buffered_chars = 0
+    deadline = None
+    first_token = True
+    next_item = None
+    try:
+        while True:
+            if next_item is None:
+                next_item = asyncio.ensure_future(iterator.__anext__())
+            if buffer:
+                # La espera no cancela la lectura pendiente: si vence, se envía el lote y se sigue esperando el mismo elemento
+                done, _ = await asyncio.wait({next_item}, timeout=max(0.0, deadline - loop.time()))
+                if not done:
+                    yield StreamEvent(TOKEN, "".join(buffer))
+                    buffer, buffered_chars = [], 0
+                    continue
+            try:
+                item = await next_item
+            except StopAsyncIteration:
+                break
+            finally:
+                if next_item.done():
+                    next_item = None
+
+            if isinstance(item, StreamEvent) and item.type != TOKEN:
+                if buffer:
+                    yield StreamEvent(TOKEN, "".join(buffer))
+                    buffer, buffered_chars = [], 0
+                yield item
+                continue
+
+            token = item.data if isinstance(item, StreamEvent) else item
+            if not token:
+                continue
+            if first_token:
+                first_token = False
+                yield StreamEvent(TOKEN, token)
+                continue
+            if not buffer:
+                deadline = loop.time() + max_delay
+            buffer.append(token)
+            buffered_chars += len(token)
+            if buffered_chars >= max_chars:
+                yield StreamEvent(TOKEN, "".join(buffer))
+                buffer, buffered_chars = [], 0
+    finally:
+        # Si el cliente se desconecta no dejamos la lectura pendiente huérfana
+        if next_item is not None and not next_item.done():
+            next_item.cancel()
+    if buffer:
+        yield StreamEvent(TOKEN, "".join(buffer))
+
+
+# Frame NDJSON: un objeto JSON por línea
+def to_ndjson(event: StreamEvent) -> str:
+    return json.dumps({"type": event.type, "data": event.data}, ensure_ascii=False) + "\n"
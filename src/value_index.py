@@ -0,0 +1,168 @@
+import re
+import sqlite3
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+_TOKEN = re.compile(r"\w+")
+
+# Palabras del usuario que equivalen a un valor de la base de datos: campo -> {palabra normalizada: valor}
+DEFAULT_SYNONYMS = {
+    "operacion": {
+        "comprar": "venta", "compra": "venta", "compro": "venta", "vender": "venta", "vendo": "venta", "venden": "venta",
+        "alquilar": "alquiler", "alquilo": "alquiler", "alquilan": "alquiler", "arrendar": "alquiler", "renta": "alquiler",
+    },
+}
+
+
+# Palabras frecuentes en las peticiones que no son valores de ningún campo. Una palabra que no es valor conocido ni
+# está en esta lista puede ser un valor con errata o ausente de la base de datos (ver ValueIndex.unknown_words)
+COMMON_WORDS = set("""
+a al algo alguna alguno algun ante aqui asi bajo barato barata busca buscamos buscando busco cabe cerca como con contra
+cual cuanto de del desde donde dos el ella en entre era es esa ese esta este esto estoy favor gracias gustaria haber
+habitacion habitaciones hacia hasta hay hola interesa interesaria la las le lo los mas me mi mis mucho muy necesita
+necesitamos necesito no nos o para pero poco por precio precios preferiblemente puede que quiero quisiera se sea ser si
+sin sobre solo su sus tambien tener tengo tiene todo tu un una uno unos unas vale y ya zona ciudad municipio pueblo
+barrio inmueble inmuebles vivienda viviendas propiedad euros metros m2 maximo minimo menos buenas dias tardes
+""".split())
+
+
+def normalize_value(text: str) -> str:
+    text = unicodedata.normalize("NFKD", str(text).lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(_TOKEN.findall(text))
+
+
+# Formas singulares candidatas de cada palabra ("pisos" -> "piso", "locales" -> "local")
+def singular_forms(text: str) -> Set[str]:
+    forms = {text}
+    for suffix in ("s", "es"):
+        words = [word[:-len(suffix)] if word.endswith(suffix) and len(word) > len(suffix) + 2 else word for word in text.split()]
+        forms.add(" ".join(words))
+    return forms
+
+
+def trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class FieldMatch(NamedTuple):
+    value: str # valor de la base de datos
+    score: float # 1.0 en coincidencias exactas y sinónimos
+    start: int # posición de la primera palabra del input que coincide
+    size: int # número de palabras
+
+
+class ValueIndex:
+    """
+    Índice local de los valores distintos de los campos requeridos (tipo, operacion, poblacion) para extraerlos
+    del input sin llamar al LLM. Las comparaciones no distinguen mayúsculas ni tildes:
+        - Coincidencia exacta de las palabras del valor en el input (también en singular).
+        - Sinónimos (p.ej. "comprar" -> "venta"), sólo si el valor existe en la base de datos.
+        - Coincidencia aproximada por trigramas (similitud de Dice) para erratas y plurales.
+    """
+
+    def __init__(self, values: Dict[str, Iterable[str]], synonyms: Dict[str, Dict[str, str]] = None, threshold: float = 0.75):
+        self.threshold = threshold
+        self.fields = list(values)
+        self.entries: List[Tuple[str, str, str, Set[str]]] = [] # (campo, valor, valor normalizado, trigramas)
+        self.postings = defaultdict(set) # trigrama -> posiciones en entries
+        self.exact = defaultdict(list) # valor normalizado -> posiciones en entries
+        self.max_words = 1
+        for field, field_values in values.items():
+            for value in field_values:
+                normalized = normalize_value(value)
+                if not normalized:
+                    continue
+                grams = trigrams(normalized)
+                position = len(self.entries)
+                self.entries.append((field, value, normalized, grams))
+                self.exact[normalized].append(position)
+                for gram in grams:
+                    self.postings[gram].add(position)
+                self.max_words = max(self.max_words, len(normalized.split()))
+
+        self.synonyms = {}
+        for field, mapping in (DEFAULT_SYNONYMS if synonyms is None else synonyms).items():
+            for word, target in mapping.items():
+                matches = [self.entries[p][1] for p in self.exact.get(normalize_value(target), []) if self.entries[p][0] == field]
+                if matches:
+                    self.synonyms[normalize_value(word)] = (field, matches[0])
+
+    @classmethod
+    def from_database(cls, database_path: str, table: str, fields: Iterable[str], **kwargs) -> "ValueIndex":
+        conn = sqlite3.connect(f"file:{database_path}?mode=ro", uri=True)
+        try:
+            values = {field: [row[0] for row in conn.execute(f'SELECT DISTINCT "{field}" FROM "{table}" WHERE "{field}" IS NOT NULL')] for field in fields}
+        finally:
+            conn.close()
+        return cls(values, **kwargs)
+
+    @classmethod
+    def from_catalog(cls, catalog, fields: Iterable[str], **kwargs) -> "ValueIndex":
+        return cls({field: catalog.distinct_values(field) for field in fields}, **kwargs)
+
+    def _spans(self, words: List[str]):
+        for size in range(min(self.max_words, len(words)), 0, -1):
+            for start in range(len(words) - size + 1):
+                yield start, size, " ".join(words[start:start + size])
+
+    def match(self, input: str) -> Dict[str, FieldMatch]:
+        """
+        Devuelve {campo: FieldMatch} para los campos que aparecen en el input.
+        Para cada campo se queda con la coincidencia de mayor similitud (a igualdad, la más larga).
+        """
+        words = normalize_value(input).split()
+        best: Dict[str, FieldMatch] = {}
+
+        def offer(field, value, score, start, size):
+            if field not in best or (score, size) > (best[field].score, best[field].size):
+                best[field] = FieldMatch(value, score, start, size)
+
+        for start, word in enumerate(words):
+            if word in self.synonyms:
+                field, value = self.synonyms[word]
+                offer(field, value, 1.0, start, 1)
+
+        for start, size, span in self._spans(words):
+            for form in singular_forms(span):
+                for position in self.exact.get(form, ()):
+                    field, value, _, _ = self.entries[position]
+                    offer(field, value, 1.0, start, size)
+            # Palabras cortas ("en", "de", "un") no se comparan de forma aproximada
+            if len(span) < 4:
+                continue
+            grams = trigrams(span)
+            candidates = defaultdict(int)
+            for gram in grams:
+                for position in self.postings.get(gram, ()):
+                    candidates[position] += 1
+            for position, shared in candidates.items():
+                field, value, _, value_grams = self.entries[position]
+                score = 2 * shared / (len(grams) + len(value_grams))
+                if score >= self.threshold:
+                    offer(field, value, score, start, size)
+        return best
+
+    def resolve(self, input: str) -> Dict[str, str]:
+        """
+        Devuelve {campo: valor de la base de datos} para los campos que aparecen en el input.
+        """
+        return {field: match.value for field, match in self.match(input).items()}
+
+    def unknown_words(self, input: str) -> List[str]:
+        """
+        Palabras del input que no forman parte de ninguna coincidencia, no son números y no están en COMMON_WORDS.
+        Son candidatas a un valor que el índice no reconoce (errata o valor ausente de la base de datos).
+        """
+        words = normalize_value(input).split()
+        covered = set()
+        for match in self.match(input).values():
+            covered.update(range(match.start, match.start + match.size))
+        return [word for i, word in enumerate(words) if i not in covered and len(word) > 2 and not word.isdigit() and word not in COMMON_WORDS]
+
+    def missing_fields(self, input: str, known: Optional[Dict[str, str]] = None) -> List[str]:
+        resolved = dict(known or {})
+        resolved.update(self.resolve(input))
+        return [field for field in self.fields if field not in resolved]
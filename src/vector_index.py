@@ -0,0 +1,106 @@
+import os
+import pickle
+import logging
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq")
+
+# Nombre del índice plano (fuente de la ingesta incremental) y del índice que carga el servidor
+SOURCE_INDEX_NAME = "flat"
+SERVING_INDEX_NAME = "index"
+
+# PQ con 8 bits por subvector entrena 256 centroides por subcuantizador: necesita al menos 256 vectores
+PQ_MIN_TRAINING_POINTS = 256
+
+
+def build_faiss_index(vectors: np.ndarray, index_type: str = "flat", nlist: int = 256, hnsw_m: int = 32, pq_m: int = 16):
+    """
+    Construye un índice FAISS (métrica L2, como el índice por defecto de LangChain) a partir de los vectores.
+        - flat: búsqueda exacta por fuerza bruta.
+        - ivf: IVF-Flat con nlist listas. Se ajusta con nprobe.
+        - hnsw: grafo HNSW con hnsw_m vecinos por nodo. Se ajusta con efSearch.
+        - ivfpq: IVF con cuantización PQ de pq_m subvectores (menos memoria, recall aproximado). Se ajusta con nprobe.
+          Con menos de PQ_MIN_TRAINING_POINTS vectores no se puede entrenar y se construye un ivf.
+    Los vectores se añaden en orden, de modo que la posición i del índice corresponde al vector i.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, dimension = vectors.shape
+    # FAISS recomienda al menos ~39 vectores de entrenamiento por lista
+    nlist = max(1, min(nlist, n // 39))
+
+    if index_type == "ivfpq" and n < PQ_MIN_TRAINING_POINTS:
+        logger.warning(f"ivfpq needs at least {PQ_MIN_TRAINING_POINTS} vectors to train, got {n}. Building an ivf index instead")
+        index_type = "ivf"
+
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dimension)
+    elif index_type == "ivf":
+        index = faiss.index_factory(dimension, f"IVF{nlist},Flat")
+    elif index_type == "hnsw":
+        index = faiss.index_factory(dimension, f"HNSW{hnsw_m},Flat")
+    elif index_type == "ivfpq":
+        if dimension % pq_m:
+            raise ValueError(f"pq_m={pq_m} must divide the embedding dimension {dimension}")
+        index = faiss.index_factory(dimension, f"IVF{nlist},PQ{pq_m}")
+    else:
+        raise ValueError(f"Unknown index type '{index_type}'. Use one of {INDEX_TYPES}")
+
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def set_search_params(index, nprobe: int = None, ef_search: int = None):
+    """
+    Ajusta los parámetros de búsqueda: nprobe (listas visitadas en IVF) y efSearch (candidatos en HNSW).
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and nprobe:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+    if hasattr(index, "hnsw") and ef_search:
+        index.hnsw.efSearch = ef_search
+
+
+def read_index(path: str, mmap: bool = True):
+    """
+    Lee un índice FAISS. Con mmap el archivo se proyecta en memoria y los workers comparten las páginas.
+    Si el tipo de índice no admite mmap se lee de forma normal.
+    """
+    if mmap:
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+        try:
+            return faiss.read_index(path, flags)
+        except RuntimeError as e:
+            logger.info(f"Index {path} cannot be memory-mapped, loading in RAM: {e}")
+    return faiss.read_index(path)
+
+
+def load_vector_store(db_dir: str, embeddings: Embeddings, index_name: str = SERVING_INDEX_NAME, mmap: bool = True, nprobe: int = None, ef_search: int = None) -> FAISS:
+    """
+    Equivalente a FAISS.load_local pero con lectura memory-mapped y parámetros de búsqueda.
+    """
+    index = read_index(os.path.join(db_dir, f"{index_name}.faiss"), mmap=mmap)
+    set_search_params(index, nprobe=nprobe, ef_search=ef_search)
+    with open(os.path.join(db_dir, f"{index_name}.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+
+def publish_serving_index(source: FAISS, db_dir: str, index_type: str = "flat", nlist: int = 256, hnsw_m: int = 32, pq_m: int = 16):
+    """
+    Escribe el índice que carga el servidor (index.faiss/index.pkl) a partir del índice plano de la ingesta,
+    reconstruyendo sus vectores y construyendo el tipo de índice elegido. El docstore se conserva tal cual.
+    """
+    if index_type == "flat":
+        source.save_local(db_dir, index_name=SERVING_INDEX_NAME)
+        return source.index
+    vectors = source.index.reconstruct_n(0, source.index.ntotal)
+    index = build_faiss_index(vectors, index_type, nlist=nlist, hnsw_m=hnsw_m, pq_m=pq_m)
+    FAISS(source.embedding_function, index, source.docstore, source.index_to_docstore_id).save_local(db_dir, index_name=SERVING_INDEX_NAME)
+    return index
@@ -0,0 +1,99 @@
+import time
+import asyncio
+import logging
+import inspect
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+RETRYING = "retrying"
+READY = "ready"
+FAILED = "failed"
+
+
+class Warmup:
+    """
+    Progreso del arranque de la aplicación por componentes (cadenas, índices, índice TTL de MongoDB...).
+        - run() inicializa un componente: las funciones síncronas se ejecutan en un hilo y las corrutinas en el event loop,
+          de modo que los componentes independientes se pueden inicializar en paralelo con asyncio.gather.
+        - La aplicación está lista cuando todos los componentes requeridos están en estado "ready".
+          Los componentes opcionales (required=False) sólo registran el error si fallan.
+        - Los componentes requeridos se reintentan con backoff exponencial (retry_initial, duplicándose hasta retry_max
+          segundos), de modo que un fallo transitorio (MongoDB, OpenAI, artefactos a medio publicar) no deja la aplicación
+          sin arrancar. Con max_attempts > 0 el error se propaga tras ese número de intentos.
+    """
+
+    def __init__(self, retry_initial: float = 1.0, retry_max: float = 30.0, max_attempts: int = 0):
+        self.started_at = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+        self.ready_seconds = None
+        self.components = {}
+        self.retry_initial = retry_initial
+        self.retry_max = retry_max
+        self.max_attempts = max_attempts
+
+    def register(self, name: str, required: bool = True):
+        self.components[name] = {"status": PENDING, "required": required, "seconds": None, "error": None, "attempts": 0}
+
+    async def run(self, name: str, func: Callable, *args, **kwargs) -> Optional[Any]:
+        component = self.components.get(name)
+        if component is None:
+            self.register(name)
+            component = self.components[name]
+        start = time.perf_counter()
+        delay = self.retry_initial
+        while True:
+            component["status"] = RUNNING
+            component["attempts"] += 1
+            try:
+                if inspect.iscoroutinefunction(func):
+                    result = await func(*args, **kwargs)
+                else:
+                    result = await asyncio.to_thread(func, *args, **kwargs)
+                break
+            except Exception as e:
+                component.update(seconds=time.perf_counter() - start, error=str(e))
+                metrics.incr("startup.failures")
+                exhausted = self.max_attempts > 0 and component["attempts"] >= self.max_attempts
+                if not component["required"] or exhausted:
+                    component["status"] = FAILED
+                    logger.error(f"Startup of {name} failed: {e}")
+                    if component["required"]:
+                        raise
+                    return None
+                component["status"] = RETRYING
+                logger.warning(f"Startup of {name} failed (attempt {component['attempts']}), retrying in {delay:.1f}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.retry_max)
+        component.update(status=READY, seconds=time.perf_counter() - start, error=None)
+        metrics.observe(f"startup.{name}_seconds", component["seconds"])
+        logger.info(f"{name} ready in {component['seconds']:.2f}s")
+        return result
+
+    def finish(self):
+        self.ready_seconds = time.perf_counter() - self._start
+        metrics.observe("startup.total_seconds", self.ready_seconds)
+        logger.info(f"Application ready in {self.ready_seconds:.2f}s")
+
+    @property
+    def ready(self) -> bool:
+        return self.ready_seconds is not None
+
+    @property
+    def failed(self) -> bool:
+        return any(component["status"] == FAILED and component["required"] for component in self.components.values())
+
+    def status(self) -> Dict:
+        done = sum(component["status"] in (READY, FAILED) for component in self.components.values())
+        return {
+            "ready": self.ready,
+            "failed": self.failed,
+            "progress": f"{done}/{len(self.components)}",
+            "started_at": self.started_at.isoformat(),
+            "elapsed_seconds": self.ready_seconds if self.ready else time.perf_counter() - self._start,
+            "components": self.components
+        }
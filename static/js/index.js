@@ -4,7 +4,7 @@ let tempSpan = null;  // Variable para el span temporal.
 
 
 // ---------------------CALLBACKS---------------------
-// Lista de mensajes especiales que requieren un comportamiento específico
+// Eventos de estado ("status") que requieren un comportamiento específico
 const specialTags = {
     "loading-db:start": handleLoadingDbStart, // Arranque de la animación de carga para búsquedas en la base de datos
     "loading-db:end": handleLoadingDbEnd,  // Fin de la animación de carga para búsquedas en la base de datos
@@ -64,7 +64,7 @@ async function startSession() {
         const errorMessageDiv = createBotMessageContainer('bot');
         const chatContainer = document.getElementById("chat-container");
         targetDiv = errorMessageDiv.querySelector(".bot-message-content");
-        targetDiv.insertAdjacentHTML('beforeend', `Error: ${error.message}`);
+        appendErrorText(error.message);
         chatContainer.appendChild(errorMessageDiv);
     }
 }
@@ -90,11 +90,12 @@ async function sendMessage(userInput) {
     targetDiv = messageDiv.querySelector(".bot-message-content");
 
     try {
-        // 5. Solicitud de mensaje al backend
-        const response = await fetch('/chat', {
+        // 5. Solicitud de mensaje al backend. Se pide el stream de eventos en NDJSON (un objeto JSON por línea)
+        const response = await fetch('/chat?format=ndjson', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
+                'Accept': 'application/x-ndjson',
             },
             body: JSON.stringify({ user_input: userInput }),
         });
@@ -109,30 +110,26 @@ async function sendMessage(userInput) {
         // 7. Lectura del stream de datos
         const reader = response.body.getReader();
         const decoder = new TextDecoder();
-        botMessage = ""
+        let pending = "";  // Línea incompleta recibida al final del último chunk
 
         // 8. Bucle de lectura mientras el stream reciba datos
         while (true) {
             const { done, value } = await reader.read();
             if (done) break;
-            let chunk = decoder.decode(value, { stream: true }); // Convertir datos binarios a texto.
-            console.log("CHUNK: " + chunk);
-            botMessage+= chunk
-
-            // 9. Bucle de lectura mientras el stream reciba datos
-            const specialTagKeys = Object.keys(specialTags);
-            specialTagKeys.forEach(tag => {
-                if (chunk.includes(tag)) {
-                    specialTags[tag]();  // Ejecutar la función asociada al comando
-                    chunk = chunk.split(tag).join('');  // Eliminar el comando del chunk
+            pending += decoder.decode(value, { stream: true }); // Convertir datos binarios a texto.
+            const lines = pending.split("\n");
+            pending = lines.pop();
+
+            // 9. Cada línea es un evento tipado
+            for (const line of lines) {
+                if (line.trim() !== "") {
+                    await handleStreamEvent(JSON.parse(line));
                 }
-            });
-            // 10. Procesado del html
-            await renderize_html(chunk);
+            }
         }
         scrollToBottom()
     } catch (error) {
-        targetDiv.insertAdjacentHTML('beforeend', `Error: ${error.message}`);
+        appendErrorText(error.message);
     }
     finally {
         await cleanTemporalSpan();
@@ -141,6 +138,37 @@ async function sendMessage(userInput) {
 
 //___________________________________________________________________
 
+// EVENTOS DEL STREAM: token, status, route, error, done
+async function handleStreamEvent(event) {
+    switch (event.type) {
+        case "token":
+            // 10. Procesado del html
+            await renderize_html(event.data);
+            break;
+        case "status":
+            if (specialTags[event.data]) {
+                specialTags[event.data]();  // Ejecutar la función asociada al estado
+            }
+            break;
+        case "error":
+            handleLoadingDbEnd();
+            appendErrorText(event.data);
+            break;
+        case "route":
+            console.log("ROUTE: " + event.data);
+            break;
+        case "done":
+            break;
+    }
+}
+
+// El texto de error viene del servidor: se inserta como texto, nunca como HTML
+function appendErrorText(message) {
+    const errorSpan = document.createElement('span');
+    errorSpan.textContent = `Error: ${message}`;
+    targetDiv.appendChild(errorSpan);
+}
+
 async function renderize_html(chunk) {
     // Eliminar elementos markdown del chunk (simplificación)
     const plainText = chunk.replace(/[#*_\[\]\(\)`]/g, '');
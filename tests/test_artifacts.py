@@ -0,0 +1,69 @@
+import asyncio
+import os
+import pytest
+
+pytest.importorskip("src.directories")
+from src.artifacts import ArtifactManager, ArtifactReloader, artifact_files, LEGACY_VERSION  # noqa: E402
+
+
+def write_artifacts(directory, content):
+    os.makedirs(directory, exist_ok=True)
+    for name in artifact_files():
+        with open(os.path.join(directory, name), "w") as f:
+            f.write(content)
+
+
+class Target:
+    def __init__(self):
+        self.resources = None
+
+    def load_resources(self, directory):
+        with open(os.path.join(directory, artifact_files()[0])) as f:
+            return f.read()
+
+    def swap_resources(self, resources):
+        self.resources = resources
+
+
+def test_without_pointer_the_root_is_the_legacy_version(tmp_path):
+    manager = ArtifactManager(str(tmp_path))
+    assert manager.current_version() == LEGACY_VERSION
+    assert manager.current_dir() == str(tmp_path)
+
+
+def test_publish_switches_the_pointer_and_prunes_old_versions(tmp_path):
+    source = tmp_path / "build"
+    manager = ArtifactManager(str(tmp_path / "artifacts"))
+    for version in ["v1", "v2", "v3"]:
+        write_artifacts(str(source), version)
+        assert manager.publish(str(source), version, keep=2) == version
+    assert manager.current_version() == "v3"
+    assert sorted(os.listdir(tmp_path / "artifacts" / "versions")) == ["v2", "v3"]
+
+
+def test_publish_without_artifacts_fails_and_keeps_the_current_version(tmp_path):
+    manager = ArtifactManager(str(tmp_path / "artifacts"))
+    (tmp_path / "empty").mkdir()
+    with pytest.raises(FileNotFoundError):
+        manager.publish(str(tmp_path / "empty"), "v1")
+    assert manager.current_version() == LEGACY_VERSION
+
+
+def test_reloader_swaps_every_target_to_the_new_version(tmp_path):
+    source = tmp_path / "build"
+    manager = ArtifactManager(str(tmp_path / "artifacts"))
+    write_artifacts(str(source), "v1")
+    manager.publish(str(source), "v1")
+    targets = [Target(), Target()]
+
+    async def run():
+        reloader = ArtifactReloader(manager, targets, poll_interval=0)
+        assert (await reloader.reload())["version"] == "v1"
+        assert targets[0].resources is None # Sin cambios de versión no se recarga
+        write_artifacts(str(source), "v2")
+        manager.publish(str(source), "v2")
+        return await reloader.reload()
+
+    status = asyncio.run(run())
+    assert status["version"] == "v2" and status["last_error"] is None
+    assert [target.resources for target in targets] == ["v2", "v2"]
@@ -0,0 +1,42 @@
+from src.bm25_index import BM25Index, reciprocal_rank_fusion, tokenize
+
+DOCS = {
+    "a": "La fianza es de dos meses en los contratos de alquiler.",
+    "b": "Horario de la oficina de Málaga: de 9 a 14 horas.",
+    "c": "Referencia REF000123: piso en la calle Alcalá, código postal 28014.",
+}
+
+
+def build():
+    return BM25Index.build(list(DOCS), list(DOCS.values()))
+
+
+def test_tokenize_keeps_codes_and_removes_accents():
+    assert tokenize("Málaga, CP 28014 (REF000123)") == ["malaga", "cp", "28014", "ref000123"]
+
+
+def test_search_finds_exact_terms_and_codes():
+    index = build()
+    assert index.search("fianza")[0][0] == "a"
+    assert index.search("malaga")[0][0] == "b"
+    assert [doc_id for doc_id, _ in index.search("28014")] == ["c"]
+    assert index.search("inexistente") == []
+
+
+def test_search_is_ordered_and_limited_to_k():
+    results = build().search("de la oficina fianza", k=2)
+    assert len(results) == 2
+    assert results[0][1] >= results[1][1]
+
+
+def test_save_and_load_round_trip(tmp_path):
+    path = tmp_path / "bm25.pkl"
+    build().save(str(path))
+    assert BM25Index.load(str(path)).search("REF000123") == build().search("REF000123")
+
+
+def test_reciprocal_rank_fusion_rewards_documents_in_both_rankings():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "a", "d"]])
+    assert fused[0] == "a"
+    assert set(fused) == {"a", "b", "c", "d"}
+    assert fused.index("d") > fused.index("c")
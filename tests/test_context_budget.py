@@ -0,0 +1,49 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+from langchain_core.documents import Document  # noqa: E402
+from src.context_budget import ContextAssembler, count_tokens, truncate_tokens  # noqa: E402
+from src.sql_executor import QueryResult  # noqa: E402
+
+
+def test_truncate_tokens_respects_the_budget():
+    text = "palabra " * 200
+    truncated = truncate_tokens(text, 10)
+    assert truncated.endswith("…") and count_tokens(truncated) <= 12
+    assert truncate_tokens("corto", 10) == "corto"
+    assert truncate_tokens(text, 0) == ""
+
+
+def test_history_keeps_the_most_recent_turns_in_order():
+    entries = [{"user": f"pregunta {i}", "bot": "respuesta " * 5} for i in range(20)]
+    assembler = ContextAssembler(history_tokens=60, bot_turn_tokens=100)
+    history = assembler.history(entries)
+    assert "pregunta 19" in history and "pregunta 0\n" not in history
+    assert history.index("pregunta 18") < history.index("pregunta 19")
+    assert count_tokens(history) <= 60 + 2
+
+
+def test_documents_drop_duplicates_and_merge_overlapping_chunks():
+    text = "abcdefghij" * 3
+    documents = [
+        Document(page_content=text[:20], metadata={"source": "faq.pdf", "page": 1, "start_index": 0}),
+        Document(page_content=text[:20], metadata={"source": "faq.pdf", "page": 1, "start_index": 0}),
+        Document(page_content=text[10:30], metadata={"source": "faq.pdf", "page": 1, "start_index": 10}),
+        Document(page_content="otro chunk", metadata={"source": "faq.pdf", "page": 2, "start_index": 0}),
+    ]
+    context = ContextAssembler(context_tokens=1000).documents(documents)
+    assert context == f"[faq.pdf p.1]\n{text}\n\n[faq.pdf p.2]\notro chunk"
+
+
+def test_sql_result_is_a_compact_table_with_row_limits():
+    result = QueryResult.from_rows(["tipo", "precio"], [("piso", 100), ("casa", None), ("local", 300)], truncated=True)
+    table = ContextAssembler(max_rows=2).sql_result(result)
+    assert table.splitlines() == ["tipo | precio", "piso | 100", "casa | ", "(se muestran 2 filas de más de 3)"]
+
+
+def test_sql_result_accepts_session_summaries_and_legacy_strings():
+    assembler = ContextAssembler()
+    summary = QueryResult.from_rows(["tipo"], [("piso",)]).summary(max_rows=10)
+    assert assembler.sql_result(summary) == "tipo\npiso"
+    assert assembler.sql_result("[('piso', 100)]") == "piso | 100"
+    assert assembler.sql_result("[]") == "Sin resultados"
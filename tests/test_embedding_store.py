@@ -0,0 +1,72 @@
+import asyncio
+import threading
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("langchain_core")
+from langchain_core.embeddings import Embeddings  # noqa: E402
+from src.embedding_store import CachedEmbeddings  # noqa: E402
+
+
+class CountingEmbeddings(Embeddings):
+    model = "fake"
+
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts):
+        return self.embed_documents(texts)
+
+
+def test_vectors_are_persisted_and_reused(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    inner = CountingEmbeddings()
+    cache = CachedEmbeddings(inner, path)
+    assert cache.embed_documents(["a", "bb", "a"]) == [[1.0, 1.0], [2.0, 1.0], [1.0, 1.0]]
+    assert inner.calls == [["a", "bb"]]
+    cache.close()
+
+    reopened = CachedEmbeddings(inner, path)
+    assert reopened.embed_query("bb") == [2.0, 1.0]
+    assert inner.calls == [["a", "bb"]]
+    reopened.close()
+
+
+def test_async_store_io_runs_off_the_event_loop(tmp_path):
+    inner = CountingEmbeddings()
+    cache = CachedEmbeddings(inner, str(tmp_path / "cache.sqlite"), memory_entries=0)
+    threads = set()
+    original_lookup, original_write = cache._lookup_store, cache._write
+
+    def lookup_store(texts):
+        threads.add(threading.get_ident())
+        return original_lookup(texts)
+
+    def write(rows):
+        threads.add(threading.get_ident())
+        return original_write(rows)
+
+    cache._lookup_store, cache._write = lookup_store, write
+
+    async def run():
+        loop_thread = threading.get_ident()
+        vector = await cache.aembed_query("hola")
+        await asyncio.sleep(0.05)
+        return loop_thread, vector
+
+    loop_thread, vector = asyncio.run(run())
+    cache.close()
+    assert vector == [4.0, 1.0]
+    assert threads and loop_thread not in threads
+
+    reopened = CachedEmbeddings(inner, str(tmp_path / "cache.sqlite"))
+    assert reopened.embed_query("hola") == [4.0, 1.0]
+    assert len(inner.calls) == 1
+    reopened.close()
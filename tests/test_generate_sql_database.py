@@ -0,0 +1,97 @@
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+
+pd = pytest.importorskip("pandas")
+openpyxl = pytest.importorskip("openpyxl")
+pytest.importorskip("src.directories")
+pytest.importorskip("src.utilities")
+pytest.importorskip("src.config.clean_csv_functions")
+from src.config import generate_sql_dabase as etl  # noqa: E402
+
+
+def write_workbook(path, rows):
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
+
+
+def test_schema_is_inferred_from_every_chunk():
+    chunks = [
+        pd.DataFrame({"precio": [1, 2], "ref": [10, 11], "nota": [None, None]}),
+        pd.DataFrame({"precio": [2.5, None], "ref": ["A-1", None], "nota": [None, None]}),
+    ]
+    assert etl.infer_schema(chunks) == {"precio": "REAL", "ref": "TEXT", "nota": "TEXT"}
+
+
+def test_build_database_creates_a_typed_indexed_table(tmp_path, monkeypatch):
+    monkeypatch.setattr(etl, "get_clean_functions", lambda: [])
+    excel_path = str(tmp_path / "inmuebles.xlsx")
+    write_workbook(excel_path, [
+        ("tipo", "operacion", "poblacion", "precio", "habitaciones"),
+        ("Piso", "venta", "Madrid", 200000, 3),
+        ("casa", "alquiler", "Sevilla", 900.5, 2),
+        ("piso", "venta", "Madrid", 150000, None),
+    ])
+    name, rows, timings = etl.build_database(excel_path, "inmuebles", str(tmp_path), chunk_size=2)
+    assert (name, rows) == ("inmuebles", 3) and "load" in timings
+
+    database_path = str(tmp_path / "inmuebles.db")
+    conn = sqlite3.connect(database_path)
+    try:
+        types = {row[1]: row[2] for row in conn.execute('PRAGMA table_info("inmuebles")')}
+        assert types == {"tipo": "TEXT", "operacion": "TEXT", "poblacion": "TEXT", "precio": "REAL", "habitaciones": "INTEGER"}
+        indexes = {row[1] for row in conn.execute('PRAGMA index_list("inmuebles")')}
+        assert {"idx_inmuebles_filters", "idx_inmuebles_poblacion", "idx_inmuebles_precio", "idx_inmuebles_habitaciones"} <= indexes
+        assert [row[2] for row in conn.execute('PRAGMA index_info("idx_inmuebles_filters")')] == ["tipo", "operacion", "poblacion"]
+        # Los campos de igualdad no distinguen mayúsculas
+        assert conn.execute("SELECT COUNT(*) FROM inmuebles WHERE tipo = 'PISO'").fetchone()[0] == 2
+    finally:
+        conn.close()
+    assert os.path.exists(etl.schema_path(database_path))
+    assert not os.path.exists(database_path + ".tmp") and not os.path.exists(database_path + ".raw.csv")
+
+
+def test_build_databases_only_rebuilds_changed_workbooks(tmp_path, monkeypatch):
+    excel_dir, db_dir = tmp_path / "excel", tmp_path / "db"
+    excel_dir.mkdir()
+    cleaners = tmp_path / "clean_csv_functions.py"
+    cleaners.write_text("v1")
+    built = []
+
+    def fake_build(excel_path, name_db, db_dir, *args):
+        built.append(name_db)
+        open(os.path.join(db_dir, f"{name_db}.db"), "w").close()
+        return name_db, 1, {"load": 0.0}
+    # Los libros se procesan en hilos para que el ETL simulado se use también en el pool
+    monkeypatch.setattr(etl, "ProcessPoolExecutor", ThreadPoolExecutor)
+    monkeypatch.setattr(etl, "build_database", fake_build)
+    monkeypatch.setattr(etl, "CLEANERS_PATH", str(cleaners))
+
+    def run(**kwargs):
+        built.clear()
+        db_dict = etl.build_databases(str(excel_dir), str(db_dir), workers=2, **kwargs)
+        return sorted(built), sorted(db_dict)
+
+    (excel_dir / "a.xlsx").write_bytes(b"a1")
+    (excel_dir / "b.xlsx").write_bytes(b"b1")
+    assert run() == (["a", "b"], ["a", "b"])
+    assert run() == ([], ["a", "b"])
+
+    (excel_dir / "a.xlsx").write_bytes(b"a2")
+    assert run() == (["a"], ["a", "b"])
+
+    os.remove(db_dir / "b.db")
+    assert run() == (["b"], ["a", "b"])
+
+    # Si cambian las funciones de limpieza se regeneran todas
+    cleaners.write_text("v2")
+    assert run() == (["a", "b"], ["a", "b"])
+    assert run(full=True) == (["a", "b"], ["a", "b"])
+
+    os.remove(excel_dir / "b.xlsx")
+    assert run() == ([], ["a"])
+    assert list(etl.load_manifest(str(db_dir))["files"]) == ["a"]
@@ -0,0 +1,62 @@
+import asyncio
+import os
+import pytest
+
+pytest.importorskip("src.directories")
+pytest.importorskip("langchain_community")
+pytest.importorskip("langchain_openai")
+httpx = pytest.importorskip("httpx")
+openai = pytest.importorskip("openai")
+from src.config import generate_vector_database as ingestion  # noqa: E402
+
+
+class FakeEmbeddings:
+    """
+    Devuelve como vector la longitud de cada texto y registra las llamadas simultáneas.
+    `failures` llamadas fallan con un error de conexión antes de responder.
+    """
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = 0
+        self.running = 0
+        self.max_running = 0
+
+    async def aembed_documents(self, texts):
+        self.calls += 1
+        if self.failures:
+            self.failures -= 1
+            raise openai.APIConnectionError(request=httpx.Request("POST", "http://test/embeddings"))
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        return [[float(len(text))] for text in texts]
+
+
+def test_manifest_round_trip(tmp_path):
+    assert ingestion.load_manifest(str(tmp_path)) == {"files": {}}
+    manifest = {"files": {"a/b.pdf": {"sha256": "x", "ids": ["x-0"], "pages": 1}}, "index": {"index_type": "flat"}}
+    ingestion.save_manifest(str(tmp_path), manifest)
+    assert ingestion.load_manifest(str(tmp_path)) == manifest
+    assert os.listdir(tmp_path) == [ingestion.MANIFEST_NAME]
+
+
+def test_embed_texts_keeps_order_across_batches_with_bounded_concurrency():
+    embeddings = FakeEmbeddings()
+    texts = ["a" * n for n in range(1, 11)]
+    vectors = asyncio.run(ingestion.embed_texts(embeddings, texts, batch_size=3, concurrency=2))
+    assert vectors == [[float(n)] for n in range(1, 11)]
+    assert embeddings.calls == 4 and embeddings.max_running == 2
+
+
+def test_embed_texts_retries_connection_errors(monkeypatch):
+    async def no_sleep(delay):
+        pass
+    monkeypatch.setattr(ingestion.asyncio, "sleep", no_sleep)
+    embeddings = FakeEmbeddings(failures=2)
+    assert asyncio.run(ingestion.embed_texts(embeddings, ["ab"], max_retries=3)) == [[2.0]]
+    assert embeddings.calls == 3
+
+    with pytest.raises(openai.APIConnectionError):
+        asyncio.run(ingestion.embed_texts(FakeEmbeddings(failures=2), ["ab"], max_retries=2))
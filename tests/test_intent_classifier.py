@@ -0,0 +1,36 @@
+import json
+import logging
+from src.intent_classifier import (
+    KeywordIntentClassifier, IntentPrediction, log_decision, normalize_text, SEARCH_ROUTE, INFO_ROUTE, PRESENTATION_ROUTE
+)
+
+
+def test_normalize_text_removes_accents():
+    assert normalize_text("Búsqueda ÁTICO") == "busqueda atico"
+
+
+def test_classifies_each_route():
+    classifier = KeywordIntentClassifier()
+    assert classifier.classify("Busco un piso de alquiler en Madrid").route == SEARCH_ROUTE
+    assert classifier.classify("¿Qué fianza pedís en los contratos?").route == INFO_ROUTE
+    assert classifier.classify("Hola, ¿quién eres?").route == PRESENTATION_ROUTE
+
+
+def test_no_rule_means_no_route():
+    prediction = KeywordIntentClassifier().classify("zzz")
+    assert prediction == IntentPrediction(None, 0.0, {})
+
+
+def test_confidence_is_the_margin_between_the_two_best_routes():
+    rules = [(SEARCH_ROUTE, r"piso", 2.0), (INFO_ROUTE, r"fianza", 1.0)]
+    classifier = KeywordIntentClassifier(rules, smoothing=0.0)
+    assert classifier.classify("piso").confidence == 1.0
+    assert classifier.classify("piso y fianza").confidence == 0.5
+
+
+def test_log_decision_records_agreement(caplog):
+    prediction = IntentPrediction(SEARCH_ROUTE, 0.8, {SEARCH_ROUTE: 3.0})
+    with caplog.at_level(logging.INFO, logger="router.preclassifier"):
+        log_decision("busco piso", prediction, source="shadow", llm_route=SEARCH_ROUTE)
+    record = json.loads(caplog.records[-1].getMessage())
+    assert record["agreement"] is True and record["source"] == "shadow"
@@ -0,0 +1,57 @@
+import asyncio
+import time
+import pytest
+
+httpx = pytest.importorskip("httpx")
+from src.llm_transport import LimitedTransport, TokenBucket  # noqa: E402
+
+
+def test_token_bucket_allows_a_burst_and_then_the_rate():
+    async def run():
+        bucket = TokenBucket(rate=20, capacity=2)
+        start = time.monotonic()
+        for _ in range(4):
+            await bucket.acquire()
+        return time.monotonic() - start
+    # 2 peticiones de ráfaga y 2 más a 20/s
+    assert 0.08 <= asyncio.run(run()) < 0.5
+
+
+def test_concurrency_slot_is_held_until_the_stream_is_closed():
+    async def run():
+        active = 0
+        peak = 0
+
+        async def handler(request):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            return httpx.Response(200, content=b"ok")
+
+        transport = LimitedTransport(httpx.MockTransport(handler), "qa", max_concurrency=2)
+        async with httpx.AsyncClient(transport=transport) as client:
+            async with client.stream("GET", "http://llm/v1") as response:
+                assert transport.in_flight == 1
+                await response.aread()
+            assert transport.in_flight == 0
+            responses = await asyncio.gather(*(client.get("http://llm/v1") for _ in range(6)))
+        return peak, [response.text for response in responses], transport.in_flight
+
+    peak, texts, in_flight = asyncio.run(run())
+    assert peak <= 2 and texts == ["ok"] * 6 and in_flight == 0
+
+
+def test_failed_requests_release_the_slot():
+    async def run():
+        def handler(request):
+            raise httpx.ConnectError("refused")
+
+        transport = LimitedTransport(httpx.MockTransport(handler), "rag", max_concurrency=1)
+        async with httpx.AsyncClient(transport=transport) as client:
+            for _ in range(2):
+                with pytest.raises(httpx.ConnectError):
+                    await asyncio.wait_for(client.get("http://llm/v1"), 1)
+        return transport.in_flight
+    assert asyncio.run(run()) == 0
@@ -0,0 +1,27 @@
+from src.metrics import Metrics
+
+
+def test_counters_gauges_and_timings():
+    metrics = Metrics(window=4)
+    metrics.incr("hits")
+    metrics.incr("hits", 2)
+    metrics.gauge("queue", 3)
+    for value in [1.0, 2.0, 3.0, 4.0, 5.0]:
+        metrics.observe("latency", value)
+    snapshot = metrics.snapshot()
+    assert snapshot["counters"] == {"hits": 3}
+    assert snapshot["gauges"] == {"queue": 3}
+    latency = snapshot["timings"]["latency"]
+    assert latency["count"] == 5 and latency["avg"] == 3.0 and latency["max"] == 5.0
+    # Los percentiles se calculan sobre la ventana (los últimos 4 valores)
+    assert latency["p50"] == 3.0 and latency["p99"] == 4.0
+
+
+def test_timer_records_even_when_the_block_raises():
+    metrics = Metrics()
+    try:
+        with metrics.timer("step"):
+            raise ValueError
+    except ValueError:
+        pass
+    assert metrics.snapshot()["timings"]["step"]["count"] == 1
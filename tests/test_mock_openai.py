@@ -0,0 +1,54 @@
+import os
+import sys
+import json
+import base64
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+pytest.importorskip("uvicorn")
+from fastapi.testclient import TestClient  # noqa: E402
+
+# El servidor simulado se importa como lo hacen los scripts de benchmarks/loadtest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "loadtest"))
+from mock_openai import create_app, fake_embedding, _sql_answer  # noqa: E402
+from src.intent_classifier import SEARCH_ROUTE, INFO_ROUTE, PRESENTATION_ROUTE  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    return TestClient(create_app(tokens_per_second=0, latency=0, answer_tokens=5, embedding_dim=8))
+
+
+def chat(client, content, stream=False):
+    return client.post("/v1/chat/completions", json={"model": "gpt-4o", "stream": stream, "messages": [{"role": "user", "content": content}]})
+
+
+def test_text2sql_answer_uses_the_listed_values():
+    prompt = 'CREATE TABLE "inmuebles" (\n\t"tipo" TEXT\n)\n/* Valores de tipo: piso, casa */\n/* Valores de poblacion: Madrid */'
+    assert _sql_answer(prompt) == ('SELECT * FROM "inmuebles" WHERE "tipo" = \'piso\' AND "operacion" IS NOT NULL '
+                                   'AND "poblacion" = \'Madrid\' LIMIT 3')
+
+
+def test_completions_depend_on_the_prompt(client):
+    routes = f"Rutas: {SEARCH_ROUTE}, {INFO_ROUTE}, {PRESENTATION_ROUTE}\nInput: busco un piso en alquiler en Madrid"
+    assert chat(client, routes).json()["choices"][0]["message"]["content"] == SEARCH_ROUTE
+    assert chat(client, 'CREATE TABLE "inmuebles"').json()["choices"][0]["message"]["content"].startswith('SELECT * FROM "inmuebles"')
+    assert chat(client, "¿Nueva búsqueda?").json()["choices"][0]["message"]["content"] == "True"
+
+
+def test_streaming_answer_is_server_sent_events(client):
+    lines = [line for line in chat(client, "Responde", stream=True).text.split("\n\n") if line]
+    assert lines[-1] == "data: [DONE]"
+    chunks = [json.loads(line[len("data: "):]) for line in lines[:-1]]
+    assert [chunk["choices"][0]["finish_reason"] for chunk in chunks][-1] == "stop"
+    assert len([chunk for chunk in chunks if chunk["choices"][0]["delta"].get("content")]) == 5
+    assert client.get("/health").json() == {"chat": 0, "chat_stream": 1, "embeddings": 0}
+
+
+def test_embeddings_are_deterministic_and_normalized(client):
+    response = client.post("/v1/embeddings", json={"input": ["piso en Madrid", [1, 2, 3]], "encoding_format": "base64"}).json()
+    vectors = [np.frombuffer(base64.b64decode(item["embedding"]), dtype=np.float32) for item in response["data"]]
+    assert np.allclose(vectors[0], fake_embedding("piso en Madrid", 8)) and np.allclose(vectors[1], fake_embedding([1, 2, 3], 8))
+    assert all(abs(np.linalg.norm(vector) - 1) < 1e-5 for vector in vectors)
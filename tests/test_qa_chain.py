@@ -0,0 +1,112 @@
+import asyncio
+import weakref
+from datetime import datetime, timezone
+import pytest
+
+pytest.importorskip("src.directories")
+pytest.importorskip("src.utilities")
+pytest.importorskip("langchain_community")
+pytest.importorskip("fastapi_sessions")
+from session_manager import SessionData  # noqa: E402
+from src.qa_chain import QAChain  # noqa: E402
+
+
+def bare_chain():
+    # QAChain sin cadenas ni base de datos: sólo el estado que usan los métodos probados
+    chain = QAChain.__new__(QAChain)
+    chain._session_locks = weakref.WeakValueDictionary()
+    chain.db = object()
+    chain._dialect = "sqlite"
+    chain._table_info = 'CREATE TABLE "inmuebles" ("tipo" TEXT)'
+    chain.schema_catalog = None
+    chain.value_index = None
+    chain.top_k = 3
+    return chain
+
+
+def new_session(session_id="s1", last_query=None):
+    now = datetime.now(timezone.utc)
+    qa_data = {"last_query": last_query, "missing_fields": [], "sql_queries": []}
+    return SessionData(session_id=session_id, history=[], qa_data=qa_data, last_active=now, expiration_time=now)
+
+
+def test_session_locks_are_per_session_and_released():
+    chain = bare_chain()
+    lock = chain.session_lock("a")
+    assert chain.session_lock("a") is lock
+    assert chain.session_lock("b") is not lock
+    assert list(chain._session_locks) == ["a"]
+    del lock
+    assert len(chain._session_locks) == 0
+
+
+def test_text2sql_input_is_built_per_request():
+    chain = bare_chain()
+    first = chain.build_text2sql_input("pisos en Madrid", new_session("a", last_query={"tipo": "piso"}))
+    second = chain.build_text2sql_input("casas", new_session("b"))
+    assert first is not second
+    assert first["input"] == "pisos en Madrid" and first["last_query"] == "{'tipo': 'piso'}"
+    assert second["input"] == "casas" and second["last_query"] == ""
+    assert first["table_info"] == second["table_info"] and first["top_k"] == 3
+
+
+class Branch:
+    """
+    Rama especulativa simulada: una tarea que no termina hasta que se cancela.
+    """
+
+    def __init__(self):
+        self.task = asyncio.ensure_future(asyncio.sleep(10))
+
+    def cancel(self):
+        return self.task.cancel()
+
+
+def run_execute(chain, session, snapshot):
+    """
+    Ejecuta un turno con dos ramas especulativas. Devuelve los mensajes, las ramas que recibe _execute
+    y si cada rama se ha cancelado al terminar el turno.
+    """
+    calls = []
+
+    async def fake_execute(input, history, session, new_search=None, query=None):
+        calls.append((new_search, query))
+        yield "respuesta"
+    chain._execute = fake_execute
+
+    async def run():
+        branches = [Branch(), Branch()]
+        messages = [message async for message in chain.execute("pisos", "", session, *branches, snapshot=snapshot)]
+        await asyncio.sleep(0.01)
+        return messages, [branch.task.cancelled() for branch in branches]
+    messages, cancelled = asyncio.run(run())
+    return messages, calls, cancelled
+
+
+def test_snapshot_copies_only_speculative_fields():
+    chain = bare_chain()
+    session = new_session(last_query={"tipo": "piso"})
+    snapshot = asyncio.run(chain.snapshot_session(session))
+    assert set(snapshot.qa_data) == set(QAChain.SPECULATIVE_FIELDS)
+    snapshot.qa_data["last_query"]["tipo"] = "casa"
+    assert session.qa_data["last_query"] == {"tipo": "piso"}
+
+
+def test_speculative_branches_are_used_while_the_snapshot_is_current():
+    chain = bare_chain()
+    session = new_session()
+    snapshot = asyncio.run(chain.snapshot_session(session))
+    messages, calls, cancelled = run_execute(chain, session, snapshot)
+    assert messages == ["respuesta"]
+    assert calls[0][0] is not None and calls[0][1] is not None and cancelled == [False, False]
+
+
+def test_stale_speculative_branches_are_cancelled_and_repeated():
+    chain = bare_chain()
+    session = new_session()
+    snapshot = asyncio.run(chain.snapshot_session(session))
+    # Otro turno de la sesión cambia la última consulta después de lanzar las ramas
+    session.qa_data["last_query"] = {"tipo": "casa"}
+    messages, calls, cancelled = run_execute(chain, session, snapshot)
+    assert messages == ["respuesta"]
+    assert calls == [(None, None)] and cancelled == [True, True]
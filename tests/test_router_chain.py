@@ -0,0 +1,82 @@
+import asyncio
+import pytest
+
+pytest.importorskip("src.directories")
+pytest.importorskip("src.utilities")
+pytest.importorskip("langchain_community")
+pytest.importorskip("fastapi_sessions")
+from src.router_chain import Router_chain  # noqa: E402
+from src.intent_classifier import SEARCH_ROUTE, INFO_ROUTE  # noqa: E402
+
+
+class FakeQAChain:
+    """
+    Registra las ramas especulativas: check_new_search y build_query no terminan hasta que se cancelan.
+    """
+
+    def __init__(self):
+        self.cancelled = []
+        self.execute_kwargs = None
+        self.branches_running = None
+
+    async def snapshot_session(self, session):
+        return session
+
+    async def _wait(self, name):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            self.cancelled.append(name)
+            raise
+
+    def check_new_search(self, input, history, session):
+        return self._wait("check_new_search")
+
+    def build_query(self, input, session):
+        return self._wait("build_query")
+
+    async def execute(self, input, history, session, **kwargs):
+        self.execute_kwargs = kwargs
+        self.branches_running = not kwargs["new_search"].done() and not kwargs["query"].done()
+        yield "qa"
+
+
+class FakeRagChain:
+    async def query_rag(self, input, history):
+        yield "rag"
+
+
+def speculative_router(route):
+    router = Router_chain.__new__(Router_chain)
+    router.qa_chain = FakeQAChain()
+    router.rag_chain = FakeRagChain()
+    router.speculative_text2sql = True
+
+    async def classify(input, history):
+        await asyncio.sleep(0.01)
+        return route
+    router.classify = classify
+    return router
+
+
+def run(router):
+    async def collect():
+        messages = [message async for message in router.execute_speculative("pisos en Madrid", "", session=None)]
+        await asyncio.sleep(0.01)
+        return [message for message in messages if isinstance(message, str)]
+    return asyncio.run(collect())
+
+
+def test_search_route_hands_the_running_branches_to_the_qa_chain():
+    router = speculative_router(SEARCH_ROUTE)
+    assert run(router) == ["qa"]
+    assert set(router.qa_chain.execute_kwargs) == {"new_search", "query", "snapshot"}
+    # Las ramas lanzadas en paralelo a la clasificación llegan sin terminar ni cancelar
+    assert router.qa_chain.branches_running
+
+
+def test_other_routes_cancel_the_speculative_branches():
+    router = speculative_router(INFO_ROUTE)
+    assert run(router) == ["rag"]
+    assert sorted(router.qa_chain.cancelled) == ["build_query", "check_new_search"]
+    assert router.qa_chain.execute_kwargs is None
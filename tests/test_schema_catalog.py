@@ -0,0 +1,72 @@
+import os
+import sqlite3
+import pytest
+from src.schema_catalog import SchemaCatalog, build_schema_catalog, save_schema_catalog, schema_path
+
+
+@pytest.fixture
+def database_path(tmp_path):
+    path = str(tmp_path / "inmuebles.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE inmuebles (tipo TEXT, operacion TEXT, poblacion TEXT, precio REAL, num_habitaciones INTEGER, descripcion TEXT)")
+    conn.executemany("INSERT INTO inmuebles VALUES (?, ?, ?, ?, ?, ?)", [
+        ("piso", "venta", "Madrid", 200000, 3, "Piso luminoso"),
+        ("piso", "alquiler", "Sevilla", 900, 2, "Piso céntrico"),
+        ("casa", "venta", "Madrid", 350000, 4, "Casa con jardín"),
+    ])
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_build_describes_tables_and_distinct_values(database_path):
+    catalog = build_schema_catalog(database_path, sample_rows=2)
+    assert list(catalog["tables"]) == ["inmuebles"]
+    table = catalog["tables"]["inmuebles"]
+    assert [column["name"] for column in table["columns"]][:3] == ["tipo", "operacion", "poblacion"]
+    assert len(table["sample_rows"]) == 2
+    assert table["distinct"]["tipo"] == {"piso": 2, "casa": 1}
+
+
+def test_load_rejects_a_stale_artifact(database_path):
+    save_schema_catalog(build_schema_catalog(database_path), schema_path(database_path))
+    assert SchemaCatalog.load(database_path) is not None
+    conn = sqlite3.connect(database_path)
+    conn.execute("INSERT INTO inmuebles (tipo) VALUES ('local')")
+    conn.commit()
+    conn.close()
+    os.utime(database_path, (0, 0))
+    assert SchemaCatalog.load(database_path) is None
+
+
+def test_table_info_only_samples_relevant_columns(database_path):
+    catalog = SchemaCatalog(build_schema_catalog(database_path))
+    info = catalog.table_info("pisos de 3 habitaciones", always=["tipo"])
+    assert info.startswith('CREATE TABLE "inmuebles" (')
+    assert '\t"precio" REAL' in info
+    assert "tipo\tnum_habitaciones\n" in info
+    assert "/* Valores de poblacion: Madrid, Sevilla */" in info
+
+
+def test_long_value_lists_only_include_values_in_the_input(database_path):
+    catalog = SchemaCatalog(build_schema_catalog(database_path), max_listed_values=1)
+    info = catalog.table_info("algo en sevilla")
+    assert "/* Valores de poblacion: Sevilla */" in info
+    assert "Valores de tipo" not in info
+    assert catalog.distinct_values("operacion") == ["venta", "alquiler"]
+
+
+def test_fts_tables_are_described_as_a_join_hint(database_path):
+    conn = sqlite3.connect(database_path)
+    try:
+        conn.execute("CREATE VIRTUAL TABLE inmuebles_fts USING fts5(descripcion, content='inmuebles')")
+    except sqlite3.OperationalError:
+        pytest.skip("FTS5 no disponible")
+    conn.commit()
+    conn.close()
+    catalog = build_schema_catalog(database_path)
+    # Ni la tabla virtual ni sus tablas internas (inmuebles_fts_data, ...) se describen como tablas
+    assert list(catalog["tables"]) == ["inmuebles"]
+    assert catalog["tables"]["inmuebles"]["fts"] == {"table": "inmuebles_fts", "columns": ["descripcion"]}
+    info = SchemaCatalog(catalog).table_info("piso con jardín")
+    assert 'JOIN "inmuebles" ON "inmuebles".rowid = "inmuebles_fts".rowid WHERE "inmuebles_fts" MATCH' in info
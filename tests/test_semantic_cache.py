@@ -0,0 +1,34 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+from src.semantic_cache import SemanticCache  # noqa: E402
+
+
+def test_lookup_returns_answer_above_threshold():
+    cache = SemanticCache(threshold=0.9)
+    cache.store([1.0, 0.0], "¿qué fianza pedís?", "Dos meses")
+    assert cache.lookup([0.99, 0.05]) == "Dos meses"
+    assert cache.lookup([0.0, 1.0]) is None
+
+
+def test_lookup_requires_same_context_signature():
+    cache = SemanticCache(threshold=0.9)
+    history_a = SemanticCache.context_signature("user: busco piso en Madrid")
+    history_b = SemanticCache.context_signature("user: busco casa en Sevilla")
+    cache.store([1.0, 0.0], "¿y el precio?", "Desde 900 euros", history_a)
+    assert cache.lookup([1.0, 0.0], history_a) == "Desde 900 euros"
+    assert cache.lookup([1.0, 0.0], history_b) is None
+    assert cache.lookup([1.0, 0.0]) is None
+
+
+def test_context_signature_ignores_whitespace_and_empty_history():
+    assert SemanticCache.context_signature("") == SemanticCache.context_signature(None) == ""
+    assert SemanticCache.context_signature("a  b\n") == SemanticCache.context_signature("a b")
+
+
+def test_entries_are_evicted_by_lru():
+    cache = SemanticCache(threshold=0.9, max_entries=1)
+    cache.store([1.0, 0.0], "a", "A")
+    cache.store([0.0, 1.0], "b", "B")
+    assert cache.lookup([1.0, 0.0]) is None
+    assert cache.lookup([0.0, 1.0]) == "B"
@@ -0,0 +1,182 @@
+import asyncio
+from datetime import datetime, timezone
+import pytest
+
+pytest.importorskip("pydantic")
+pytest.importorskip("pymongo")
+pytest.importorskip("fastapi_sessions")
+from session_manager import SessionData, CachedSessionBackend  # noqa: E402
+
+
+class FakeCollection:
+    """
+    Colección en memoria con lo que usa CachedSessionBackend: find_one, bulk_write (con filtro por versión),
+    find y update_one. `write_started` y `release_write` permiten intercalar turnos durante un bulk_write.
+    """
+
+    def __init__(self):
+        self.docs = {}
+        self.write_started = asyncio.Event()
+        self.release_write = None
+
+    def _apply(self, doc, update):
+        for key, push in update["$push"].items():
+            if key.startswith("qa_data."):
+                key = key.split(".", 1)[1]
+                doc["qa_data"][key] = (doc["qa_data"].get(key, []) + push["$each"])[push["$slice"]:]
+            else:
+                doc[key] = (doc[key] + push["$each"])[push["$slice"]:]
+        for key, value in update["$set"].items():
+            if key.startswith("qa_data."):
+                doc["qa_data"][key.split(".", 1)[1]] = value
+            else:
+                doc[key] = value
+        doc["version"] += update["$inc"]["version"]
+
+    def _matches(self, doc, query):
+        return all(doc.get(key) == value for key, value in query.items())
+
+    async def find_one(self, query, projection=None):
+        doc = self.docs.get(query["session_id"])
+        return dict(doc) if doc else None
+
+    async def bulk_write(self, operations, ordered=False):
+        self.write_started.set()
+        if self.release_write is not None:
+            await self.release_write.wait()
+        matched = 0
+        for operation in operations:
+            doc = self.docs.get(operation._filter["session_id"])
+            if doc is not None and self._matches(doc, operation._filter):
+                self._apply(doc, operation._doc)
+                matched += 1
+        return type("Result", (), {"matched_count": matched})()
+
+    async def update_one(self, query, update):
+        self._apply(self.docs[query["session_id"]], update)
+
+    def find(self, query, projection=None):
+        docs = [dict(self.docs[session_id]) for session_id in query["session_id"]["$in"] if session_id in self.docs]
+
+        async def cursor():
+            for doc in docs:
+                yield doc
+        return cursor()
+
+
+class FakeBackend:
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def create(self, data):
+        self.collection.docs[data.session_id] = data.model_dump()
+
+    async def read(self, session_id, history_limit=None):
+        doc = self.collection.docs.get(str(session_id))
+        return SessionData(**doc) if doc else None
+
+
+def new_session(session_id="s1", history=None):
+    now = datetime.now(timezone.utc)
+    return SessionData(session_id=session_id, history=history or [], qa_data={}, last_active=now, expiration_time=now)
+
+
+def append(cache, session, entry, history_cap=50):
+    # Igual que main.update_session: el turno se añade a la sesión cacheada y se encola para MongoDB
+    session.history.append(entry)
+    now = datetime.now(timezone.utc)
+    return cache.append_turn(session.session_id, entry, {"last_query": entry["n"]}, now, now, history_cap)
+
+
+def test_validate_reads_is_the_default():
+    assert CachedSessionBackend(FakeBackend(FakeCollection())).validate_reads
+
+
+def test_read_evicts_session_changed_by_another_worker():
+    async def run():
+        collection = FakeCollection()
+        cache = CachedSessionBackend(FakeBackend(collection))
+        await cache.create(new_session())
+        collection.docs["s1"]["version"] = 5
+        collection.docs["s1"]["qa_data"] = {"last_query": "otro worker"}
+        session = await cache.read("s1")
+        assert session.version == 5 and session.qa_data == {"last_query": "otro worker"}
+    asyncio.run(run())
+
+
+def test_append_turn_trims_cached_history():
+    async def run():
+        cache = CachedSessionBackend(FakeBackend(FakeCollection()))
+        session = new_session()
+        await cache.create(session)
+        for n in range(5):
+            append(cache, session, {"n": n}, history_cap=3)
+        assert [entry["n"] for entry in session.history] == [2, 3, 4]
+    asyncio.run(run())
+
+
+def test_turn_appended_during_flush_is_rebased():
+    async def run():
+        collection = FakeCollection()
+        cache = CachedSessionBackend(FakeBackend(collection))
+        session = new_session()
+        await cache.create(session)
+
+        append(cache, session, {"n": 0})
+        collection.release_write = asyncio.Event()
+        flush = asyncio.create_task(cache.flush())
+        await collection.write_started.wait()
+        append(cache, session, {"n": 1})
+        collection.release_write.set()
+        await flush
+
+        collection.release_write = None
+        await cache.flush()
+        doc = collection.docs["s1"]
+        assert [entry["n"] for entry in doc["history"]] == [0, 1]
+        assert doc["version"] == session.version == 2
+        assert doc["last_writer"] and "s1" in cache._sessions
+    asyncio.run(run())
+
+
+def test_failed_flush_keeps_turns_in_order():
+    async def run():
+        collection = FakeCollection()
+        cache = CachedSessionBackend(FakeBackend(collection))
+        session = new_session()
+        await cache.create(session)
+        append(cache, session, {"n": 0})
+
+        async def failing_write(operations, ordered=False):
+            append(cache, session, {"n": 1})
+            raise RuntimeError("mongo down")
+        original_write, collection.bulk_write = collection.bulk_write, failing_write
+        with pytest.raises(Exception):
+            await cache.flush()
+
+        collection.bulk_write = original_write
+        await cache.flush()
+        assert [entry["n"] for entry in collection.docs["s1"]["history"]] == [0, 1]
+        assert collection.docs["s1"]["version"] == 1
+    asyncio.run(run())
+
+
+def test_cached_turns_merge_sql_query_appends_and_sets():
+    async def run():
+        collection = FakeCollection()
+        cache = CachedSessionBackend(FakeBackend(collection))
+        session = new_session()
+        session.qa_data = {"sql_queries": [{"sql": 0}]}
+        await cache.create(session)
+        now = datetime.now(timezone.utc)
+        for n in (1, 2):
+            session.qa_data["sql_queries"].append({"sql": n})
+            await cache.append_turn("s1", {"n": n}, {}, now, now, 50, qa_appends={"sql_queries": [{"sql": n}]}, qa_list_cap=2)
+        # El $set de un turno posterior absorbe los elementos añadidos después
+        await cache.append_turn("s1", {"n": 3}, {"sql_queries": [{"sql": "x"}]}, now, now, 50, qa_appends={}, qa_list_cap=2)
+        await cache.append_turn("s1", {"n": 4}, {}, now, now, 50, qa_appends={"sql_queries": [{"sql": "y"}]}, qa_list_cap=2)
+        await cache.flush()
+        return session, collection.docs["s1"]
+    session, doc = asyncio.run(run())
+    assert doc["qa_data"]["sql_queries"] == [{"sql": "x"}, {"sql": "y"}]
+    assert session.qa_data["sql_queries"] == [{"sql": 1}, {"sql": 2}] # La lista cacheada se recorta a qa_list_cap
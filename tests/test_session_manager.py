@@ -0,0 +1,78 @@
+import asyncio
+from datetime import datetime, timezone
+import pytest
+
+pytest.importorskip("pydantic")
+pytest.importorskip("pymongo")
+pytest.importorskip("fastapi_sessions")
+from session_manager import SessionData, MongoDBBackend, diff_qa_data  # noqa: E402
+
+
+class FakeCollection:
+    """
+    Colección en memoria con lo que usa MongoDBBackend: insert_one, find_one (con $slice del historial) y update_one
+    con $push/$slice, $set (también sobre qa_data.<clave>) e $inc.
+    """
+
+    def __init__(self):
+        self.docs = {}
+        self.updates = []
+
+    async def insert_one(self, doc):
+        self.docs[doc["session_id"]] = doc
+
+    async def find_one(self, query, projection=None):
+        doc = self.docs.get(query["session_id"])
+        if doc is None:
+            return None
+        doc = dict(doc)
+        if projection:
+            doc["history"] = doc["history"][projection["history"]["$slice"]:]
+        return doc
+
+    async def update_one(self, query, update):
+        self.updates.append(update)
+        doc = self.docs[query["session_id"]]
+        for key, push in update["$push"].items():
+            target, key = (doc["qa_data"], key.split(".", 1)[1]) if key.startswith("qa_data.") else (doc, key)
+            target[key] = (target.get(key, []) + push["$each"])[push["$slice"]:]
+        for key, value in update["$set"].items():
+            target, key = (doc["qa_data"], key.split(".", 1)[1]) if key.startswith("qa_data.") else (doc, key)
+            target[key] = value
+        for key, value in update.get("$inc", {}).items():
+            doc[key] = doc.get(key, 0) + value
+
+
+def new_session(session_id="s1"):
+    now = datetime.now(timezone.utc)
+    qa_data = {"sql_queries": [], "last_query": None}
+    return SessionData(session_id=session_id, history=[], qa_data=qa_data, last_active=now, expiration_time=now)
+
+
+def test_diff_qa_data_appends_new_sql_queries_and_sets_other_keys():
+    snapshot = {"sql_queries": [{"sql": "a"}], "last_query": None, "missing_fields": []}
+    qa_data = {"sql_queries": [{"sql": "a"}, {"sql": "b"}], "last_query": "tipo = 'piso'", "missing_fields": []}
+    assert diff_qa_data(snapshot, qa_data) == ({"last_query": "tipo = 'piso'"}, {"sql_queries": [{"sql": "b"}]})
+    # Si la lista no conserva el contenido anterior se escribe completa
+    assert diff_qa_data(snapshot, {"sql_queries": [{"sql": "c"}]}) == ({"sql_queries": [{"sql": "c"}]}, {})
+    assert diff_qa_data(snapshot, dict(snapshot)) == ({}, {})
+
+
+def test_append_turn_pushes_history_and_sql_queries_with_caps():
+    async def run():
+        collection = FakeCollection()
+        backend = MongoDBBackend(collection)
+        await backend.create(new_session())
+        now = datetime.now(timezone.utc)
+        for n in range(5):
+            qa_changes = {"last_query": f"tipo = '{n}'"}
+            await backend.append_turn("s1", {"n": n}, qa_changes, now, now, 4, qa_appends={"sql_queries": [{"sql": n}]}, qa_list_cap=3)
+        return collection, await backend.read("s1", history_limit=2)
+    collection, session = asyncio.run(run())
+    doc = collection.docs["s1"]
+    assert [entry["n"] for entry in doc["history"]] == [1, 2, 3, 4]
+    assert doc["qa_data"] == {"sql_queries": [{"sql": 2}, {"sql": 3}, {"sql": 4}], "last_query": "tipo = '4'"}
+    # Cada turno sólo envía lo que ha cambiado, nunca el documento ni la lista completa
+    assert collection.updates[-1]["$push"]["qa_data.sql_queries"] == {"$each": [{"sql": 4}], "$slice": -3}
+    assert "qa_data.sql_queries" not in collection.updates[-1]["$set"]
+    assert [entry["n"] for entry in session.history] == [3, 4]
@@ -0,0 +1,58 @@
+import sqlite3
+import pytest
+from src.sql_builder import SQLBuilder, parse_amount, render_literal
+from src.value_index import ValueIndex
+
+VALUES = {"tipo": ["piso", "casa"], "operacion": ["venta", "alquiler"], "poblacion": ["Madrid", "Sevilla"]}
+REQUIRED = ["tipo", "operacion", "poblacion"]
+
+
+@pytest.fixture
+def builder():
+    return SQLBuilder("inmuebles", REQUIRED + ["precio", "habitaciones"], ValueIndex(VALUES), REQUIRED)
+
+
+@pytest.mark.parametrize("number, multiplier, expected", [
+    ("200.000", None, 200000), ("200 000", None, 200000), ("1,5", "millones", 1.5e6), ("150", "k", 150000), ("900", None, 900),
+])
+def test_parse_amount(number, multiplier, expected):
+    assert parse_amount(number, multiplier) == expected
+
+
+def test_render_literal_quotes_strings():
+    assert render_literal('SELECT * FROM t WHERE a = ? AND b <= ?', ["O'Donnell", 100.0]) == "SELECT * FROM t WHERE a = 'O''Donnell' AND b <= 100.0"
+
+
+def test_structured_search_is_parameterized(builder):
+    info = builder.build("Busco un piso en venta en Madrid de 3 habitaciones por menos de 200.000 euros")
+    assert info["sql_template"] == 'SELECT * FROM "inmuebles" WHERE "tipo" = ? AND "operacion" = ? AND "poblacion" = ? AND "habitaciones" = ? AND "precio" <= ? LIMIT 3'
+    assert info["parameters"] == ["piso", "venta", "Madrid", 3, 200000.0]
+    assert info["missing_fields"] == []
+
+
+def test_ranges(builder):
+    info = builder.build("casa de alquiler en Sevilla con al menos dos habitaciones entre 500 y 900 euros")
+    assert info["parameters"] == ["casa", "alquiler", "Sevilla", 2, 500.0, 900.0]
+    assert '"habitaciones" >= ?' in info["sql_template"]
+
+
+def test_known_fields_from_previous_turns(builder):
+    info = builder.build("en Madrid", known={"tipo": "piso", "operacion": "venta"})
+    assert info["parameters"] == ["piso", "venta", "Madrid"]
+
+
+@pytest.mark.parametrize("input", [
+    "piso en venta en Madrid con piscina",  # palabra sin interpretar
+    "piso en venta",  # falta la población
+    "piso en venta en Madrid por menos de 3",  # cifra que no es un precio
+])
+def test_free_queries_go_to_the_llm(builder, input):
+    assert builder.build(input) is None
+
+
+def test_generated_sql_runs_on_sqlite(builder):
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE inmuebles (tipo TEXT, operacion TEXT, poblacion TEXT, precio REAL, habitaciones INTEGER)")
+    conn.executemany("INSERT INTO inmuebles VALUES (?, ?, ?, ?, ?)", [("piso", "venta", "Madrid", 150000, 3), ("piso", "venta", "Madrid", 250000, 3)])
+    info = builder.build("piso en venta en Madrid de 3 habitaciones hasta 200.000 euros")
+    assert conn.execute(info["sql_template"], info["parameters"]).fetchall() == [("piso", "venta", "Madrid", 150000.0, 3)]
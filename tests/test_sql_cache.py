@@ -0,0 +1,81 @@
+import os
+import time
+from src.sql_cache import LRUTTLCache, Text2SQLCache, canonicalize_sql, normalize_input
+
+
+def test_canonicalize_sorts_and_conditions_with_their_literals():
+    a = canonicalize_sql("SELECT * FROM t WHERE tipo='piso' AND poblacion='Madrid';")
+    b = canonicalize_sql("select *  from t where poblacion='Madrid' and tipo='piso'")
+    assert a == b == "select * from t where poblacion='Madrid' and tipo='piso'"
+
+
+def test_canonicalize_keeps_select_literals_in_place():
+    sql = "SELECT 'a' AS k, * FROM t WHERE tipo='piso' AND poblacion='Madrid'"
+    assert canonicalize_sql(sql) == "select 'a' as k, * from t where poblacion='Madrid' and tipo='piso'"
+
+
+def test_canonicalize_keeps_tail_literals_in_place():
+    sql = "SELECT * FROM t WHERE tipo='piso' AND poblacion='Madrid' ORDER BY estado='nuevo' LIMIT 3"
+    assert canonicalize_sql(sql) == "select * from t where poblacion='Madrid' and tipo='piso' order by estado='nuevo' limit 3"
+
+
+def test_canonicalize_distinguishes_swapped_values():
+    a = canonicalize_sql("SELECT * FROM t WHERE tipo='piso' AND poblacion='Madrid'")
+    b = canonicalize_sql("SELECT * FROM t WHERE tipo='Madrid' AND poblacion='piso'")
+    assert a != b
+
+
+def test_canonicalize_preserves_literal_case_and_quotes():
+    sql = "SELECT * FROM t WHERE poblacion='L''Hospitalet' AND tipo='Piso'"
+    assert canonicalize_sql(sql) == "select * from t where poblacion='L''Hospitalet' and tipo='Piso'"
+
+
+def test_canonicalize_does_not_reorder_or_conditions():
+    sql = "SELECT * FROM t WHERE tipo='piso' OR poblacion='Madrid'"
+    assert canonicalize_sql(sql) == "select * from t where tipo='piso' or poblacion='Madrid'"
+
+
+def test_normalize_input():
+    assert normalize_input("  ¿Busco un PISO en Málaga? ") == "busco un piso en malaga"
+
+
+def test_lru_ttl_cache_evicts_oldest_and_expired(monkeypatch):
+    cache = LRUTTLCache(max_entries=2, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1 and cache.get("c") == 3
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 11)
+    assert cache.get("a") is None
+    assert len(cache) == 1
+
+
+def test_text2sql_cache_clears_when_database_changes(tmp_path):
+    database = tmp_path / "db.sqlite"
+    database.write_bytes(b"v1")
+    cache = Text2SQLCache(str(database))
+    cache.set_result("SELECT * FROM t WHERE a='1' AND b='2'", "rows")
+    cache.set_query("Busco piso", None, {"sql_query": "SELECT 1", "missing_fields": []})
+    assert cache.get_result("select * from t where b='2' and a='1'") == "rows"
+    assert cache.get_query("busco piso", None)["sql_query"] == "SELECT 1"
+
+    database.write_bytes(b"version 2")
+    os.utime(database, ns=(time.time_ns(), time.time_ns() + 10**9))
+    assert cache.get_result("SELECT * FROM t WHERE a='1' AND b='2'") is None
+    assert cache.get_query("busco piso", None) is None
+
+
+def test_query_cache_is_not_shared_between_sessions_with_different_resolved_fields(tmp_path):
+    database = tmp_path / "db.sqlite"
+    database.write_bytes(b"v1")
+    cache = Text2SQLCache(str(database))
+    session_a = {"tipo": "casa", "operacion": "venta"}
+    session_b = {"operacion": "venta", "tipo": "piso"}
+    cache.set_query("en Madrid", None, {"sql_query": "SELECT * FROM t WHERE tipo='casa'", "missing_fields": []}, session_a)
+    assert cache.get_query("en Madrid", None, session_b) is None
+    assert cache.get_query("en Madrid", None) is None
+    # El orden de los campos no cambia la clave
+    assert cache.get_query("en madrid", None, dict(reversed(list(session_a.items()))))["sql_query"].endswith("'casa'")
@@ -0,0 +1,87 @@
+import asyncio
+import sqlite3
+import pytest
+from src.sql_executor import SQLExecutor, QueryResult
+
+SLOW_QUERY = "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT COUNT(*) FROM n"
+
+
+@pytest.fixture
+def database_path(tmp_path):
+    path = tmp_path / "inmuebles.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE inmuebles (tipo TEXT, precio REAL)")
+    conn.executemany("INSERT INTO inmuebles VALUES (?, ?)", [("piso", 100.0 * i) for i in range(10)])
+    conn.commit()
+    conn.close()
+    return str(path)
+
+
+def test_query_result_is_columnar_and_round_trips_through_summary():
+    result = QueryResult.from_rows(["tipo", "precio"], [("piso", 1.0), ("casa", 2.0)], sql="SELECT 1")
+    assert result.data == [["piso", "casa"], [1.0, 2.0]]
+    assert result.rows() == [("piso", 1.0), ("casa", 2.0)]
+    assert result.rows(limit=1) == [("piso", 1.0)]
+    summary = result.summary(max_rows=1)
+    assert summary["data"] == [["piso"], [1.0]] and summary["row_count"] == 2
+    assert QueryResult.from_summary(summary).sql == "SELECT 1"
+
+
+def test_empty_result_is_falsy():
+    result = QueryResult.from_rows(["tipo"], [])
+    assert not result and result.data == [[]]
+
+
+def test_run_reads_at_most_max_rows(database_path):
+    executor = SQLExecutor(database_path, pool_size=2, max_rows=3)
+    try:
+        result = asyncio.run(executor.run("SELECT tipo, precio FROM inmuebles WHERE precio >= ? ORDER BY precio", (0,)))
+    finally:
+        executor.close()
+    assert result.columns == ["tipo", "precio"]
+    assert result.row_count == 3 and result.truncated
+    assert result.data[1] == [0.0, 100.0, 200.0]
+
+
+def test_connections_are_read_only(database_path):
+    executor = SQLExecutor(database_path)
+    try:
+        with pytest.raises(sqlite3.OperationalError):
+            asyncio.run(executor.run("DELETE FROM inmuebles"))
+    finally:
+        executor.close()
+
+
+def test_timeout_interrupts_the_query_and_frees_the_pool(database_path):
+    async def run(executor):
+        with pytest.raises(asyncio.TimeoutError):
+            await executor.run(SLOW_QUERY, timeout=0.05)
+        # El hueco del pool y la conexión se han liberado: la siguiente consulta se ejecuta
+        return await asyncio.wait_for(executor.run("SELECT COUNT(*) FROM inmuebles"), 5)
+
+    executor = SQLExecutor(database_path, pool_size=1)
+    try:
+        assert asyncio.run(run(executor)).data == [[10]]
+    finally:
+        executor.close()
+
+
+def test_connection_released_after_close_is_closed(database_path):
+    executor = SQLExecutor(database_path)
+    conn = executor._acquire_connection()
+    executor.close()
+    # Como el _on_done de una consulta que termina después de close()
+    executor._release_connection(conn)
+    assert executor._connections.empty()
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1")
+
+
+def test_connections_use_the_configured_mmap_size(database_path):
+    executor = SQLExecutor(database_path, mmap_size=1 << 20)
+    try:
+        conn = executor._acquire_connection()
+        assert conn.execute("PRAGMA mmap_size").fetchone()[0] == 1 << 20
+        executor._release_connection(conn)
+    finally:
+        executor.close()
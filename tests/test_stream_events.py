@@ -0,0 +1,89 @@
+import asyncio
+import json
+from src.stream_events import StreamEvent, coalesce_tokens, to_ndjson, TOKEN, ROUTE, DONE, LOADING_DB_END
+
+
+async def collect(stream, **kwargs):
+    return [event async for event in coalesce_tokens(stream, **kwargs)]
+
+
+async def timed_stream(items):
+    # items: (segundos de espera antes del elemento, elemento)
+    for delay, item in items:
+        await asyncio.sleep(delay)
+        yield item
+
+
+def test_first_token_is_sent_without_waiting_for_the_second():
+    async def run():
+        events = []
+        stream = timed_stream([(0, "Hola"), (0.5, " mundo")])
+        async for event in coalesce_tokens(stream, max_chars=64, max_delay=10):
+            events.append((event, asyncio.get_running_loop().time()))
+        return events
+    loop_events = asyncio.run(run())
+    assert [event for event, _ in loop_events] == [StreamEvent(TOKEN, "Hola"), StreamEvent(TOKEN, " mundo")]
+    assert loop_events[1][1] - loop_events[0][1] >= 0.4
+
+
+def test_tokens_are_batched_by_size_and_order_is_kept():
+    async def run():
+        stream = timed_stream([(0, "a"), (0, StreamEvent(ROUTE, "qa")), (0, "b"), (0, "cd"), (0, "ef"), (0, LOADING_DB_END), (0, "g")])
+        return await collect(stream, max_chars=3, max_delay=10)
+    assert asyncio.run(run()) == [
+        StreamEvent(TOKEN, "a"),
+        StreamEvent(ROUTE, "qa"),
+        StreamEvent(TOKEN, "bcd"),
+        StreamEvent(TOKEN, "ef"),
+        LOADING_DB_END,
+        StreamEvent(TOKEN, "g"),
+    ]
+
+
+def test_batch_is_flushed_when_max_delay_expires_without_new_tokens():
+    async def run():
+        received = []
+        stream = timed_stream([(0, "a"), (0, "b"), (1.0, "c")])
+        async for event in coalesce_tokens(stream, max_chars=64, max_delay=0.05):
+            received.append(event)
+            if event == StreamEvent(TOKEN, "b"):
+                # "b" llega por el temporizador, mucho antes que "c"
+                received.append("before c")
+        return received
+    assert asyncio.run(run()) == [StreamEvent(TOKEN, "a"), StreamEvent(TOKEN, "b"), "before c", StreamEvent(TOKEN, "c")]
+
+
+def test_empty_tokens_are_skipped():
+    async def run():
+        return await collect(timed_stream([(0, ""), (0, StreamEvent(TOKEN, "")), (0, "x")]))
+    assert asyncio.run(run()) == [StreamEvent(TOKEN, "x")]
+
+
+def test_closing_the_stream_cancels_the_pending_read():
+    async def run():
+        cancelled = asyncio.Event()
+
+        async def slow_stream():
+            yield "a"
+            try:
+                await asyncio.sleep(10)
+                yield "b"
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        events = coalesce_tokens(slow_stream(), max_delay=0.01)
+        assert await events.__anext__() == StreamEvent(TOKEN, "a")
+        pending = asyncio.ensure_future(events.__anext__())
+        await asyncio.sleep(0.05)
+        pending.cancel()
+        await asyncio.gather(pending, return_exceptions=True)
+        await events.aclose()
+        await asyncio.wait_for(cancelled.wait(), 1)
+    asyncio.run(run())
+
+
+def test_to_ndjson_is_one_json_object_per_line():
+    frame = to_ndjson(StreamEvent(DONE, {"route": "qa", "texto": "ñ"}))
+    assert frame.endswith("\n") and frame.count("\n") == 1
+    assert json.loads(frame) == {"type": "done", "data": {"route": "qa", "texto": "ñ"}}
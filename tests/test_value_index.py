@@ -0,0 +1,48 @@
+from src.value_index import ValueIndex, normalize_value, singular_forms
+
+VALUES = {
+    "tipo": ["Piso", "Casa", "Local", "Ático"],
+    "operacion": ["venta", "alquiler"],
+    "poblacion": ["Madrid", "Sevilla", "San Sebastián de los Reyes"],
+}
+
+
+def test_normalize_value_removes_accents_case_and_punctuation():
+    assert normalize_value("  ÁTICO, en Málaga! ") == "atico en malaga"
+
+
+def test_singular_forms():
+    assert {"pisos", "piso"} <= singular_forms("pisos")
+    assert "local" in singular_forms("locales")
+
+
+def test_resolve_exact_plural_synonym_and_multiword_values():
+    index = ValueIndex(VALUES)
+    assert index.resolve("Quiero comprar pisos en San Sebastián de los Reyes") == {
+        "tipo": "Piso", "operacion": "venta", "poblacion": "San Sebastián de los Reyes"
+    }
+    assert index.resolve("alquilar un ático") == {"operacion": "alquiler", "tipo": "Ático"}
+
+
+def test_resolve_tolerates_typos():
+    assert ValueIndex(VALUES).resolve("casa en Sevila") == {"tipo": "Casa", "poblacion": "Sevilla"}
+
+
+def test_synonyms_require_the_value_in_the_database():
+    index = ValueIndex({"tipo": ["Piso"], "operacion": ["venta"]})
+    assert index.resolve("quiero alquilar") == {}
+
+
+def test_missing_fields_uses_known_values():
+    index = ValueIndex(VALUES)
+    assert index.missing_fields("busco piso") == ["operacion", "poblacion"]
+    assert index.missing_fields("en venta", known={"tipo": "Piso"}) == ["poblacion"]
+
+
+def test_unknown_words_flags_unrecognised_values_only():
+    index = ValueIndex(VALUES)
+    assert index.unknown_words("Busco un piso en venta en Madrid") == []
+    assert index.unknown_words("quiero un piso de 3 habitaciones") == []
+    # Población ausente de la base de datos o con una errata que el índice no alcanza
+    assert index.unknown_words("busco piso en Torrelodones") == ["torrelodones"]
+    assert index.unknown_words("piso en Mdrd") == ["mdrd"]
@@ -0,0 +1,39 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+faiss = pytest.importorskip("faiss")
+pytest.importorskip("langchain_community")
+from src.vector_index import build_faiss_index, PQ_MIN_TRAINING_POINTS  # noqa: E402
+
+
+def random_vectors(n, dimension=32, seed=0):
+    return np.random.default_rng(seed).random((n, dimension), dtype=np.float32)
+
+
+@pytest.mark.parametrize("n", [1, 20, 100, PQ_MIN_TRAINING_POINTS - 1])
+def test_ivfpq_falls_back_to_ivf_below_training_minimum(n):
+    vectors = random_vectors(n)
+    index = build_faiss_index(vectors, "ivfpq", pq_m=8)
+    assert index.ntotal == n
+    assert isinstance(faiss.extract_index_ivf(index), faiss.IndexIVFFlat)
+    _, ids = index.search(vectors[:1], 1)
+    assert ids[0][0] == 0
+
+
+def test_ivfpq_is_built_with_enough_vectors():
+    vectors = random_vectors(PQ_MIN_TRAINING_POINTS * 2)
+    index = build_faiss_index(vectors, "ivfpq", pq_m=8)
+    assert index.ntotal == len(vectors)
+    assert isinstance(faiss.extract_index_ivf(index), faiss.IndexIVFPQ)
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf", "hnsw"])
+def test_small_corpora_build_for_every_index_type(index_type):
+    vectors = random_vectors(10)
+    index = build_faiss_index(vectors, index_type)
+    assert index.ntotal == 10
+
+
+def test_unknown_index_type_is_rejected():
+    with pytest.raises(ValueError):
+        build_faiss_index(random_vectors(10), "lsh")
@@ -0,0 +1,66 @@
+import asyncio
+import time
+import pytest
+from src.warmup import Warmup, READY, RETRYING, FAILED
+
+
+def test_components_run_in_parallel_and_report_progress():
+    async def run(warmup):
+        async def coroutine():
+            await asyncio.sleep(0.2)
+            return "chains"
+        return await asyncio.gather(warmup.run("chains", coroutine), warmup.run("index", time.sleep, 0.2))
+
+    warmup = Warmup()
+    warmup.register("chains")
+    warmup.register("index")
+    assert warmup.status()["progress"] == "0/2" and not warmup.ready
+    start = time.perf_counter()
+    assert asyncio.run(run(warmup)) == ["chains", None]
+    assert time.perf_counter() - start < 0.35
+    warmup.finish()
+    status = warmup.status()
+    assert status["ready"] and not status["failed"] and status["progress"] == "2/2"
+    assert all(component["status"] == READY for component in status["components"].values())
+
+
+def test_required_failures_raise_and_optional_failures_are_recorded():
+    def fail():
+        raise RuntimeError("mongo down")
+
+    warmup = Warmup(retry_initial=0.01, max_attempts=2)
+    warmup.register("ttl_index", required=False)
+    assert asyncio.run(warmup.run("ttl_index", fail)) is None
+    assert warmup.components["ttl_index"]["status"] == FAILED and not warmup.failed
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(warmup.run("chains", fail))
+    assert warmup.failed and warmup.components["chains"]["error"] == "mongo down"
+    assert warmup.components["chains"]["attempts"] == 2
+    assert warmup.components["ttl_index"]["attempts"] == 1 # Los componentes opcionales no se reintentan
+
+
+def test_readiness_recovers_after_a_transient_failure():
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ConnectionError("openai timeout")
+        return "qa_chain"
+
+    async def run(warmup):
+        task = asyncio.create_task(warmup.run("qa_chain", flaky))
+        while warmup.components["qa_chain"]["status"] != RETRYING:
+            await asyncio.sleep(0.001)
+        assert not warmup.ready and warmup.status()["progress"] == "0/1"
+        result = await task
+        warmup.finish()
+        return result
+
+    warmup = Warmup(retry_initial=0.01, retry_max=0.02)
+    warmup.register("qa_chain")
+    assert asyncio.run(run(warmup)) == "qa_chain"
+    component = warmup.components["qa_chain"]
+    assert component["status"] == READY and component["attempts"] == 3 and component["error"] is None
+    assert warmup.ready and not warmup.failed